@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+"""
+用保存的页面检查两个解析后端的结果是否完全一致：
+python -m aio.parser_parity [fixtures 目录]
+"""
+import os
+import sys
+import warnings
+
+from aio import weibo_parser, weibo_parser_lxml
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'fixtures')
+
+# 页面文件名前缀 -> (解析函数名, 除页面内容外的参数)
+FIXTURES = {
+    'timeline': ('parse_user_tweet', ('1000000001',)),
+    'search': ('parse_search', ()),
+    'follow': ('parse_follow', ()),
+    'info': ('parse_user_info', ('1000000001',)),
+    'homepage': ('parse_view', ()),
+    'comment': ('parse_comments', ('HaAAAAAA3', None, True)),
+    'repost': ('parse_repost', ('HsSSSSSS2', 'HoOOOOOO1', True)),
+}
+
+# 个人主页同时用于取 uid
+EXTRA_PARSERS = {
+    'homepage': [('parse_home_page_user_id', ())],
+}
+
+
+def load_fixtures(path=FIXTURE_PATH):
+    """
+    :return: [(文件名, 页面 bytes, 解析函数名, 参数)]，文件名为 <前缀>.html 或 <前缀>_<序号>.html
+    """
+    pages = []
+    for file_name in sorted(os.listdir(path)):
+        kind = file_name.split('.')[0].split('_')[0]
+        if not file_name.endswith('.html') or kind not in FIXTURES:
+            continue
+        with open(os.path.join(path, file_name), 'rb') as f:
+            content = f.read()
+        for parser_name, args in [FIXTURES[kind]] + EXTRA_PARSERS.get(kind, []):
+            pages.append((file_name, content, parser_name, args))
+    return pages
+
+
+def compare(content, parser_name, args):
+    expected = getattr(weibo_parser, parser_name)(content.decode('utf-8'), *args)
+    actual = getattr(weibo_parser_lxml, parser_name)(content, *args)
+    if repr(expected) != repr(actual):
+        # “n 分钟前”按当前时间计算，两次解析跨过一秒时重新比较一次
+        expected = getattr(weibo_parser, parser_name)(content.decode('utf-8'), *args)
+    return expected, actual
+
+
+def check(path=FIXTURE_PATH):
+    """
+    :return: 结果不一致的 [(文件名, 解析函数名, bs4 结果, lxml 结果)]
+    """
+    mismatches = []
+    for file_name, content, parser_name, args in load_fixtures(path):
+        expected, actual = compare(content, parser_name, args)
+        # 比较 repr，字段顺序和类型也要一致
+        if repr(expected) != repr(actual):
+            mismatches.append((file_name, parser_name, expected, actual))
+    return mismatches
+
+
+if __name__ == '__main__':
+    # weibo.cn 页面带 xml 声明，新版 bs4 会对每个页面警告一次
+    warnings.filterwarnings('ignore', message='.*HTML parser to parse an XML document')
+    fixture_path = sys.argv[1] if len(sys.argv) > 1 else FIXTURE_PATH
+    pages = load_fixtures(fixture_path)
+    if not pages:
+        print('no fixture pages in %s' % fixture_path)
+        sys.exit(1)
+    mismatches = check(fixture_path)
+    for file_name, parser_name, expected, actual in mismatches:
+        print('%s %s:\n  bs4:  %r\n  lxml: %r' % (file_name, parser_name, expected, actual))
+    print('%d pages, %d mismatches' % (len(pages), len(mismatches)))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,307 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import time
+from collections import Counter
+from enum import Enum
+
+import aioredis
+
+from aio.weibo_redis import RedisCookie
+from setting import LOGGER, ACCOUNT_REQUESTS_PER_MINUTE, ACCOUNT_BURST, ACCOUNT_HEALTH_ALPHA, \
+    ACCOUNT_HEALTH_THRESHOLD, ACCOUNT_COOLDOWN, ACCOUNT_MAX_STRIKES, ACCOUNT_RELEASE_INTERVAL, ACCOUNT_WAIT_INTERVAL, \
+    ACCOUNT_WAIT_TIMEOUT
+
+
+class TokenBucket(object):
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: 每秒补充的令牌数
+        :param capacity: 桶容量
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now):
+        """
+        还要等多久才有一个令牌（秒）
+        """
+        self._refill(now)
+        return max(0, (1 - self.tokens) / self.rate)
+
+
+class AccountScheduler(object):
+    """
+    按账号限速分配 cookie：每个账号一个令牌桶，只有令牌桶允许时才分配这个账号，
+    所有账号都没有令牌时协程等待最早可用的账号，而不是过度使用某一个账号。
+    接口和 RedisCookie 相同，可以直接替换
+    """
+
+    def __init__(self, cookie_pool, **kwargs):
+        """
+        :param cookie_pool: LocalCookiePool
+        """
+        self.cookie_pool = cookie_pool
+        rpm = kwargs['requests_per_minute'] if 'requests_per_minute' in kwargs else ACCOUNT_REQUESTS_PER_MINUTE
+        self._rate = rpm / 60
+        self._burst = kwargs['burst'] if 'burst' in kwargs else ACCOUNT_BURST
+        self._buckets = {}
+        # 每个账号的使用次数
+        self.usage = Counter()
+        # 因为没有可用账号而等待的总时长（秒）
+        self.wait_seconds = 0
+
+    def _bucket(self, user_name):
+        bucket = self._buckets.get(user_name)
+        if bucket is None:
+            bucket = self._buckets[user_name] = TokenBucket(self._rate, self._burst)
+        return bucket
+
+    def _acquire(self, accounts):
+        """
+        按最久未使用的顺序找一个有令牌的账号
+        :return: (cookies, 没有可用账号时需要等待的秒数)
+        """
+        now = time.monotonic()
+        wait = None
+        for user_name in accounts:
+            bucket = self._bucket(user_name)
+            if bucket.try_acquire(now):
+                self.usage[user_name] += 1
+                self.cookie_pool.touch(user_name)
+                return accounts[user_name], 0
+            bucket_wait = bucket.wait_time(now)
+            wait = bucket_wait if wait is None else min(wait, bucket_wait)
+        return None, wait
+
+    async def fetch_cookies(self):
+        while True:
+            accounts = await self.cookie_pool.accounts()
+            if not accounts:
+                LOGGER.warn('cookies not get')
+                return None
+            cookies, wait = self._acquire(accounts)
+            if cookies:
+                return cookies
+            self.wait_seconds += wait
+            await asyncio.sleep(wait)
+
+    def stats(self):
+        """
+        :return: user_name -> {'used': 使用次数, 'tokens': 剩余令牌}
+        """
+        now = time.monotonic()
+        result = {}
+        for user_name, bucket in self._buckets.items():
+            bucket._refill(now)
+            result[user_name] = {'used': self.usage[user_name], 'tokens': round(bucket.tokens, 2)}
+        return result
+
+    async def close(self):
+        LOGGER.info('account usage: %s, waited %.1fs for free accounts' % (dict(self.usage), self.wait_seconds))
+        await self.cookie_pool.close()
+
+
+# 正常页面的结构：内容区块 class="c" 或顶部导航 class="n"。账号被限制时返回的空页面两者都没有；
+# 没有搜索结果、没有微博、评论被删除的页面仍然有导航，交给解析函数当作 0 行处理，不算账号的问题
+PAGE_MARKERS = ('class="c"', 'class="n"')
+PAGE_MARKERS_BYTES = tuple(marker.encode('utf-8') for marker in PAGE_MARKERS)
+
+
+class Outcome(Enum):
+    ok = 'ok'
+    # 被重定向到登录页，cookie 已失效
+    login = 'login'
+    # 4xx/5xx 等错误页面
+    error = 'error'
+    # 没有任何内容的页面，一般是账号被限制
+    empty = 'empty'
+    timeout = 'timeout'
+
+
+class AccountError(Exception):
+    """
+    账号返回了登录页、错误页或空页面，页面内容不可用，任务需要换账号重试
+    """
+
+    def __init__(self, user_name, outcome, url):
+        super().__init__('%s got %s page: %s' % (user_name, outcome.value, url))
+        self.user_name = user_name
+        self.outcome = outcome
+
+
+class NoAccountError(Exception):
+    """
+    所有账号都在冷却或下线，等待 ACCOUNT_WAIT_TIMEOUT 秒后仍然没有可用账号。
+    这是账号池的状态，不是任务本身的问题，任务放回重试队列时不计重试次数
+    """
+
+
+async def wait_for_cookies(cookie_source, interval=ACCOUNT_WAIT_INTERVAL, timeout=ACCOUNT_WAIT_TIMEOUT):
+    """
+    从 RedisCookie、LocalCookiePool 或 AccountScheduler 取 cookie，没有可用账号时等待冷却的账号放回
+    :raise NoAccountError: 超过 timeout 秒仍然没有可用账号
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        cookies = await cookie_source.fetch_cookies()
+        if cookies:
+            return cookies
+        if time.monotonic() >= deadline:
+            raise NoAccountError('no account available after %ds' % timeout)
+        await asyncio.sleep(interval)
+
+
+# 把冷却结束的账号放回 users 集合，并通知各节点刷新 cookie 池
+RELEASE_ACCOUNTS_SCRIPT = """
+local users = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1])
+for _, user in ipairs(users) do
+    redis.call('sadd', KEYS[2], user)
+    redis.call('zrem', KEYS[1], user)
+    redis.call('publish', ARGV[2], user)
+end
+return users
+"""
+
+
+class AccountHealth(object):
+    """
+    账号健康度：根据每次请求的结果（登录页、错误页、空页面、超时）给账号打分，
+    分数过低的账号从 users 集合移到冷却有序集合，冷却结束后再放回；
+    多次冷却或者 cookie 失效的账号下线，放入 account:relogin 等待 redis_cookies.py 重新登录
+    """
+    _pool = None
+    cooldown_key = 'account:cooldown'
+    strikes_key = 'account:strikes'
+    relogin_key = 'account:relogin'
+
+    def __init__(self, cookie_pool=None, **kwargs):
+        """
+        :param cookie_pool: LocalCookiePool，账号冷却或下线时立即从中移除
+        """
+        self.cookie_pool = cookie_pool
+        self._host = kwargs['host'] if 'host' in kwargs else 'redis://localhost:6378'
+        self._db = kwargs['db'] if 'db' in kwargs else 0
+        self._alpha = kwargs['alpha'] if 'alpha' in kwargs else ACCOUNT_HEALTH_ALPHA
+        self._threshold = kwargs['threshold'] if 'threshold' in kwargs else ACCOUNT_HEALTH_THRESHOLD
+        self._cooldown = kwargs['cooldown'] if 'cooldown' in kwargs else ACCOUNT_COOLDOWN
+        self._max_strikes = kwargs['max_strikes'] if 'max_strikes' in kwargs else ACCOUNT_MAX_STRIKES
+        self.scores = {}
+        self.outcomes = Counter()
+        # 本进程已经让其冷却或下线的账号 -> 到期时间，避免还在进行中的请求重复处理
+        self._benched = {}
+        # 有冷却记录的账号，恢复健康后清除
+        self._struck = set()
+
+    async def init_pool(self):
+        self._pool = await aioredis.create_pool(self._host, db=self._db, minsize=1, maxsize=5)
+
+    @staticmethod
+    def classify(status, url, html):
+        if 'login' in url or 'passport' in url:
+            return Outcome.login
+        if status >= 400:
+            return Outcome.error
+        markers = PAGE_MARKERS_BYTES if isinstance(html, bytes) else PAGE_MARKERS
+        if not any(marker in html for marker in markers):
+            return Outcome.empty
+        return Outcome.ok
+
+    async def report(self, user_name, outcome):
+        """
+        记录一次请求的结果
+        :return: 账号状态 ok, cooldown, retired
+        """
+        self.outcomes[outcome] += 1
+        if self._benched.get(user_name, 0) > time.time():
+            return 'ok' if outcome is Outcome.ok else 'cooldown'
+        if outcome is Outcome.login:
+            await self.retire(user_name)
+            return 'retired'
+        score = self.scores.get(user_name, 1.0) * (1 - self._alpha)
+        if outcome is Outcome.ok:
+            score += self._alpha
+        self.scores[user_name] = score
+        if score < self._threshold:
+            return await self.cool_down(user_name)
+        if outcome is Outcome.ok and user_name in self._struck and score > 1 - self._alpha:
+            self._struck.discard(user_name)
+            await self._execute('hdel', self.strikes_key, user_name)
+        return 'ok'
+
+    async def _execute(self, *args):
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            return await conn.execute(*args)
+
+    async def cool_down(self, user_name):
+        # _bench 会清除账号的分数，先取出来写日志
+        score = self.scores.get(user_name, 0.0)
+        self._bench(user_name, time.time() + self._cooldown)
+        strikes = await self._execute('hincrby', self.strikes_key, user_name, 1)
+        if strikes >= self._max_strikes:
+            await self.retire(user_name)
+            return 'retired'
+        self._struck.add(user_name)
+        until = time.time() + self._cooldown * 2 ** (strikes - 1)
+        self._benched[user_name] = until
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            await asyncio.gather(conn.execute('zadd', self.cooldown_key, until, user_name),
+                                 conn.execute('srem', 'users', user_name),
+                                 conn.execute('publish', RedisCookie.invalidate_channel, user_name))
+        LOGGER.warn('account %s cool down for %ds (score %.2f, strike %d)' %
+                    (user_name, until - time.time(), score, strikes))
+        return 'cooldown'
+
+    async def retire(self, user_name):
+        self._bench(user_name, time.time() + self._cooldown)
+        self._struck.discard(user_name)
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            await asyncio.gather(conn.execute('zrem', self.cooldown_key, user_name),
+                                 conn.execute('srem', 'users', user_name),
+                                 conn.execute('hdel', self.strikes_key, user_name),
+                                 conn.execute('sadd', self.relogin_key, user_name),
+                                 conn.execute('publish', RedisCookie.invalidate_channel, user_name))
+        LOGGER.error('account %s retired, waiting for relogin' % user_name)
+
+    def _bench(self, user_name, until):
+        self._benched[user_name] = until
+        self.scores.pop(user_name, None)
+        if self.cookie_pool is not None:
+            self.cookie_pool.remove(user_name)
+
+    async def release_cooled_accounts(self, interval=ACCOUNT_RELEASE_INTERVAL):
+        """
+        定时把冷却结束的账号放回 users 集合
+        """
+        while True:
+            users = await self._execute('eval', RELEASE_ACCOUNTS_SCRIPT, 2, self.cooldown_key, 'users',
+                                        time.time(), RedisCookie.invalidate_channel)
+            for user in users:
+                LOGGER.info('account %s back from cool down' % user.decode('utf-8'))
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        LOGGER.info('account outcomes: %s' % ', '.join('%s=%d' % (o.value, n) for o, n in self.outcomes.items()))
+        if self._pool:
+            self._pool.close()
+            await self._pool.wait_closed()
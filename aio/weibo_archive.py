@@ -0,0 +1,316 @@
+# -*- coding:utf-8 -*-
+"""
+抓取页面的归档：grab_html 下载的每个响应（url、抓取时间、账号、状态码、页面内容）压缩后追加写入分段文件，
+每个分段有一个 json lines 索引。解析出错修复以后，不用重新抓取，直接用归档重新解析：
+python -m aio.weibo_archive ARCHIVE_PATH -o records.jsonl [-p 进程数] [--backend lxml] [--kafka]
+
+分段文件 <前缀>-<序号>.seg 中每条记录为 4 字节长度 + zlib(json 头 + '\\n' + 页面)，
+索引 <前缀>-<序号>.idx 每行是一条记录的 json 头加上 offset、length，只有写完的记录才会写入索引
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from aio import weibo_parser, weibo_parser_lxml, weibo_tweet
+from setting import LOGGER, ARCHIVE_SEGMENT_SIZE, ARCHIVE_COMPRESS_LEVEL, PARSER_PROCESSES
+
+LENGTH = struct.Struct('>I')
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+# 重新解析时第一遍先解析这些页面，用来补全其他页面的结果
+LOOKUP_PARSERS = ('parse_home_page_user_id', 'parse_view')
+
+
+class ArchiveWriter(object):
+    """
+    追加写入归档，压缩和写文件在单独的线程中按顺序执行，不阻塞事件循环。
+    每个进程使用自己的前缀（主机名-进程号），多个爬虫进程可以写同一个目录
+    """
+
+    def __init__(self, path, loop=None, **kwargs):
+        self.path = path
+        self.loop = loop or asyncio.get_event_loop()
+        self._segment_size = kwargs['segment_size'] if 'segment_size' in kwargs else ARCHIVE_SEGMENT_SIZE
+        self._level = kwargs['compress_level'] if 'compress_level' in kwargs else ARCHIVE_COMPRESS_LEVEL
+        self._prefix = kwargs['prefix'] if 'prefix' in kwargs else '%s-%d' % (socket.gethostname(), os.getpid())
+        self._executor = ThreadPoolExecutor(1)
+        self._sequence = self._last_sequence()
+        self._segment = None
+        self._index = None
+        self.written = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _last_sequence(self):
+        if not os.path.isdir(self.path):
+            return 0
+        sequences = [int(file_name[len(self._prefix) + 1:-len(SEGMENT_SUFFIX)]) for file_name in os.listdir(self.path)
+                     if file_name.startswith(self._prefix + '-') and file_name.endswith(SEGMENT_SUFFIX)]
+        return max(sequences) if sequences else 0
+
+    def _open_segment(self):
+        """
+        每次启动和分段写满时新建一个分段，不往已有的分段里追加
+        """
+        self._close_segment()
+        self._sequence += 1
+        name = os.path.join(self.path, '%s-%06d' % (self._prefix, self._sequence))
+        self._segment = open(name + SEGMENT_SUFFIX, 'ab')
+        self._index = open(name + INDEX_SUFFIX, 'a')
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = self._index = None
+
+    def _append(self, header, body):
+        if self._segment is None or self._segment.tell() >= self._segment_size:
+            self._open_segment()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        data = zlib.compress(json.dumps(header).encode('utf-8') + b'\n' + body, self._level)
+        offset = self._segment.tell()
+        self._segment.write(LENGTH.pack(len(data)) + data)
+        self._segment.flush()
+        entry = dict(header, offset=offset, length=len(data))
+        self._index.write(json.dumps(entry) + '\n')
+        self._index.flush()
+        self.written += 1
+
+    async def write(self, url, account, status, body, parser=None, args=()):
+        """
+        :param parser: 页面对应的解析函数名，重新解析时使用
+        :param args: 解析函数除页面内容外的参数
+        """
+        header = {'url': url, 'time': time.time(), 'account': account, 'status': status,
+                  'parser': parser, 'args': list(args)}
+        await self.loop.run_in_executor(self._executor, self._append, header, body)
+
+    async def close(self):
+        await self.loop.run_in_executor(self._executor, self._close_segment)
+        self._executor.shutdown()
+        LOGGER.info('archive closed, %d pages written' % self.written)
+
+
+def list_segments(path):
+    """
+    :return: 归档目录中的 [(分段文件, 索引文件)]
+    """
+    segments = []
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith(SEGMENT_SUFFIX):
+            name = os.path.join(path, file_name[:-len(SEGMENT_SUFFIX)])
+            if os.path.exists(name + INDEX_SUFFIX):
+                segments.append((name + SEGMENT_SUFFIX, name + INDEX_SUFFIX))
+    return segments
+
+
+def read_index(index_file):
+    entries = []
+    with open(index_file) as f:
+        for line in f:
+            # 进程被杀时最后一行可能不完整
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+    return entries
+
+
+def read_pages(segment_file, entries):
+    """
+    按索引读取页面
+    :return: 生成 (json 头, 页面 bytes)
+    """
+    with open(segment_file, 'rb') as f:
+        for entry in entries:
+            f.seek(entry['offset'] + LENGTH.size)
+            header, body = zlib.decompress(f.read(entry['length'])).split(b'\n', 1)
+            yield json.loads(header.decode('utf-8')), body
+
+
+def iter_chunks(path, parsers, chunk_size):
+    """
+    只读索引，把要解析的页面按 chunk_size 分组，交给进程池
+    :return: 生成 (分段文件, [索引])
+    """
+    for segment_file, index_file in list_segments(path):
+        chunk = []
+        for entry in read_index(index_file):
+            if entry['status'] == 200 and entry['parser'] in parsers:
+                chunk.append(entry)
+                if len(chunk) >= chunk_size:
+                    yield segment_file, chunk
+                    chunk = []
+        if chunk:
+            yield segment_file, chunk
+
+
+def site_of(url):
+    parts = urlsplit(url)
+    return '%s://%s' % (parts.scheme, parts.netloc)
+
+
+def absolute_url(home_page_url, page_url):
+    """
+    和 WeiboCnSpider.resolve_user_id 一样补全个人主页的相对路径
+    """
+    return home_page_url if home_page_url.startswith('http') else site_of(page_url) + home_page_url
+
+
+# 子进程中使用的解析后端和第一遍得到的 {'homepage': {url: uid}, 'view': {url: 主页统计}}
+_backend = None
+_lookups = None
+
+
+def _init_worker(backend, lookups):
+    global _backend, _lookups
+    _backend = weibo_parser_lxml if backend == 'lxml' else weibo_parser
+    _lookups = lookups
+
+
+def _parse(header, body):
+    # 相对时间按抓取时间计算
+    weibo_tweet.set_clock(header['time'])
+    return getattr(_backend, header['parser'])(body if _backend is weibo_parser_lxml else body.decode('utf-8'),
+                                               *header['args'])
+
+
+def _parse_lookups(chunk):
+    segment_file, entries = chunk
+    homepages, views = {}, {}
+    for header, body in read_pages(segment_file, entries):
+        try:
+            result = _parse(header, body)
+        except Exception as e:
+            LOGGER.error('parse %s failed: %s' % (header['url'], e))
+            continue
+        if header['parser'] == 'parse_home_page_user_id':
+            homepages[header['url']] = result
+        elif result:
+            views[header['url']] = result
+    return homepages, views
+
+
+def _resolve(record, page_url):
+    """
+    用第一遍解析的个人主页补全 HomePage，归档中没有的保留个人主页的 url
+    """
+    if record:
+        for key, value in record.items():
+            if isinstance(value, weibo_parser.HomePage):
+                url = absolute_url(value.url, page_url)
+                record[key] = _lookups['homepage'].get(url) or url
+    return record
+
+
+def to_records(header, result):
+    """
+    和 WeiboCnSpider 中各个任务发送到 kafka 的记录一致，只产生记录，不产生新任务
+    """
+    parser, url = header['parser'], header['url']
+    if parser in ('parse_search', 'parse_user_tweet'):
+        return [_resolve(tweet, url) for tweet in result['tweets']]
+    if parser == 'parse_comments':
+        records = [_resolve(comment, url) for comment in result['comments']]
+        return records + ([_resolve(result['tweet'], url)] if result['tweet'] else [])
+    if parser == 'parse_repost':
+        return [_resolve(result['tweet'], url)] if result['tweet'] else []
+    if parser == 'parse_user_info' and result:
+        # 用户资料和个人主页上的统计是分开抓取的，用同一个 uid 的个人主页合并
+        result.update(_lookups['view'].get(site_of(url) + '/' + str(header['args'][0])) or {})
+        return [result]
+    return []
+
+
+def _parse_records(chunk):
+    segment_file, entries = chunk
+    records, errors = [], 0
+    for header, body in read_pages(segment_file, entries):
+        try:
+            records.extend(to_records(header, _parse(header, body)))
+        except Exception as e:
+            errors += 1
+            LOGGER.error('parse %s failed: %s' % (header['url'], e))
+    return len(entries), records, errors
+
+
+def reparse(path, emit, processes=PARSER_PROCESSES, backend='lxml', chunk_size=200):
+    """
+    多进程重新解析整个归档，不访问网络
+    :param emit: 每条记录调用一次
+    :return: (页面数, 记录数, 解析失败的页面数)
+    """
+    processes = processes or 1
+    lookups = {'homepage': {}, 'view': {}}
+    with multiprocessing.Pool(processes, _init_worker, (backend, lookups)) as pool:
+        for homepages, views in pool.imap_unordered(_parse_lookups, iter_chunks(path, LOOKUP_PARSERS, chunk_size)):
+            lookups['homepage'].update(homepages)
+            lookups['view'].update(views)
+
+    record_parsers = ('parse_search', 'parse_user_tweet', 'parse_comments', 'parse_repost', 'parse_user_info')
+    pages = records = errors = 0
+    with multiprocessing.Pool(processes, _init_worker, (backend, lookups)) as pool:
+        for page_count, chunk_records, chunk_errors in pool.imap_unordered(
+                _parse_records, iter_chunks(path, record_parsers, chunk_size)):
+            pages += page_count
+            errors += chunk_errors
+            for record in chunk_records:
+                emit(record)
+            records += len(chunk_records)
+    return pages, records, errors
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='re-parse archived weibo.cn pages')
+    arg_parser.add_argument('path', help='归档目录')
+    arg_parser.add_argument('-o', '--output', help='记录写入 json lines 文件')
+    arg_parser.add_argument('--kafka', action='store_true', help='记录重新发送到 kafka')
+    arg_parser.add_argument('-p', '--processes', type=int, default=os.cpu_count(), help='解析进程数')
+    arg_parser.add_argument('--backend', default='lxml', choices=('lxml', 'bs4'), help='解析后端')
+    arg_parser.add_argument('--chunk-size', type=int, default=200, help='每个子任务解析的页面数')
+    args = arg_parser.parse_args()
+    if not args.output and not args.kafka:
+        arg_parser.error('one of --output and --kafka is required')
+
+    outputs = []
+    if args.output:
+        output_file = open(args.output, 'w', encoding='utf-8')
+        outputs.append(lambda record: output_file.write(json.dumps(record, ensure_ascii=False) + '\n'))
+    if args.kafka:
+        from kafka import KafkaProducer
+        producer = KafkaProducer(bootstrap_servers=['localhost:9092'],
+                                 value_serializer=lambda msg: json.dumps(msg).encode('utf-8'))
+        outputs.append(lambda record: producer.send(topic='sinaweibo', value=record))
+
+    def emit(record):
+        for output in outputs:
+            output(record)
+
+    start = time.time()
+    try:
+        pages, records, errors = reparse(args.path, emit, args.processes, args.backend, args.chunk_size)
+    finally:
+        if args.output:
+            output_file.close()
+        if args.kafka:
+            producer.flush()
+            producer.close()
+    elapsed = time.time() - start
+    LOGGER.info('%d pages, %d records, %d errors in %.1fs (%.1f pages/sec)' %
+                (pages, records, errors, elapsed, pages / elapsed if elapsed else 0))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# -*- coding:utf-8 -*-
+import hashlib
+import math
+import struct
+
+import aioredis
+from pybloom import ScalableBloomFilter
+
+from setting import LOGGER, DEDUP_BACKEND, DEDUP_CAPACITY, DEDUP_ERROR_RATE
+
+# 每个元素 k 个 bit 位一组，SETBIT 返回旧值，有任意一位原来是 0 就说明是新元素
+BLOOM_ADD_SCRIPT = """
+local k = tonumber(ARGV[1])
+local result = {}
+for i = 0, (#ARGV - 1) / k - 1 do
+    local added = 0
+    for j = 2 + i * k, 1 + (i + 1) * k do
+        if redis.call('setbit', KEYS[1], ARGV[j], 1) == 0 then
+            added = 1
+        end
+    end
+    result[i + 1] = added
+end
+return result
+"""
+
+BLOOM_CONTAINS_SCRIPT = """
+local k = tonumber(ARGV[1])
+local result = {}
+for i = 0, (#ARGV - 1) / k - 1 do
+    local found = 1
+    for j = 2 + i * k, 1 + (i + 1) * k do
+        if redis.call('getbit', KEYS[1], ARGV[j]) == 0 then
+            found = 0
+            break
+        end
+    end
+    result[i + 1] = found
+end
+return result
+"""
+
+
+class LocalBloomFilter(object):
+    """
+    进程内的布隆过滤器，和 RedisBloomFilter 接口相同
+    """
+
+    def __init__(self):
+        self._filter = ScalableBloomFilter(mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+
+    async def add(self, item):
+        return (await self.add_many([item]))[0]
+
+    async def add_many(self, items):
+        """
+        :return: 每个元素是否是新加入的
+        """
+        result = []
+        for item in items:
+            if item in self._filter:
+                result.append(False)
+            else:
+                self._filter.add(item)
+                result.append(True)
+        return result
+
+    async def contains_many(self, items):
+        return [item in self._filter for item in items]
+
+    async def fill_ratio(self):
+        return len(self._filter) / self._filter.capacity
+
+    async def close(self):
+        pass
+
+
+class RedisBloomFilter(object):
+    """
+    存在 redis bitmap 中的布隆过滤器，所有节点共用，重启也不会丢失。
+    检查和写入在一个 lua 脚本中完成，一批元素只需要一次 round trip
+    """
+    _pool = None
+
+    def __init__(self, key, **kwargs):
+        self.key = key
+        self._host = kwargs['host'] if 'host' in kwargs else 'redis://localhost:6378'
+        self._db = kwargs['db'] if 'db' in kwargs else 1
+        self._minsize = kwargs['minsize'] if 'minsize' in kwargs else 1
+        self._maxsize = kwargs['maxsize'] if 'maxsize' in kwargs else 5
+        capacity = kwargs['capacity'] if 'capacity' in kwargs else DEDUP_CAPACITY
+        error_rate = kwargs['error_rate'] if 'error_rate' in kwargs else DEDUP_ERROR_RATE
+        # redis bitmap 最大 2^32 位
+        self.num_bits = min(2 ** 32, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+
+    async def init_pool(self):
+        LOGGER.info("init redis bloom filter %s (bits: %d, hashes: %d)" % (self.key, self.num_bits, self.num_hashes))
+        self._pool = await aioredis.create_pool(
+            self._host, db=self._db,
+            minsize=self._minsize, maxsize=self._maxsize)
+
+    def _offsets(self, item):
+        if not isinstance(item, bytes):
+            item = str(item).encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(item).digest())
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    async def _eval(self, script, items):
+        if not items:
+            return []
+        if not self._pool:
+            await self.init_pool()
+        args = [self.num_hashes]
+        for item in items:
+            args.extend(self._offsets(item))
+        with await self._pool as conn:
+            result = await conn.execute('eval', script, 1, self.key, *args)
+        return [flag == 1 for flag in result]
+
+    async def add(self, item):
+        return (await self.add_many([item]))[0]
+
+    async def add_many(self, items):
+        """
+        :return: 每个元素是否是新加入的
+        """
+        return await self._eval(BLOOM_ADD_SCRIPT, items)
+
+    async def contains_many(self, items):
+        return await self._eval(BLOOM_CONTAINS_SCRIPT, items)
+
+    async def fill_ratio(self):
+        """
+        已置位的 bit 比例，超过 0.5 说明误判率已经明显高于设定值，需要扩容
+        """
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            bits = await conn.execute('bitcount', self.key)
+        return bits / self.num_bits
+
+    async def close(self):
+        if self._pool:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+
+def create_filter(key, backend=DEDUP_BACKEND, **kwargs):
+    if backend == 'redis':
+        return RedisBloomFilter(key, **kwargs)
+    return LocalBloomFilter()
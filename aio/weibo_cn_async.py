@@ -1,22 +1,34 @@
 # -*- coding:utf-8 -*-
 import asyncio
-import datetime
 import json
 import re
+import signal
 import sys
 import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from time import sleep
 
-import aiohttp
 import async_timeout
 import urllib3
-from bs4 import BeautifulSoup
 from kafka import KafkaProducer
-from pybloom import ScalableBloomFilter
 
-from aio.weibo_redis import RedisCookie, RedisJob
-from setting import LOGGER
+from aio.weibo_archive import ArchiveWriter
+from aio.weibo_account import AccountScheduler, AccountHealth, AccountError, NoAccountError, Outcome, wait_for_cookies
+from aio.weibo_bloom import create_filter
+from aio.weibo_flight import SingleFlight
+from aio.weibo_job_codec import JobCodec, url_templates
+from aio.weibo_scheduler import RecrawlScheduler, USER, COMMENT
+from aio import weibo_parser, weibo_parser_lxml
+from aio.weibo_kafka import BatchProducer
+from aio import weibo_tweet
+from aio.weibo_redis import RedisCookie, RedisJob, LocalCookiePool, HomePageCache, PageCursor, \
+    TimelineWatermark
+from aio.weibo_session import SessionPool
+from aio.weibo_workers import WorkerPool
+from setting import LOGGER, KAFKA_SINK, COOKIE_POOL, ACCOUNT_REQUESTS_PER_MINUTE, PARSER_PROCESSES, PARSER_BACKEND, \
+    ARCHIVE_PATH, FETCH_COALESCE, ROW_CONCURRENCY, PAGINATION, TIMELINE_INCREMENTAL, WORKER_MODE, DRAIN_TIMEOUT, \
+    STATS_INTERVAL, JOB_CODEC
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -28,10 +40,12 @@ class WeiboProcuder:
                                       value_serializer=lambda msg: json.dumps(msg).encode('utf-8'))
 
     async def send(self, msg, url):
-        LOGGER.info(url)
-        LOGGER.info('send type: %s, id: %s, (%s)' % (msg['type'], msg['id'], str(msg)))
+        LOGGER.debug('send type: %s, id: %s, (%s)', msg['type'], msg['id'], url)
         self.producer.send(topic=self.topic, value=msg)
-        LOGGER.info('send successful.')
+
+    async def close(self):
+        self.producer.flush()
+        self.producer.close()
 
 
 class JobType(Enum):
@@ -44,383 +58,241 @@ class JobType(Enum):
 
 
 class WeiboCnSpider:
-    def __init__(self, tasks=2, loop=None):
+    def __init__(self, tasks=2, loop=None, **kwargs):
+        """
+        :param kwargs: weibo_host 抓取的站点，redis_host redis 地址，weibo_producer 替换 kafka 的发送对象，
+            requests_per_minute 每个账号每分钟的请求数；压测时指向本地的模拟服务；
+            archive_path 页面归档目录，默认 ARCHIVE_PATH；
+            retry_base_delay、retry_move_interval 失败任务的重试等待和检查间隔，见 RedisJob
+        """
         self.tasks = tasks
         self.loop = loop or asyncio.get_event_loop()
-        self.redis_cookie = RedisCookie()
-        self.redis_job = RedisJob()
-        self.bloom_filter = ScalableBloomFilter(mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        self.weibo_host = kwargs['weibo_host'] if 'weibo_host' in kwargs else 'https://weibo.cn'
+        redis_kwargs = {'host': kwargs['redis_host']} if 'redis_host' in kwargs else {}
+        requests_per_minute = kwargs['requests_per_minute'] if 'requests_per_minute' in kwargs \
+            else ACCOUNT_REQUESTS_PER_MINUTE
+        self.cookie_pool = LocalCookiePool(**redis_kwargs) if COOKIE_POOL == 'local' else None
+        if self.cookie_pool is None:
+            self.redis_cookie = RedisCookie(**redis_kwargs)
+        elif requests_per_minute:
+            self.redis_cookie = AccountScheduler(self.cookie_pool, requests_per_minute=requests_per_minute)
+        else:
+            self.redis_cookie = self.cookie_pool
+        self.account_health = AccountHealth(cookie_pool=self.cookie_pool, **redis_kwargs)
+        # 任务中的 url 按本站点的模板编码
+        retry_kwargs = {key: kwargs[key] for key in ('retry_base_delay', 'retry_move_interval') if key in kwargs}
+        self.redis_job = RedisJob(codec=JobCodec(self.weibo_host, compact=JOB_CODEC == 'compact'),
+                                  **retry_kwargs, **redis_kwargs)
+        self.session_pool = SessionPool()
+        # 同一个 url 的并发下载只请求一次，比如热门评论者的个人主页、同一条微博的评论和转发任务
+        self.flight = SingleFlight(loop=self.loop) if FETCH_COALESCE else None
+        self.bloom_filter = create_filter('bloom:user', **redis_kwargs)
+        self.homepage_cache = HomePageCache(**redis_kwargs)
+        # cursor 模式下用户微博和评论的分页任务一页一页地放入队列
+        self.pagination = kwargs['pagination'] if 'pagination' in kwargs else PAGINATION
+        self.page_cursor = PageCursor(**redis_kwargs)
+        # cursor 模式下用户微博只抓到上次抓过的位置
+        self.timeline_incremental = kwargs['timeline_incremental'] if 'timeline_incremental' in kwargs \
+            else TIMELINE_INCREMENTAL
+        self.watermark = TimelineWatermark(**redis_kwargs)
+        self.scheduler = RecrawlScheduler(**redis_kwargs)
+        self.worker_mode = kwargs['worker_mode'] if 'worker_mode' in kwargs else WORKER_MODE
+        self.worker_pool = None
+        # 取任务的协程（不包括后台维护协程），停止时等它们处理完手上的任务
+        self.crawl_workers = []
+        self.draining = False
+        # 任务类型 -> 完成数、进入重试的数量
+        self.jobs_done = Counter()
+        self.jobs_failed = Counter()
         self.weibo_limit = True
-        self.time_current_pattern = re.compile(r'(\d*)分钟前')
-        self.time_today_pattern = re.compile(r'今天\s*(\d*):(\d*)')
-        self.time_year_pattern = re.compile(r'(\d*)月(\d*)日\s*(\d*):(\d*)')
-        self.user_id_pattern = re.compile(r'https://weibo.cn/u/(\d*)')
-        self.weibo_host = 'https://weibo.cn'
-        self.follow_url = self.weibo_host + '/%s/follow'
+        # 解析页面的进程池，PARSER_PROCESSES 为 0 时在事件循环线程内解析
+        self.executor = ProcessPoolExecutor(PARSER_PROCESSES) if PARSER_PROCESSES else None
+        # lxml 后端直接解析响应的 bytes，不需要先解码
+        self.parser = weibo_parser_lxml if PARSER_BACKEND == 'lxml' else weibo_parser
+        self.raw_html = PARSER_BACKEND == 'lxml'
+        # 任务 url 的模板和 JobCodec 共用，编码后的任务取出时按同样的模板拼出 url
+        templates = url_templates(self.weibo_host)
+        self.follow_url, self.follow_url2 = templates['follower']
 
         self.fan_url = self.weibo_host + '/%s/fans'
         self.user_info_url = self.weibo_host + '/%s/info'
-        self.user_tweet_url = self.weibo_host + '/%s'
-        self.user_tweet_url2 = self.weibo_host + '/%s?page=%d'
-        self.user_repost_url = self.weibo_host + '/repost/%s'
-        self.user_repost_url2 = self.weibo_host + '/repost/%s?page=%d'
-        self.tweet_comment_url = self.weibo_host + '/comment/%s'
-        self.tweet_comment_url2 = self.weibo_host + '/comment/%s?page=%d'
-        self.weibo_producer = WeiboProcuder(['localhost:9092'], 'sinaweibo')
-        self.search_url = 'https://weibo.cn/search/?pos=search'
-        self.get_search_url = 'https://weibo.cn/search/mblog/?keyword=%s&filter=hasori'
+        self.user_tweet_url, self.user_tweet_url2 = templates['tweet']
+        self.tweet_page_pattern = re.compile(re.escape(self.weibo_host) + r'/(\d*)\?page=(\d*)')
+        self.user_repost_url, self.user_repost_url2 = templates['repost']
+        self.tweet_comment_url, self.tweet_comment_url2 = templates['comment']
+        if 'weibo_producer' in kwargs:
+            self.weibo_producer = kwargs['weibo_producer']
+        elif KAFKA_SINK == 'batch':
+            self.weibo_producer = BatchProducer(['localhost:9092'], 'sinaweibo', loop=self.loop)
+        else:
+            self.weibo_producer = WeiboProcuder(['localhost:9092'], 'sinaweibo')
+        archive_path = kwargs['archive_path'] if 'archive_path' in kwargs else ARCHIVE_PATH
+        self.archive = ArchiveWriter(archive_path, loop=self.loop) if archive_path else None
+        self.search_url = self.weibo_host + '/search/?pos=search'
+        self.get_search_url = self.weibo_host + '/search/mblog/?keyword=%s&filter=hasori'
 
-    async def crawl_follow(self):
-        while True:
-            follow_dict = await self.redis_job.fetch_job(JobType.follower.value)
-            if follow_dict:
+    async def run_job(self, job_type, job_info, handler):
+        """
+        执行一个任务，失败的任务交给重试队列延后再执行，不阻塞事件循环。
+        不管成功还是进入重试，最后都 ack 掉原来的任务；停止时被取消的任务放回重试队列后继续取消
+        """
+        try:
+            await handler(job_info)
+            self.jobs_done[job_type] += 1
+        except asyncio.CancelledError:
+            LOGGER.warn('%s job cancelled, requeue: %s' % (job_type, str(job_info)))
+            await self.retry_job(job_type, job_info)
+            raise
+        except NoAccountError as e:
+            LOGGER.warn('%s, requeue %s job: %s' % (e, job_type, str(job_info)))
+            await self.retry_job(job_type, job_info, attempt=False)
+        except (TimeoutError, asyncio.TimeoutError):
+            LOGGER.warn('%s job timeout: %s' % (job_type, str(job_info)))
+            self.jobs_failed[job_type] += 1
+            await self.retry_job(job_type, job_info)
+        except:
+            LOGGER.error(traceback.format_exc())
+            self.jobs_failed[job_type] += 1
+            await self.retry_job(job_type, job_info)
+        finally:
+            await self.redis_job.ack(job_info)
+
+    async def retry_job(self, job_type, job_info, attempt=True):
+        """
+        任务放入重试队列，游标任务超过最大重试次数进入死信队列时同时删除它的检查点
+        """
+        if not await self.redis_job.retry_job(job_type, job_info, attempt=attempt) and 'page' in job_info:
+            if job_type == JobType.tweet.value:
+                await self.page_cursor.abandon(job_type, job_info['uid'], job_info['page'])
+            elif job_type == JobType.comment.value:
+                await self.page_cursor.abandon(job_type, job_info['tweetId'], job_info['page'])
 
-                try:
-                    await self.grab_follow(follow_dict)
-                except TimeoutError as e:
-                    pass
-                except:
-                    LOGGER.error(traceback.format_exc())
-                    sleep(5 * 60)
+    async def crawl_follow(self):
+        async for job_type, follow_dict in self.redis_job.jobs(JobType.follower.value):
+            await self.run_job(job_type, follow_dict, self.grab_follow)
 
     async def grab_follow(self, follow_dict):
         LOGGER.info('start grab user follow: %s' % str(follow_dict))
-        html_content = await self.grab_html(self.follow_url % follow_dict['uid'])
-        follow_html = BeautifulSoup(html_content, "lxml")
-        all_td = follow_html.find_all('td', style=True)
-        for td in all_td:
-            a = td.find('a').get('href')
-            usr_id_result = self.user_id_pattern.findall(a)
-            if usr_id_result:
-                usr_id = usr_id_result[0]
-            else:
-                usr_id = await self.get_user_id_from_homepage(a)
-            public_user = td.parent.find_all('img', src='https://h5.sinaimg.cn/upload/2016/05/26/319/5338.gif')
-            if not public_user:
-                enterprise_user = td.parent.find_all('img', src='https://h5.sinaimg.cn/upload/2016/05/26/319/5337.gif')
-                if not enterprise_user:
-                    await self.user_id_in_queue(usr_id)
-                else:
-                    LOGGER.info('%s passed' % usr_id)
-            else:
-                LOGGER.info('%s passed' % usr_id)
-        if 'page=' not in follow_dict['url']:
+        result = await self.grab_page(follow_dict['url'], 'parse_follow')
 
-            page_div = follow_html.find(id='pagelist')
-            if page_div:
-                max_page = int(page_div.input.get('value'))
-                for page in range(2, max_page + 1):
-                    await self.redis_job.push_job(JobType.follower.value,
-                                                  {'url': (self.follow_url % follow_dict['uid']) + '?page=' + str(page),
-                                                   'uid': follow_dict['uid']})
+        async def follow_user(user):
+            usr_id, followable = user
+            if followable:
+                await self.user_id_in_queue(await self.resolve_user_id(usr_id))
+            else:
+                LOGGER.info('%s passed' % str(usr_id))
+        await self.gather_rows(follow_user, result['users'])
+        if 'page=' not in follow_dict['url'] and result['max_page']:
+            await self.redis_job.push_jobs(JobType.follower.value,
+                                           [{'url': self.follow_url2 % (follow_dict['uid'], page),
+                                             'uid': follow_dict['uid']} for page in range(2, result['max_page'] + 1)])
 
     async def crawl_comment(self):
-        while True:
-            comment_job_info = await self.redis_job.fetch_job(JobType.comment.value)
-            if comment_job_info:
-                try:
-                    # asyncio.run_coroutine_threadsafe(self.grab_tweet_comments(comment_job_info), self.loop)
-                    await self.grab_tweet_comments(comment_job_info)
-                except TimeoutError as e:
-                    pass
-                except:
-                    LOGGER.error("something error")
-                    LOGGER.error(traceback.format_exc())
-                    sleep(5 * 60)
+        async for job_type, comment_job_info in self.redis_job.jobs(JobType.comment.value):
+            await self.run_job(job_type, comment_job_info, self.grab_tweet_comments)
 
     async def crawl_repost(self):
-        while True:
-            repost_job_info = await self.redis_job.fetch_job(JobType.repost.value)
-            if repost_job_info:
-                try:
-                    await self.grab_tweet_repost(repost_job_info)
-                except TimeoutError as e:
-                    pass
-                except:
-                    LOGGER.error("something error")
-                    LOGGER.error(traceback.format_exc())
-                    sleep(5 * 60)
+        async for job_type, repost_job_info in self.redis_job.jobs(JobType.repost.value):
+            await self.run_job(job_type, repost_job_info, self.grab_tweet_repost)
 
     async def crawl_weibo(self):
-        r = re.compile(r'https://weibo.cn/(\d*)\?page=(\d*)')
-        while True:
-            tweet_job_info = await self.redis_job.fetch_job(JobType.tweet.value)
-            if tweet_job_info:
-                m = r.findall(tweet_job_info['url'])
-                if m:
-                    page_no = int(m[0][1])
-                    if page_no > 200:
-                        LOGGER.info('job passed %s' % str(tweet_job_info))
-                        continue
-                # if 'page=' in tweet_job_info['url']:
-                #     LOGGER.info('job passed %s' % str(tweet_job_info))
-                #     continue
-
-                try:
-                    await self.grab_user_tweet(tweet_job_info)
-                except TimeoutError as e:
-                    pass
-                except:
-                    LOGGER.error(traceback.format_exc())
-                    sleep(5 * 60)
+        async for job_type, tweet_job_info in self.redis_job.jobs(JobType.tweet.value):
+            await self.run_job(job_type, tweet_job_info, self.grab_weibo)
+
+    async def grab_weibo(self, tweet_job_info):
+        # 游标任务没有 url，页数上限在 advance_cursor 中处理
+        m = self.tweet_page_pattern.findall(tweet_job_info.get('url', ''))
+        if m:
+            page_no = int(m[0][1])
+            if page_no > 200:
+                LOGGER.info('job passed %s' % str(tweet_job_info))
+                return
+        # if 'page=' in tweet_job_info['url']:
+        #     LOGGER.info('job passed %s' % str(tweet_job_info))
+        #     return
+
+        await self.grab_user_tweet(tweet_job_info)
 
     async def search(self):
-        while True:
-            search_job_info = await self.redis_job.fetch_job(JobType.search.value)
-            if search_job_info:
-                try:
-                    await self.search_tweet(search_job_info)
-                except TimeoutError as e:
-                    pass
-                except:
-                    LOGGER.error(traceback.format_exc())
-                    sleep(5 * 60)
+        async for job_type, search_job_info in self.redis_job.jobs(JobType.search.value):
+            await self.run_job(job_type, search_job_info, self.search_tweet)
 
     async def crawl_user(self):
-        while True:
-            user_job_info = await self.redis_job.fetch_job(JobType.user.value)
-            if user_job_info:
-                try:
-                    # asyncio.run_coroutine_threadsafe(self.grab_user_info(user_job_info['user_id']), self.loop)
-                    await self.grab_user_info(user_job_info['user_id'])
-                    # await self.redis_job.push_job(JobType.tweet.value,
-                    #                               {'url': 'https://weibo.cn/' + user_job_info['user_id'],
-                    #                                'uid': user_job_info['user_id']})
-
-                    # await self.redis_job.push_job(JobType.follower.value,
-                    #                               {'url': self.follow_url % user_job_info['user_id'],
-                    #                                'uid': user_job_info['user_id']})
-                    # self.weibo_queue.put({'url': self.user_tweet_url % user_id, 'uid': user_id})
-                    # self.follow_queue.put({'uid': user_id, 'url': self.follow_url % user_id})
-                except TimeoutError as e:
-                    pass
-                except:
-                    LOGGER.error(traceback.format_exc())
-                    sleep(5 * 60)
+        async for job_type, user_job_info in self.redis_job.jobs(JobType.user.value):
+            await self.run_job(job_type, user_job_info, lambda job: self.grab_user_info(job['user_id']))
 
     async def search_tweet(self, search_job_info):
-        html_content = await self.grab_html(search_job_info['url'])
-
-        result_html = BeautifulSoup(html_content, "lxml")
-        if 'page' not in search_job_info['url']:
-            total_count_str = result_html.find(text=re.compile(r'共\d*条'))
-            print(total_count_str)
-            total_count_result = re.findall(r'共(\d*)条', total_count_str)
-            if total_count_result:
-                total_count = total_count_result[0]
-                total_page = int(total_count) / 10
-                for page_no in range(2, int(total_page)):
-                    await self.redis_job.push_job(JobType.search.value, {
-                        'url': search_job_info['url'] + '&page=' + str(page_no)
-                    })
-
-        tweet_divs = result_html.find_all(id=True, class_='c')
-        for tweet_div in tweet_divs:
-            tweet = {}
-            nk_div = tweet_div.find('a', class_='nk')
-            if nk_div:
-                nk_url = nk_div.get('href')
-                usr_id_result = self.user_id_pattern.findall(nk_url)
-                if usr_id_result:
-                    usr_id = usr_id_result[0]
-                else:
-                    usr_id = await self.get_user_id_from_homepage(nk_url)
-            else:
-                usr_id = 'unknown'
-            if tweet_div.find(class_='cmt', string='转发理由:'):  # 转发
-                tweet['flag'] = '转发'
-                parent = tweet_div.find(class_='cmt', string='转发理由:').parent
-                try:
-                    comment_href = tweet_div.find_all('div')[-2].find('a', class_='cc').get('href')
-
-                    href = comment_href.split('?')[0]
-                    tweet['sourceTid'] = href.split('/')[-1]
-
-                except Exception:
-                    pass
-                text = parent.get_text()
-                fields = text.split('\xa0')
-
-                content = fields[0][5:]
-                ct_content = parent.find('span', class_='ct').get_text()
-                time_source = ct_content.split('\u6765\u81ea')
-
-                time = time_source[0]
-                if len(time_source) == 2:
-                    source = time_source[1]
-                else:
-                    source = 'unknown'
-                other = ';'.join(fields[1:])
-
-            else:
-                tweet['flag'] = '原创'
-                text = tweet_div.get_text()
-                ct_content = tweet_div.find('span', class_='ct').get_text()
-                time_source = ct_content.split('\u6765\u81ea')
-
-                time = time_source[0]
-                if len(time_source) == 2:
-                    source = time_source[1]
-                else:
-                    source = 'unknown'
-                fields = text.split('\u200b')
-                content = fields[0]
-                other_fields = fields[-1].split('\xa0')
-                other = ';'.join(other_fields[1:])
-
-            like = re.findall(u'\u8d5e\[(\d+)\];', other)  # 点赞数
-            transfer = re.findall(u'\u8f6c\u53d1\[(\d+)\];', other)  # 转载数
-            comment = re.findall(u'\u8bc4\u8bba\[(\d+)\];', other)  # 评论数
-            tweet['content'] = content.strip()
-            tweet['id'] = tweet_div.get('id').strip('M_')
-            tweet['time'] = self.get_time(str(time))
-            tweet['source'] = source
-            tweet['like'] = like[0] if like else -1
-            tweet['transfer'] = transfer[0] if transfer else -1
-            tweet['comment'] = comment[0] if comment else -1
-            tweet['type'] = 'tweet_info'
-            tweet['uid'] = usr_id
-            print(tweet)
+        result = await self.grab_page(search_job_info['url'], 'parse_search')
+        if 'page' not in search_job_info['url'] and result['max_page']:
+            await self.redis_job.push_jobs(JobType.search.value, [{
+                'url': search_job_info['url'] + '&page=' + str(page_no)
+            } for page_no in range(2, result['max_page'] + 1)])
+
+        tweet_jobs, comment_jobs = [], []
+        await self.gather_rows(self.resolve_record, result['tweets'])
+        for tweet in result['tweets']:
             await self.weibo_producer.send(tweet, search_job_info['url'])
-            await self.redis_job.push_job(JobType.tweet.value,
-                                          {'url': self.user_tweet_url % tweet['id'],
-                                           'uid': usr_id})
-            await self.redis_job.push_job(JobType.comment.value,
-                                          {'url': self.tweet_comment_url % tweet['id'],
-                                           'tweetId': tweet['id']})
+            tweet_jobs.append({'url': self.user_tweet_url % tweet['id'], 'uid': tweet['uid']})
+            comment_jobs.append({'url': self.tweet_comment_url % tweet['id'], 'tweetId': tweet['id']})
+        await self.redis_job.push_jobs(JobType.tweet.value, tweet_jobs)
+        await self.redis_job.push_jobs(JobType.comment.value, comment_jobs)
 
     async def grab_user_tweet(self, tweet_job_info):
         LOGGER.info('start grab tweet: %s' % str(tweet_job_info))
-        html_content = await self.grab_html(tweet_job_info['url'])
-
-        user_tweet_html = BeautifulSoup(html_content, "lxml")
-        tweet_divs = user_tweet_html.find_all(id=True, class_='c')
-        for tweet_div in tweet_divs:
-            tweet = {}
-            if tweet_div.find(class_='cmt', string='转发理由:'):  # 转发
-                tweet['flag'] = '转发'
-                parent = tweet_div.find(class_='cmt', string='转发理由:').parent
-                try:
-                    comment_href = tweet_div.find_all('div')[-2].find('a', class_='cc').get('href')
-
-                    href = comment_href.split('?')[0]
-                    tweet['sourceTid'] = href.split('/')[-1]
-
-                except Exception:
-                    pass
-                text = parent.get_text()
-                fields = text.split('\xa0')
-
-                content = fields[0][5:]
-                ct_content = parent.find('span', class_='ct').get_text()
-                time_source = ct_content.split('\u6765\u81ea')
-
-                time = time_source[0]
-                if len(time_source) == 2:
-                    source = time_source[1]
-                else:
-                    source = 'unknown'
-                other = ';'.join(fields[1:])
-
+        uid = tweet_job_info['uid']
+        checkpoint = None
+        if 'page' in tweet_job_info:
+            checkpoint = await self.check_cursor(JobType.tweet.value, uid, tweet_job_info)
+            if checkpoint is None:
+                return
+            url = self.user_tweet_url2 % (uid, tweet_job_info['page'])
+        else:
+            url = tweet_job_info['url']
+        result = await self.grab_page(url, 'parse_user_tweet', uid)
+        for tweet in result['tweets']:
+            await self.weibo_producer.send(tweet, url)
+
+        if self.pagination == 'cursor':
+            if checkpoint is not None or 'page=' not in url:
+                await self.advance_timeline(uid, tweet_job_info, checkpoint, result)
+        elif 'page=' not in tweet_job_info['url'] and result['max_page']:
+            max_page = result['max_page']
+            if self.weibo_limit:
+                max_page = max_page if max_page < 500 else 500
+            await self.redis_job.push_jobs(JobType.tweet.value,
+                                           [{'url': self.user_tweet_url2 % (tweet_job_info['uid'], page),
+                                             'uid': tweet_job_info['uid']} for page in range(2, max_page + 1)])
+
+    async def advance_timeline(self, uid, tweet_job_info, checkpoint, result):
+        """
+        用户微博的游标分页。增量模式下第一页取出上次的水位（since），翻到 since 以前的微博就停止，
+        本次看到的最新微博（newest）随检查点保存，分页结束后才更新水位，中途中断不会漏掉中间的微博
+        """
+        state = {}
+        if self.timeline_incremental:
+            if checkpoint is None:
+                since = await self.watermark.get(uid)
+                state = {'since': since, 'newest': since}
             else:
-                tweet['flag'] = '原创'
-                text = tweet_div.get_text()
-                ct_content = tweet_div.find('span', class_='ct').get_text()
-                time_source = ct_content.split('\u6765\u81ea')
-
-                time = time_source[0]
-                if len(time_source) == 2:
-                    source = time_source[1]
-                else:
-                    source = 'unknown'
-                fields = text.split('\u200b')
-                content = fields[0]
-                other_fields = fields[-1].split('\xa0')
-                other = ';'.join(other_fields[1:])
-
-            like = re.findall(u'\u8d5e\[(\d+)\];', other)  # 点赞数
-            transfer = re.findall(u'\u8f6c\u53d1\[(\d+)\];', other)  # 转载数
-            comment = re.findall(u'\u8bc4\u8bba\[(\d+)\];', other)  # 评论数
-            tweet['content'] = content.strip()
-            tweet['id'] = tweet_div.get('id')
-            tweet['time'] = self.get_time(str(time))
-            tweet['source'] = source
-            tweet['like'] = like[0] if like else -1
-            tweet['transfer'] = transfer[0] if transfer else -1
-            tweet['comment'] = comment[0] if comment else -1
-            tweet['type'] = 'tweet_info'
-            tweet['uid'] = tweet_job_info['uid']
-
-            await self.weibo_producer.send(tweet, tweet_job_info['url'])
-            # 获取评论
-            # self.comment_queue.put({'url': self.tweet_comment_url % tweet['id'][2:],
-            #                         'tweetId': tweet['id'][2:]})
-
-        if 'page=' not in tweet_job_info['url']:
-            page_div = user_tweet_html.find(id='pagelist')
-            if page_div:
-                max_page = int(page_div.input.get('value'))
-                if self.weibo_limit:
-                    max_page = max_page if max_page < 500 else 500
-                for page in range(2, max_page + 1):
-                    await self.redis_job.push_job(JobType.tweet.value,
-                                                  {'url': self.user_tweet_url2 % (tweet_job_info['uid'], page),
-                                                   'uid': tweet_job_info['uid']})
+                state = {'since': checkpoint.get('since'), 'newest': checkpoint.get('newest')}
+            state['newest'] = weibo_tweet.newest_tweet(result['tweets'], state['newest'])
+            await self.scheduler.watch_tweets(uid, result['tweets'], state['since'])
+        reached = self.timeline_incremental and weibo_tweet.reached_mark(result['tweets'], state['since'])
+        # 和 crawl_weibo 一致，超过 200 页的不抓取
+        finished = await self.advance_cursor(JobType.tweet.value, uid, tweet_job_info.get('page', 1),
+                                             tweet_job_info.get('max_page', result['max_page']), result['tweets'],
+                                             limit=200, reached=reached, state=state)
+        if finished and state.get('newest') and state['newest'] != state['since']:
+            LOGGER.info('timeline of %s crawled up to %s' % (uid, state['newest']['time']))
+            await self.watermark.set(uid, state['newest'])
+        if finished and self.timeline_incremental:
+            # 关注列表中的用户有新微博时缩短重新抓取的间隔
+            await self.scheduler.observe(USER, uid, state['newest'] != state['since'])
 
     async def grab_user_info(self, user_id):
         LOGGER.info('start grab user info: %s' % user_id)
-        html_content = await self.grab_html(self.user_info_url % user_id)
-        user_info_html = BeautifulSoup(html_content, "lxml")
-        div_list = list(user_info_html.find_all(class_=['c', 'tip']))
-
-        base_info_index, edu_info_index, work_info_index = -1, -1, -1
-        base_info = ''
-        edu_info = ''
-        work_info = ''
-        tags = ''
-        user_info = {}
-        for index, div in enumerate(div_list):
-            text = div.text
-            if text == u'基本信息':
-                base_info_index = index
-            elif text == u'学习经历':
-                edu_info_index = index
-            elif text == u'工作经历':
-                work_info_index = index
-        if base_info_index != -1:
-            b = div_list[base_info_index + 1]
-            tags = ','.join(map(lambda a: a.get_text(), b.find_all('a')))
-            base_info = b.get_text(';')
-        if edu_info_index != -1:
-            edu_info = div_list[edu_info_index + 1].get_text(';')
-
-        if work_info_index != -1:
-            work_info = div_list[work_info_index + 1].get_text(';')
-        base_info += ';'
-        nickname = re.findall(u'\u6635\u79f0[:|\uff1a](.*?);', base_info)  # 昵称
-        if nickname:
-            user_info['nickname'] = nickname[0] if nickname else 'unknown'
-            gender = re.findall(u'\u6027\u522b[:|\uff1a](.*?);', base_info)  # 性别
-            place = re.findall(u'\u5730\u533a[:|\uff1a](.*?);', base_info)  # 地区（包括省份和城市）
-            signature = re.findall(u'\u7b80\u4ecb[:|\uff1a](.*?);', base_info)  # 个性签名
-            birthday = re.findall(u'\u751f\u65e5[:|\uff1a](.*?);', base_info)  # 生日
-            sex_orientation = re.findall(u'\u6027\u53d6\u5411[:|\uff1a](.*?);', base_info)  # 性取向
-            marriage = re.findall(u'\u611f\u60c5\u72b6\u51b5[:|\uff1a](.*?);', base_info)  # 婚姻状况
-            head_url = user_info_html.find('img', alt='头像')
-            if head_url:
-                user_info['head'] = head_url.get('src')
-            user_info['tags'] = tags
-            user_info['gender'] = gender[0] if gender else 'unknown'
-            user_info['place'] = place[0] if place else 'unknown'
-            user_info['signature'] = signature[0] if signature else 'unknown'
-            user_info['birthday'] = birthday[0] if birthday else 'unknown'
-            user_info['sexOrientation'] = sex_orientation[0] if sex_orientation else 'unknown'
-            user_info['eduInfo'] = edu_info if edu_info else 'unknown'
-            user_info['marriage'] = marriage[0] if marriage else 'unknown'
-            user_info['workInfo'] = work_info if work_info else 'unknown'
-
-            user_info['type'] = 'user_info'
-            user_info['id'] = user_id
+        user_info = await self.grab_page(self.user_info_url % user_id, 'parse_user_info', user_id)
+        if user_info:
             result = await self.grab_view(user_id)
             user_info.update(result)
             await self.weibo_producer.send(user_info, self.user_info_url % user_id)
@@ -432,49 +304,28 @@ class WeiboCnSpider:
         :return: dict
         """
         LOGGER.info('grab user view: %s' % str(user_id))
-        html_content = await self.grab_html(self.weibo_host + '/' + str(user_id))
-        home_page_html = BeautifulSoup(html_content, "lxml")
-        v = home_page_html.find('div', class_='tip2')
-        result = {}
-        if v:
-            content = v.get_text(';')
-        else:
-            content = ''
-        tweet_r = re.findall('微博\[(\d+)\];', content)
-        result['tweetNum'] = tweet_r[0] if tweet_r else -1
-        fans_r = re.findall('粉丝\[(\d+)\];', content)
-        result['fansNum'] = fans_r[0] if fans_r else -1
-        follow_r = re.findall('关注\[(\d+)\];', content)
-        result['followNum'] = follow_r[0] if follow_r else -1
-        return result
+        return await self.grab_page(self.weibo_host + '/' + str(user_id), 'parse_view')
 
     def get_time(self, time_str):
-        current_result = self.time_current_pattern.findall(time_str)
-        time_now = datetime.datetime.now()
-        if current_result:
-            result_time = time_now - datetime.timedelta(minutes=int(current_result[0]))
-            return result_time.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            current_result = self.time_today_pattern.findall(time_str)
-            if current_result:
-                result_time = datetime.datetime(time_now.year, time_now.month,
-                                                time_now.day, int(current_result[0][0]), int(current_result[0][0]))
-                return result_time.strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                current_result = self.time_year_pattern.findall(time_str)
-                if current_result:
-                    result_time = datetime.datetime(time_now.year, int(current_result[0][0]),
-                                                    int(current_result[0][1]), int(current_result[0][2]),
-                                                    int(current_result[0][3]))
-                    return result_time.strftime('%Y-%m-%d %H:%M:%S')
-                else:
-                    return time_str
+        return weibo_parser.get_time(time_str)
+
+    async def parse(self, parser, *args):
+        """
+        在进程池中执行解析函数，没有配置进程池时直接在当前线程解析
+        """
+        if self.executor is None:
+            return parser(*args)
+        return await self.loop.run_in_executor(self.executor, parser, *args)
 
     @staticmethod
-    async def grab_html2(session, url):
+    async def grab_response(session, url, raw=False):
+        """
+        :param raw: 返回响应的 bytes
+        :return: (状态码, 重定向后的 url, 页面内容)
+        """
         with async_timeout.timeout(60):
             async with session.get(url, verify_ssl=False) as response:
-                return await response.text()
+                return response.status, str(response.url), await (response.read() if raw else response.text())
 
     async def post_grab2(self, session, url, data):
         with async_timeout.timeout(2 * 60):
@@ -482,192 +333,367 @@ class WeiboCnSpider:
                 return await response.text()
 
     async def post_grab(self, url, data):
-        cookies = await self.redis_cookie.fetch_cookies()
-        async with aiohttp.ClientSession(cookies=cookies['cookies']) as session:
-            return await self.post_grab2(session, url, data)
+        cookies = await wait_for_cookies(self.redis_cookie)
+        entry = self.session_pool.acquire(cookies)
+        try:
+            return await self.post_grab2(entry.session, url, data)
+        finally:
+            self.session_pool.release(entry)
+
+    async def grab_page(self, url, parser_name, *args):
+        """
+        下载页面并用 parser_name 对应的解析函数解析
+        """
+        html_content = await self.grab_html(url, parser_name, args)
+        return await self.parse(getattr(self.parser, parser_name), html_content, *args)
 
-    async def grab_html(self, url):
-        cookies = await self.redis_cookie.fetch_cookies()
-        async with aiohttp.ClientSession(cookies=cookies['cookies']) as session:
-            return await self.grab_html2(session, url)
+    async def grab_html(self, url, parser_name=None, args=()):
+        """
+        下载页面，同一个 url 正在下载时等待同一个结果
+        :param parser_name: 页面对应的解析函数名，和参数 args 一起写入归档，用于离线重新解析
+        """
+        if self.flight is None:
+            return await self.fetch_html(url, parser_name, args)
+        return await self.flight.do(url, lambda: self.fetch_html(url, parser_name, args))
+
+    async def fetch_html(self, url, parser_name=None, args=()):
+        """
+        下载页面并记录账号的健康状况，登录页、错误页、没有正常页面结构的空页面抛出 AccountError，任务会换账号重试
+        """
+        cookies = await wait_for_cookies(self.redis_cookie)
+        user_name = cookies['user_name']
+        entry = self.session_pool.acquire(cookies)
+        try:
+            status, response_url, html = await self.grab_response(entry.session, url, self.raw_html)
+        except asyncio.TimeoutError:
+            await self.account_health.report(user_name, Outcome.timeout)
+            raise
+        finally:
+            self.session_pool.release(entry)
+        if self.archive is not None:
+            await self.archive.write(url, user_name, status, html, parser_name, args)
+        outcome = self.account_health.classify(status, response_url, html)
+        state = await self.account_health.report(user_name, outcome)
+        if state == 'retired':
+            self.session_pool.evict(user_name)
+        if outcome is not Outcome.ok:
+            raise AccountError(user_name, outcome, url)
+        return html
 
     async def user_id_in_queue(self, user_id):
-        if user_id and user_id not in self.bloom_filter:
+        if user_id and await self.bloom_filter.add(user_id):
             # LOGGER.info('%s in user queue.' % user_id)
-            self.bloom_filter.add(user_id)
             await self.redis_job.push_job(JobType.user.value, {'user_id': user_id})
 
     async def get_user_id_from_homepage(self, home_page):
-        html_content = await self.grab_html(home_page)
-        home_page_html = BeautifulSoup(html_content, "lxml")
-        info_a = home_page_html.find('a', string='资料')
-        # LOGGER.info('get id from home page: %s' % home_page)
-        if info_a:
-            user_id = info_a.get('href').split('/')[1]
-            # LOGGER.info('id got: %s' % user_id)
-            return user_id
-        return 0
-
-    async def parse_tweet_content(self, html, job_info):
-        tweet_div = html.find(id='M_', class_='c')
-        if tweet_div:
-            tweet_user_a = tweet_div.find('a')
-            flag = False
-            if tweet_user_a:
-                tweet = {}
-                tweet_user_href = tweet_user_a.get('href')
-                if tweet_user_href.startswith('/u/'):
-                    tweet_user_id = tweet_user_href[3:]
-                else:
-                    tweet_user_id = await self.get_user_id_from_homepage(self.weibo_host + tweet_user_href)
-                await self.user_id_in_queue(tweet_user_id)
-                if tweet_div.find(class_='cmt', string='转发理由:'):
-                    tweet['flag'] = '转发'
-                    parent = tweet_div.find(class_='cmt', string='转发理由:').parent
-                    try:
-                        comment_href = tweet_div.find_all('div')[-2].find('a', class_='cc').get('href')
-
-                        href = comment_href.split('?')[0]
-                        tweet['sourceTid'] = href.split('/')[-1]
-
-                    except Exception:
-                        pass
-                    text = parent.get_text()
-                    fields = text.split('\xa0')
-                    flag = True
-                    content = fields[0][5:]
-                    tweet['content'] = content.strip()
-                    # ct_content = parent.find('span', class_='ct').get_text()
-                    # time_source = ct_content.split('\u6765\u81ea')
-                    #
-                    # time = time_source[0]
-                    # if len(time_source) == 2:
-                    #     source = time_source[1]
-                    # else:
-                    #     source = 'unknown'
-                    # other = ';'.join(fields[1:])
-                else:
-                    tweet_content = tweet_div.find('span', class_='ctt').get_text()
-                    tweet['content'] = tweet_content.strip()
-                tweet_details = list(
-                    filter(lambda div: div.find(class_='pms'),
-                           html.find_all('div', id=False, class_=False)))
-                tweet['sourceTid'] = job_info['parentTid'] if 'parentTid' in job_info \
-                    else tweet['sourceTid'] if flag else ''
-                detail = tweet_details[0].get_text(';').replace('\xa0', '')
-                like = re.findall(u'\u8d5e\[(\d+)\];', detail)  # 点赞数
-                transfer = re.findall(u'\u8f6c\u53d1\[(\d+)\];', detail)  # 转载数
-                comment = re.findall(u'\u8bc4\u8bba\[(\d+)\];', detail)  # 评论数
-                tweet['id'] = job_info['tweetId']
-                tweet['like'] = like[0] if like else 0
-                tweet['transfer'] = transfer[0] if transfer else 0
-                tweet['comment'] = comment[0] if comment else 0
-                tweet['type'] = 'tweet_info'
-                # if flag:
-                #     await self.weibo_producer.send(tweet, job_info['url'])
-                # else:
-                others = tweet_div.find(class_='ct').get_text()
-                if others:
-                    others = others.split('\u6765\u81ea')
-                    tweet['time'] = self.get_time(others[0])
-                    if len(others) == 2:
-                        tweet['source'] = others[1]
-                tweet['uid'] = tweet_user_id
-                await self.weibo_producer.send(tweet, job_info['url'])
-                return tweet
-        return None
+        return await self.grab_page(home_page, 'parse_home_page_user_id')
+
+    async def resolve_user_id(self, user_id):
+        """
+        解析结果中的 HomePage 需要下载个人主页才能拿到 uid，结果缓存在 homepage_cache 中
+        """
+        if isinstance(user_id, weibo_parser.HomePage):
+            uid = await self.homepage_cache.get(user_id.url)
+            if uid is None:
+                url = user_id.url if user_id.url.startswith('http') else self.weibo_host + user_id.url
+                uid = await self.get_user_id_from_homepage(url)
+                await self.homepage_cache.set(user_id.url, uid)
+            return uid
+        return user_id
+
+    async def gather_rows(self, fn, rows, limit=ROW_CONCURRENCY):
+        """
+        并发处理一个页面中的每一行（下载个人主页取 uid、放入 redis），同时最多 limit 个，
+        页面耗时取决于最慢的一行而不是所有行之和。任意一行失败时取消其余的行，整个任务重试
+        :return: 按行的顺序返回 fn 的结果
+        """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def run(row):
+            async with semaphore:
+                return await fn(row)
+        tasks = [asyncio.ensure_future(run(row)) for row in rows]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def resolve_record(self, record):
+        for key, value in record.items():
+            if isinstance(value, weibo_parser.HomePage):
+                record[key] = await self.resolve_user_id(value)
+        return record
+
+    async def send_tweet_content(self, tweet, job_info):
+        """
+        评论页、转发页顶部的微博
+        """
+        if tweet:
+            await self.resolve_record(tweet)
+            await self.user_id_in_queue(tweet['uid'])
+            await self.weibo_producer.send(tweet, job_info['url'])
 
     async def grab_tweet_repost(self, repost_job_info):
         LOGGER.info('start grab tweet repost: %s' % str(repost_job_info))
 
-        html_content = await self.grab_html(repost_job_info['url'])
-        tweet_repost_html = BeautifulSoup(html_content, "lxml")
-        repost_divs = tweet_repost_html.find_all(class_='c')
-        for div in repost_divs:
-            span_cc = div.find('span', class_='cc')
-            if span_cc:
-                attitube_a = span_cc.find('a')
-                if attitube_a:
-                    href = attitube_a.get('href')
-                    if len(href.split('/')) > 2:
-                        await self.redis_job.push_job(JobType.comment.value,
-                                                      {'url': self.tweet_comment_url % href.split('/')[2],
-                                                       'tweetId': href.split('/')[2],
-                                                       'parentTid': repost_job_info['tweetId']})
-                        await self.redis_job.push_job(JobType.repost.value,
-                                                      {'url': self.user_repost_url % href.split('/')[2],
-                                                       'tweetId': href.split('/')[2],
-                                                       'parentTid': repost_job_info['tweetId']})
-        if 'page=' not in repost_job_info['url']:
-            await self.parse_tweet_content(tweet_repost_html, repost_job_info)
-            page_div = tweet_repost_html.find(id='pagelist')
-            if page_div:
-
-                max_page = int(page_div.input.get('value'))
-                for page in range(2, max_page + 1):
-                    await self.redis_job.push_job(JobType.repost.value,
-                                                  {'url': self.user_repost_url2 % (repost_job_info['tweetId'], page),
-                                                   'tweetId': repost_job_info['tweetId']})
-        pass
+        first_page = 'page=' not in repost_job_info['url']
+        result = await self.grab_page(repost_job_info['url'], 'parse_repost', repost_job_info['tweetId'],
+                                      repost_job_info.get('parentTid'), first_page)
+        await self.redis_job.push_jobs(JobType.comment.value,
+                                       [{'url': self.tweet_comment_url % tweet_id,
+                                         'tweetId': tweet_id,
+                                         'parentTid': repost_job_info['tweetId']} for tweet_id in result['tweet_ids']])
+        await self.redis_job.push_jobs(JobType.repost.value,
+                                       [{'url': self.user_repost_url % tweet_id,
+                                         'tweetId': tweet_id,
+                                         'parentTid': repost_job_info['tweetId']} for tweet_id in result['tweet_ids']])
+        if first_page:
+            await self.send_tweet_content(result['tweet'], repost_job_info)
+            if result['max_page']:
+                await self.redis_job.push_jobs(JobType.repost.value,
+                                               [{'url': self.user_repost_url2 % (repost_job_info['tweetId'], page),
+                                                 'tweetId': repost_job_info['tweetId']}
+                                                for page in range(2, result['max_page'] + 1)])
 
     async def grab_tweet_comments(self, comment_job):
         LOGGER.info('start grab comment: %s' % str(comment_job))
-        html_content = await self.grab_html(comment_job['url'])
-        comment_html = BeautifulSoup(html_content, "lxml")
-
-        comment_divs = comment_html.find_all(id=re.compile('C_[\d]'), class_='c')
-        for comment_div in comment_divs:
-            comment_info = {}
-            comment_id = comment_div.get('id')
-            user_a = comment_div.find('a')
-            if user_a:
-                user_href = user_a.get('href')
-                if user_href.startswith('/u/'):
-                    user_id = user_href[3:]
-                else:
-                    user_id = await self.get_user_id_from_homepage(self.weibo_host + user_href)
-                await self.user_id_in_queue(user_id)
-                comment_info['userId'] = user_id
-                comment_info['content'] = comment_div.find(class_='ctt').get_text()
-                others = comment_div.find(class_='ct').get_text()
-                if others:
-                    others = others.split('\u6765\u81ea')
-                    comment_info['pubTime'] = self.get_time(others[0])
-                    if len(others) == 2:
-                        comment_info['source'] = others[1]
-                comment_info['id'] = comment_id
-                comment_info['tweetId'] = comment_job['tweetId']
-                comment_info['type'] = 'comment_info'
-                await self.weibo_producer.send(comment_info, comment_job['url'])
-
-        if 'page=' not in comment_job['url']:
-            await self.parse_tweet_content(comment_html, comment_job)
-            page_div = comment_html.find(id='pagelist')
-            if page_div:
-
-                max_page = int(page_div.input.get('value'))
-                for page in range(2, max_page + 1):
-                    await self.redis_job.push_job(JobType.comment.value,
-                                                  {'url': self.tweet_comment_url2 % (comment_job['tweetId'], page),
-                                                   'tweetId': comment_job['tweetId']})
-
-    def start(self, args):
-        LOGGER.info(str(args))
+        tweet_id = comment_job['tweetId']
+        if 'page' in comment_job:
+            if await self.check_cursor(JobType.comment.value, tweet_id, comment_job) is None:
+                return
+            url = self.tweet_comment_url2 % (tweet_id, comment_job['page'])
+        else:
+            url = comment_job['url']
+        first_page = 'page=' not in url
+        result = await self.grab_page(url, 'parse_comments', tweet_id, comment_job.get('parentTid'), first_page)
+
+        async def resolve_comment(comment_info):
+            await self.resolve_record(comment_info)
+            await self.user_id_in_queue(comment_info['userId'])
+        await self.gather_rows(resolve_comment, result['comments'])
+        for comment_info in result['comments']:
+            await self.weibo_producer.send(comment_info, url)
+
+        if first_page:
+            await self.send_tweet_content(result['tweet'], comment_job)
+            if result['tweet']:
+                await self.observe_comments(tweet_id, result['tweet']['comment'])
+        if comment_job.get('recrawl'):
+            # 定时重新抓取只看第一页的最新评论
+            return
+        if self.pagination == 'cursor':
+            if 'page' in comment_job or first_page:
+                # 只有第一页解析总页数，之后的页使用任务中的 max_page
+                await self.advance_cursor(JobType.comment.value, tweet_id, comment_job.get('page', 1),
+                                          comment_job.get('max_page', result['max_page']), result['comments'])
+        elif first_page and result['max_page']:
+            await self.redis_job.push_jobs(JobType.comment.value,
+                                           [{'url': self.tweet_comment_url2 % (comment_job['tweetId'], page),
+                                             'tweetId': comment_job['tweetId']}
+                                            for page in range(2, result['max_page'] + 1)])
+
+    async def observe_comments(self, tweet_id, comment_count):
+        """
+        关注的微博评论数增长时缩短重新抓取的间隔
+        """
+        state = await self.scheduler.state(COMMENT, tweet_id)
+        if state is not None:
+            count = int(comment_count)
+            await self.scheduler.observe(COMMENT, tweet_id, count > state.get('count', 0), count=count)
+
+    async def push_recrawl_jobs(self, due):
+        """
+        到期的关注用户放入资料和微博任务，关注的微博放入只抓第一页的评论任务，url 和之前的相同，不去重
+        :param due: RecrawlScheduler.release_due 的结果
+        """
+        user_jobs, tweet_jobs, comment_jobs = [], [], []
+        for kind, resource_id, _ in due:
+            if kind == USER:
+                user_jobs.append({'user_id': resource_id})
+                tweet_jobs.append({'url': self.user_tweet_url % resource_id, 'uid': resource_id})
+            elif kind == COMMENT:
+                comment_jobs.append({'url': self.tweet_comment_url % resource_id, 'tweetId': resource_id,
+                                     'recrawl': True})
+        for job_type, job_infos in ((JobType.user.value, user_jobs), (JobType.tweet.value, tweet_jobs),
+                                    (JobType.comment.value, comment_jobs)):
+            if job_infos:
+                await self.redis_job.push_jobs(job_type, job_infos, dedup=False)
+
+    @staticmethod
+    def cursor_job(job_type, resource_id, checkpoint):
+        """
+        游标任务不带 url，不经过 url 去重，由处理函数根据页码拼出 url
+        """
+        job_info = {'uid': resource_id} if job_type == JobType.tweet.value else {'tweetId': resource_id}
+        job_info.update(page=checkpoint['page'], max_page=checkpoint['max_page'])
+        return job_info
+
+    async def check_cursor(self, job_type, resource_id, job_info):
+        """
+        :return: 游标任务的检查点，页码和检查点不一致（重复或过期的任务）返回 None
+        """
+        checkpoint = await self.page_cursor.get(job_type, resource_id)
+        if checkpoint is None or checkpoint['page'] != job_info['page']:
+            LOGGER.info('%s cursor job passed, checkpoint: %s, job: %s' % (job_type, checkpoint, job_info))
+            return None
+        return checkpoint
+
+    async def advance_cursor(self, job_type, resource_id, page, max_page, rows, limit=None, reached=False,
+                             state=None):
+        """
+        cursor 模式下处理完第 page 页：还有下一页时先保存检查点再放入下一页的任务，到最后一页、空页
+        或者 reached 时删除检查点。第一页的任务遇到还没走完的游标时只抓第一页，不重新开始分页
+        :param reached: 已经翻到上次抓过的内容
+        :param state: 和检查点一起保存的其他状态
+        :return: 分页是否结束，第一页遇到进行中的游标返回 None
+        """
+        if page == 1 and await self.page_cursor.get(job_type, resource_id) is not None:
+            return None
+        if limit and max_page:
+            max_page = min(max_page, limit)
+        if rows and max_page and page < max_page and not reached:
+            checkpoint = dict(state or {}, page=page + 1, max_page=max_page)
+            await self.page_cursor.save(job_type, resource_id, checkpoint)
+            await self.redis_job.push_job(job_type, self.cursor_job(job_type, resource_id, checkpoint))
+            return False
+        if page > 1:
+            await self.page_cursor.finish(job_type, resource_id)
+        return True
+
+    def job_handlers(self, args):
+        """
+        :param args: 要运行的任务类型，见 start.py
+        :return: 队列名 -> 任务处理函数
+        """
+        handlers = [('f', JobType.follower, self.grab_follow),
+                    ('c', JobType.comment, self.grab_tweet_comments),
+                    ('u', JobType.user, lambda job: self.grab_user_info(job['user_id'])),
+                    ('w', JobType.tweet, self.grab_weibo),
+                    ('r', JobType.repost, self.grab_tweet_repost),
+                    ('s', JobType.search, self.search_tweet)]
+        return {job_type.value: handler for arg, job_type, handler in handlers if arg in args}
+
+    def create_workers(self, args):
+        """
+        :param args: 要运行的任务类型，见 start.py
+        :return: 各个任务类型的 worker 和后台维护协程
+        """
         workers = []
-        if 'f' in args:
-            workers += [asyncio.Task(self.crawl_follow(), loop=self.loop) for _ in range(self.tasks)]
-        if 'c' in args:
-            workers += [asyncio.Task(self.crawl_comment(), loop=self.loop) for _ in range(self.tasks)]
-        if 'u' in args:
-            workers += [asyncio.Task(self.crawl_user(), loop=self.loop) for _ in range(self.tasks)]
-        if 'w' in args:
-            workers += [asyncio.Task(self.crawl_weibo(), loop=self.loop) for _ in range(self.tasks)]
-        if 'r' in args:
-            workers += [asyncio.Task(self.crawl_repost(), loop=self.loop) for _ in range(self.tasks)]
-        if 's' in args:
-            workers += [asyncio.Task(self.search(), loop=self.loop) for _ in range(self.tasks)]
+        handlers = self.job_handlers(args)
+        if self.worker_mode == 'pool':
+            if handlers:
+                self.worker_pool = WorkerPool(self.redis_job, handlers, self.run_job, loop=self.loop,
+                                              workers=self.tasks * len(handlers))
+                workers.append(asyncio.Task(self.worker_pool.run(), loop=self.loop))
+        else:
+            if 'f' in args:
+                workers += [asyncio.Task(self.crawl_follow(), loop=self.loop) for _ in range(self.tasks)]
+            if 'c' in args:
+                workers += [asyncio.Task(self.crawl_comment(), loop=self.loop) for _ in range(self.tasks)]
+            if 'u' in args:
+                workers += [asyncio.Task(self.crawl_user(), loop=self.loop) for _ in range(self.tasks)]
+            if 'w' in args:
+                workers += [asyncio.Task(self.crawl_weibo(), loop=self.loop) for _ in range(self.tasks)]
+            if 'r' in args:
+                workers += [asyncio.Task(self.crawl_repost(), loop=self.loop) for _ in range(self.tasks)]
+            if 's' in args:
+                workers += [asyncio.Task(self.search(), loop=self.loop) for _ in range(self.tasks)]
+        self.crawl_workers = list(workers)
         if workers:
-            self.loop.run_until_complete(asyncio.wait(workers))
+            workers.append(asyncio.Task(self.redis_job.move_due_jobs(), loop=self.loop))
+            workers.append(asyncio.Task(self.redis_job.reap_expired_leases(), loop=self.loop))
+            workers.append(asyncio.Task(self.account_health.release_cooled_accounts(), loop=self.loop))
+            workers.append(asyncio.Task(self.scheduler.run(self.push_recrawl_jobs), loop=self.loop))
+            cursor_types = [job_type.value for arg, job_type in (('w', JobType.tweet), ('c', JobType.comment))
+                            if arg in args]
+            if self.pagination == 'cursor' and cursor_types:
+                workers.append(asyncio.Task(self.page_cursor.resume_stale(
+                    cursor_types, self.cursor_job, self.redis_job.push_job), loop=self.loop))
+        return workers
+
+    def stats(self):
+        """
+        :return: 本进程的统计，都是可以跨进程相加的计数
+        """
+        stats = {'jobs': dict(self.jobs_done), 'failed': dict(self.jobs_failed),
+                 'outcomes': {outcome.value: n for outcome, n in self.account_health.outcomes.items()}}
+        if self.flight is not None:
+            stats['fetch'] = {'calls': self.flight.calls, 'shared': self.flight.shared,
+                              'cache_hits': self.flight.cache_hits}
+        if isinstance(self.weibo_producer, BatchProducer):
+            stats['kafka'] = self.weibo_producer.stats()
+        if self.worker_pool is not None:
+            pool_stats = self.worker_pool.stats()
+            # 队列长度是全局的，不能相加
+            pool_stats.pop('depths')
+            stats['workers'] = pool_stats
+        return stats
+
+    async def report_stats(self, report, interval=STATS_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            report(self.stats())
+
+    def drain(self, workers, timeout=DRAIN_TIMEOUT):
+        """
+        SIGTERM/SIGINT 的处理：不再取新任务，等处理中的任务完成（最多 timeout 秒）后取消所有协程
+        """
+        if self.draining:
+            LOGGER.info('already draining')
+            return
+        self.draining = True
+        self.loop.create_task(self._drain(workers, timeout))
+
+    async def _drain(self, workers, timeout):
+        LOGGER.info('stop fetching jobs, waiting up to %ds for in-flight jobs' % timeout)
+        self.redis_job.stop()
+        if self.worker_pool is not None:
+            self.worker_pool.drain()
+        if self.crawl_workers:
+            _, pending = await asyncio.wait(self.crawl_workers, timeout=timeout)
+            if pending:
+                LOGGER.warn('%d workers still busy after %ds, cancelled' % (len(pending), timeout))
+        for worker in workers:
+            worker.cancel()
+
+    def start(self, args, report=None):
+        """
+        :param report: 定时调用，参数为 stats() 的结果，多进程运行时用来把统计发给主进程
+        """
+        LOGGER.info(str(args))
+        workers = self.create_workers(args)
+        if workers:
+            if report is not None:
+                workers.append(asyncio.Task(self.report_stats(report), loop=self.loop))
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    self.loop.add_signal_handler(sig, self.drain, workers)
+                except NotImplementedError:
+                    # windows 的事件循环不支持，收到信号直接退出
+                    pass
+            try:
+                self.loop.run_until_complete(asyncio.wait(workers))
+            finally:
+                self.loop.run_until_complete(self.close())
+                if report is not None:
+                    report(self.stats())
+
+    async def close(self):
+        await self.weibo_producer.close()
+        await self.session_pool.close()
+        await self.redis_cookie.close()
+        await self.account_health.close()
+        await self.homepage_cache.close()
+        await self.page_cursor.close()
+        await self.watermark.close()
+        await self.scheduler.close()
+        await self.redis_job.close()
+        if self.archive is not None:
+            await self.archive.close()
+        if self.executor is not None:
+            self.executor.shutdown()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,66 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import time
+from collections import OrderedDict
+
+from setting import FETCH_CACHE_TTL, FETCH_CACHE_SIZE
+
+
+class SingleFlight(object):
+    """
+    合并同一个 key 的并发请求：同时请求同一个 url 的协程共用一次下载和结果，
+    ttl 大于 0 时成功的结果在内存中缓存 ttl 秒，缓存按最近使用淘汰
+    """
+
+    def __init__(self, loop=None, **kwargs):
+        self.loop = loop or asyncio.get_event_loop()
+        self._ttl = kwargs['ttl'] if 'ttl' in kwargs else FETCH_CACHE_TTL
+        self._max_size = kwargs['max_size'] if 'max_size' in kwargs else FETCH_CACHE_SIZE
+        # key -> 正在执行的 task
+        self._flights = {}
+        # key -> (过期时间, 结果)
+        self._cache = OrderedDict()
+        self.calls = 0
+        self.shared = 0
+        self.cache_hits = 0
+
+    def _cached(self, key):
+        if key not in self._cache:
+            return None
+        expire_at, result = self._cache[key]
+        if expire_at < time.time():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return result
+
+    def _store(self, key, task):
+        self._flights.pop(key, None)
+        # 没有协程等待时也要取出异常，避免 “exception was never retrieved”
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self._ttl > 0:
+            self._cache[key] = (time.time() + self._ttl, task.result())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+
+    async def do(self, key, fn):
+        """
+        :param fn: 没有缓存、也没有正在执行的同 key 请求时调用，返回 awaitable
+        :return: fn 的结果，异常同样传给所有等待的协程
+        """
+        self.calls += 1
+        result = self._cached(key)
+        if result is not None:
+            self.cache_hits += 1
+            return result
+        task = self._flights.get(key)
+        if task is None:
+            task = self.loop.create_task(fn())
+            task.add_done_callback(lambda done: self._store(key, done))
+            self._flights[key] = task
+        else:
+            self.shared += 1
+        # 一个等待者被取消不影响其他等待者
+        return await asyncio.shield(task)
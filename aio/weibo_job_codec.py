@@ -0,0 +1,179 @@
+# -*- coding:utf-8 -*-
+"""
+redis 队列中任务的紧凑编码。任务原来是 json，每个任务都带着完整的 url，比如
+{"url": "https://weibo.cn/comment/G7lbPgeeC?page=37", "tweetId": "G7lbPgeeC"}，
+编码后只保存任务种类、id、页码、父微博 id 等字段，url 取出时按模板重新拼出来。
+
+编码格式（大端）：1 字节版本 + 1 字节任务种类 + 1 字节标志位，后面按标志位依次是
+id、页码（H）、总页数（H）、父微博 id、重试次数（B），字符串为 1 字节长度 + utf-8，整数 id 为 Q。
+没法无损编码的任务（搜索任务、url 和模板对不上、字段超出范围等）仍然写 json，
+json 以 '{' 开头，和编码后的任务可以放在同一个队列里，解码时按第一个字节区分，旧的 json 任务照常读取
+"""
+import json
+import struct
+
+VERSION = 1
+
+HEADER = struct.Struct('>BBB')
+SHORT = struct.Struct('>H')
+BYTE = struct.Struct('>B')
+LONG = struct.Struct('>Q')
+
+# 任务种类：(队列名, id 字段)，下标就是编码中的任务种类
+KINDS = (('follower', 'uid'), ('tweet', 'uid'), ('comment', 'tweetId'), ('repost', 'tweetId'), ('user', 'user_id'))
+
+# 标志位
+URL = 1 << 0          # 有 url，按模板拼出
+PAGE = 1 << 1         # 有页码：有 url 时是 url 中的 page，否则是游标任务的 page 字段
+MAX_PAGE = 1 << 2
+PARENT = 1 << 3
+RECRAWL = 1 << 4
+RETRY = 1 << 5
+INT_ID = 1 << 6
+
+PAGE_SEPARATOR = '?page='
+
+
+def url_templates(weibo_host):
+    """
+    任务 url 的模板，WeiboCnSpider.__init__ 中的 follow_url、user_tweet_url 等也由这里生成，
+    编码和拼 url 始终使用同一套模板
+    :return: 队列名 -> (第一页, 第 n 页)
+    """
+    return {
+        'follower': (weibo_host + '/%s/follow', weibo_host + '/%s/follow?page=%d'),
+        'tweet': (weibo_host + '/%s', weibo_host + '/%s?page=%d'),
+        'comment': (weibo_host + '/comment/%s', weibo_host + '/comment/%s?page=%d'),
+        'repost': (weibo_host + '/repost/%s', weibo_host + '/repost/%s?page=%d'),
+    }
+
+
+def _pack_str(value):
+    data = value.encode('utf-8')
+    if len(data) > 255:
+        raise ValueError(value)
+    return BYTE.pack(len(data)) + data
+
+
+def _unpack_str(data, offset):
+    length = data[offset]
+    return data[offset + 1:offset + 1 + length].decode('utf-8'), offset + 1 + length
+
+
+class JobCodec(object):
+
+    def __init__(self, weibo_host='https://weibo.cn', compact=True):
+        """
+        :param weibo_host: 拼 url 使用的站点，和 WeiboCnSpider 的 weibo_host 相同
+        :param compact: False 时只写 json，读取时两种格式都支持
+        """
+        self.templates = url_templates(weibo_host)
+        self.compact = compact
+        self._kinds = {queue: kind for kind, (queue, _) in enumerate(KINDS)}
+
+    def encode(self, job_type, job_info):
+        """
+        :return: 编码后的 bytes，没法紧凑编码的任务编码为 json
+        """
+        if self.compact and job_type in self._kinds:
+            try:
+                data = self._pack(job_type, job_info)
+            except (ValueError, struct.error):
+                data = None
+            if data is not None:
+                return data
+        return json.dumps(job_info).encode('utf-8')
+
+    def _pack(self, job_type, job_info):
+        kind = self._kinds[job_type]
+        id_key = KINDS[kind][1]
+        if id_key not in job_info or not set(job_info) <= {id_key, 'url', 'page', 'max_page', 'parentTid',
+                                                           'recrawl', 'retry'}:
+            return None
+        resource_id = job_info[id_key]
+        flags = 0
+        body = b''
+        if isinstance(resource_id, int) and not isinstance(resource_id, bool):
+            flags |= INT_ID
+            body += LONG.pack(resource_id)
+        elif isinstance(resource_id, str):
+            body += _pack_str(resource_id)
+        else:
+            return None
+
+        page = job_info.get('page')
+        if 'url' in job_info:
+            if 'page' in job_info or job_type not in self.templates:
+                return None
+            url, page = job_info['url'], None
+            first, nth = self.templates[job_type]
+            _, separator, page_no = url.partition(PAGE_SEPARATOR)
+            if separator and page_no.isdigit() and url == nth % (resource_id, int(page_no)):
+                page = int(page_no)
+            elif url != first % resource_id:
+                return None
+            flags |= URL
+        elif 'page' in job_info and not isinstance(page, int):
+            return None
+        if page is not None:
+            flags |= PAGE
+            body += SHORT.pack(page)
+
+        if 'max_page' in job_info:
+            if not isinstance(job_info['max_page'], int):
+                return None
+            flags |= MAX_PAGE
+            body += SHORT.pack(job_info['max_page'])
+        if 'parentTid' in job_info:
+            if not isinstance(job_info['parentTid'], str):
+                return None
+            flags |= PARENT
+            body += _pack_str(job_info['parentTid'])
+        if 'recrawl' in job_info:
+            if job_info['recrawl'] is not True:
+                return None
+            flags |= RECRAWL
+        if 'retry' in job_info:
+            flags |= RETRY
+            body += BYTE.pack(job_info['retry'])
+        return HEADER.pack(VERSION, kind, flags) + body
+
+    def decode(self, data):
+        """
+        :param data: redis 中的任务，bytes 或 str，json 和紧凑编码都可以
+        :return: 任务 dict
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if data[:1] == b'{':
+            return json.loads(data.decode('utf-8'))
+        version, kind, flags = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError('unknown job encoding version %d' % version)
+        job_type, id_key = KINDS[kind]
+        offset = HEADER.size
+        if flags & INT_ID:
+            resource_id = LONG.unpack_from(data, offset)[0]
+            offset += LONG.size
+        else:
+            resource_id, offset = _unpack_str(data, offset)
+        job_info = {id_key: resource_id}
+        page = None
+        if flags & PAGE:
+            page = SHORT.unpack_from(data, offset)[0]
+            offset += SHORT.size
+        if flags & URL:
+            first, nth = self.templates[job_type]
+            job_info['url'] = first % resource_id if page is None else nth % (resource_id, page)
+        elif page is not None:
+            job_info['page'] = page
+        if flags & MAX_PAGE:
+            job_info['max_page'] = SHORT.unpack_from(data, offset)[0]
+            offset += SHORT.size
+        if flags & PARENT:
+            job_info['parentTid'], offset = _unpack_str(data, offset)
+        if flags & RECRAWL:
+            job_info['recrawl'] = True
+        if flags & RETRY:
+            job_info['retry'] = BYTE.unpack_from(data, offset)[0]
+        return job_info
@@ -0,0 +1,128 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import json
+import traceback
+from collections import OrderedDict
+
+from kafka import KafkaProducer
+
+from setting import LOGGER, KAFKA_BATCH_SIZE, KAFKA_LINGER_MS, KAFKA_BUFFER_SIZE, KAFKA_COMPRESSION
+
+
+class BatchProducer(object):
+    """
+    异步批量发送到 kafka：send 只是把记录放进内存队列，由后台协程攒够 batch_size 条
+    或者等待 linger_ms 后在线程池里批量发送，解析流程里不再有同步的 kafka 调用
+    """
+
+    def __init__(self, bootstrap_servers, topic, loop=None, **kwargs):
+        self.topic = topic
+        self.loop = loop or asyncio.get_event_loop()
+        self._batch_size = kwargs['batch_size'] if 'batch_size' in kwargs else KAFKA_BATCH_SIZE
+        self._linger = (kwargs['linger_ms'] if 'linger_ms' in kwargs else KAFKA_LINGER_MS) / 1000
+        self._buffer_size = kwargs['buffer_size'] if 'buffer_size' in kwargs else KAFKA_BUFFER_SIZE
+        compression = kwargs['compression_type'] if 'compression_type' in kwargs else KAFKA_COMPRESSION
+        # transport 需要实现 send(topic, value=msg) -> future 和 flush()，方便用假的 broker 测试
+        if 'transport' in kwargs:
+            self.transport = kwargs['transport']
+        else:
+            self.transport = KafkaProducer(bootstrap_servers=bootstrap_servers,
+                                           compression_type=compression,
+                                           value_serializer=lambda msg: json.dumps(msg).encode('utf-8'))
+        # on_error(records, exc)：一批中发送失败的记录和异常，在事件循环线程中调用
+        self._on_error = kwargs['on_error'] if 'on_error' in kwargs else None
+        self._queue = None
+        self._flusher = None
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+
+    async def send(self, msg, url):
+        """
+        记录放入发送缓冲区，缓冲区满时等待，起到背压的作用
+        :return: future，所在的批次发送后完成，结果为发送异常，成功为 None；
+            不关心结果的调用方可以不等待，失败的记录同时交给 on_error 并计入 stats()
+        """
+        if self._flusher is None:
+            self._queue = asyncio.Queue(maxsize=self._buffer_size)
+            self._flusher = self.loop.create_task(self._flush_loop())
+        future = self.loop.create_future()
+        await self._queue.put((msg, future))
+        return future
+
+    async def _flush_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self.loop.time() + self._linger
+            while len(batch) < self._batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await self.loop.run_in_executor(None, self._deliver, [msg for msg, _ in batch])
+            except Exception as e:
+                LOGGER.error('send batch failed: %s' % e)
+                results = [e] * len(batch)
+            failed = sum(1 for error in results if error)
+            self.batches += 1
+            self.sent += len(batch) - failed
+            self.failed += failed
+            if failed:
+                LOGGER.error('%d of %d records send failed: %s' %
+                             (failed, len(batch), next(error for error in results if error)))
+            for (_, future), error in zip(batch, results):
+                if not future.done():
+                    future.set_result(error)
+                self._queue.task_done()
+            if failed and self._on_error is not None:
+                self._report_failed(batch, results)
+
+    def _report_failed(self, batch, results):
+        """
+        失败的记录按异常分组交给 on_error，回调出错只写日志，不影响后面的批次
+        """
+        groups = OrderedDict()
+        for (msg, _), error in zip(batch, results):
+            if error:
+                groups.setdefault(id(error), (error, []))[1].append(msg)
+        for error, records in groups.values():
+            try:
+                self._on_error(records, error)
+            except Exception:
+                LOGGER.error('on_error callback failed: %s' % traceback.format_exc())
+
+    def _deliver(self, messages):
+        """
+        在线程池中执行，返回每条记录的发送异常，成功为 None
+        """
+        futures = [self.transport.send(self.topic, value=msg) for msg in messages]
+        self.transport.flush()
+        results = []
+        for future in futures:
+            try:
+                future.get(timeout=0)
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stats(self):
+        """
+        :return: 发送成功、失败的记录数和发送的批次数，可以跨进程相加
+        """
+        return {'sent': self.sent, 'failed': self.failed, 'batches': self.batches}
+
+    async def close(self):
+        """
+        等待缓冲区里的记录全部发送后关闭
+        """
+        if self._flusher is not None:
+            await self._queue.join()
+            self._flusher.cancel()
+            self._flusher = None
+        await self.loop.run_in_executor(None, self.transport.close)
+        LOGGER.info('kafka producer closed, %d records sent, %d failed' % (self.sent, self.failed))
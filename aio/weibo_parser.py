@@ -0,0 +1,322 @@
+# -*- coding:utf-8 -*-
+"""
+weibo.cn 页面解析，全部是纯函数：输入页面内容，输出普通的 dict/list，
+不访问网络和 redis，可以放到进程池里执行，不阻塞事件循环
+"""
+import re
+from collections import namedtuple
+
+from bs4 import BeautifulSoup
+
+from aio import weibo_tweet
+from aio.weibo_tweet import get_time
+
+# 需要下载个人主页才能拿到 uid 的用户，url 可能是相对路径，由爬虫补全并解析
+HomePage = namedtuple('HomePage', ['url'])
+
+PUBLIC_USER_ICON = 'https://h5.sinaimg.cn/upload/2016/05/26/319/5338.gif'
+ENTERPRISE_USER_ICON = 'https://h5.sinaimg.cn/upload/2016/05/26/319/5337.gif'
+
+user_id_pattern = re.compile(r'https://weibo.cn/u/(\d*)')
+total_count_pattern = re.compile(r'共\d*条')
+comment_id_pattern = re.compile(r'C_[\d]')
+
+
+def find_comment_href(tweet_div):
+    """
+    转发微博的原文评论链接，没有返回 None
+    """
+    try:
+        return tweet_div.find_all('div')[-2].find('a', class_='cc').get('href')
+    except Exception:
+        return None
+
+
+def extract_tweet(tweet_div):
+    """
+    搜索结果页、用户微博列表页中的一条微博
+    :return: weibo_tweet.Tweet
+    """
+    repost_reason = tweet_div.find(class_='cmt', string=weibo_tweet.REPOST_REASON)
+    if repost_reason:  # 转发
+        parent = repost_reason.parent
+        return weibo_tweet.extract_forward(parent.get_text(), parent.find('span', class_='ct').get_text(),
+                                           find_comment_href(tweet_div))
+    return weibo_tweet.extract_original(tweet_div.get_text(), tweet_div.find('span', class_='ct').get_text())
+
+
+def parse_max_page(html):
+    page_div = html.find(id='pagelist')
+    if page_div:
+        return int(page_div.input.get('value'))
+    return None
+
+
+def parse_follow(html_content):
+    """
+    关注列表页
+    :return: {'users': [(uid 或 HomePage, 是否需要抓取)], 'max_page': 总页数}
+    """
+    follow_html = BeautifulSoup(html_content, "lxml")
+    users = []
+    for td in follow_html.find_all('td', style=True):
+        a = td.find('a').get('href')
+        usr_id_result = user_id_pattern.findall(a)
+        usr_id = usr_id_result[0] if usr_id_result else HomePage(a)
+        # 跳过公众号和企业号
+        public_user = td.parent.find_all('img', src=PUBLIC_USER_ICON)
+        enterprise_user = td.parent.find_all('img', src=ENTERPRISE_USER_ICON)
+        users.append((usr_id, not public_user and not enterprise_user))
+    return {'users': users, 'max_page': parse_max_page(follow_html)}
+
+
+def parse_search(html_content):
+    """
+    搜索结果页
+    :return: {'tweets': [微博], 'max_page': 总页数}，微博的 uid 可能是 HomePage
+    """
+    result_html = BeautifulSoup(html_content, "lxml")
+    max_page = None
+    total_count_str = result_html.find(text=total_count_pattern)
+    if total_count_str:
+        total_count_result = re.findall(r'共(\d*)条', total_count_str)
+        if total_count_result:
+            max_page = int(int(total_count_result[0]) / 10) - 1
+
+    tweets = []
+    tweet_divs = result_html.find_all(id=True, class_='c')
+    for tweet_div in tweet_divs:
+        nk_div = tweet_div.find('a', class_='nk')
+        if nk_div:
+            nk_url = nk_div.get('href')
+            usr_id_result = user_id_pattern.findall(nk_url)
+            if usr_id_result:
+                usr_id = usr_id_result[0]
+            else:
+                usr_id = HomePage(nk_url)
+        else:
+            usr_id = 'unknown'
+        tweets.append(weibo_tweet.to_record(extract_tweet(tweet_div), tweet_div.get('id').strip('M_'), usr_id))
+    return {'tweets': tweets, 'max_page': max_page}
+
+
+def parse_user_tweet(html_content, uid):
+    """
+    用户微博列表页
+    :return: {'tweets': [微博], 'max_page': 总页数}
+    """
+    user_tweet_html = BeautifulSoup(html_content, "lxml")
+    tweets = []
+    tweet_divs = user_tweet_html.find_all(id=True, class_='c')
+    for tweet_div in tweet_divs:
+        tweets.append(weibo_tweet.to_record(extract_tweet(tweet_div), tweet_div.get('id'), uid))
+    return {'tweets': tweets, 'max_page': parse_max_page(user_tweet_html)}
+
+
+def parse_user_info(html_content, user_id):
+    """
+    用户资料页，不包括微博数、粉丝数、关注数（在个人主页上，见 parse_view）
+    :return: 用户信息，没有昵称返回 None
+    """
+    user_info_html = BeautifulSoup(html_content, "lxml")
+    div_list = list(user_info_html.find_all(class_=['c', 'tip']))
+
+    base_info_index, edu_info_index, work_info_index = -1, -1, -1
+    base_info = ''
+    edu_info = ''
+    work_info = ''
+    tags = ''
+    user_info = {}
+    for index, div in enumerate(div_list):
+        text = div.text
+        if text == u'基本信息':
+            base_info_index = index
+        elif text == u'学习经历':
+            edu_info_index = index
+        elif text == u'工作经历':
+            work_info_index = index
+    if base_info_index != -1:
+        b = div_list[base_info_index + 1]
+        tags = ','.join(map(lambda a: a.get_text(), b.find_all('a')))
+        base_info = b.get_text(';')
+    if edu_info_index != -1:
+        edu_info = div_list[edu_info_index + 1].get_text(';')
+
+    if work_info_index != -1:
+        work_info = div_list[work_info_index + 1].get_text(';')
+    base_info += ';'
+    nickname = re.findall(u'\u6635\u79f0[:|\uff1a](.*?);', base_info)  # 昵称
+    if not nickname:
+        return None
+    user_info['nickname'] = nickname[0] if nickname else 'unknown'
+    gender = re.findall(u'\u6027\u522b[:|\uff1a](.*?);', base_info)  # 性别
+    place = re.findall(u'\u5730\u533a[:|\uff1a](.*?);', base_info)  # 地区（包括省份和城市）
+    signature = re.findall(u'\u7b80\u4ecb[:|\uff1a](.*?);', base_info)  # 个性签名
+    birthday = re.findall(u'\u751f\u65e5[:|\uff1a](.*?);', base_info)  # 生日
+    sex_orientation = re.findall(u'\u6027\u53d6\u5411[:|\uff1a](.*?);', base_info)  # 性取向
+    marriage = re.findall(u'\u611f\u60c5\u72b6\u51b5[:|\uff1a](.*?);', base_info)  # 婚姻状况
+    head_url = user_info_html.find('img', alt='头像')
+    if head_url:
+        user_info['head'] = head_url.get('src')
+    user_info['tags'] = tags
+    user_info['gender'] = gender[0] if gender else 'unknown'
+    user_info['place'] = place[0] if place else 'unknown'
+    user_info['signature'] = signature[0] if signature else 'unknown'
+    user_info['birthday'] = birthday[0] if birthday else 'unknown'
+    user_info['sexOrientation'] = sex_orientation[0] if sex_orientation else 'unknown'
+    user_info['eduInfo'] = edu_info if edu_info else 'unknown'
+    user_info['marriage'] = marriage[0] if marriage else 'unknown'
+    user_info['workInfo'] = work_info if work_info else 'unknown'
+
+    user_info['type'] = 'user_info'
+    user_info['id'] = user_id
+    return user_info
+
+
+def parse_view(html_content):
+    """
+    个人主页上的微博数、粉丝数、关注数
+    :return: dict
+    """
+    home_page_html = BeautifulSoup(html_content, "lxml")
+    v = home_page_html.find('div', class_='tip2')
+    result = {}
+    if v:
+        content = v.get_text(';')
+    else:
+        content = ''
+    tweet_r = re.findall('微博\[(\d+)\];', content)
+    result['tweetNum'] = tweet_r[0] if tweet_r else -1
+    fans_r = re.findall('粉丝\[(\d+)\];', content)
+    result['fansNum'] = fans_r[0] if fans_r else -1
+    follow_r = re.findall('关注\[(\d+)\];', content)
+    result['followNum'] = follow_r[0] if follow_r else -1
+    return result
+
+
+def parse_home_page_user_id(html_content):
+    """
+    从个人主页的“资料”链接中取 uid
+    :return: uid，没有找到返回 0
+    """
+    home_page_html = BeautifulSoup(html_content, "lxml")
+    info_a = home_page_html.find('a', string='资料')
+    if info_a:
+        return info_a.get('href').split('/')[1]
+    return 0
+
+
+def parse_tweet_content(html, tweet_id, parent_tid=None):
+    """
+    评论页、转发页第一页顶部的微博
+    :param html: BeautifulSoup
+    :param tweet_id: 微博 id
+    :param parent_tid: 从转发页来的任务带有被转发微博的 id
+    :return: 微博，uid 可能是 HomePage；没有微博返回 None
+    """
+    tweet_div = html.find(id='M_', class_='c')
+    if tweet_div:
+        tweet_user_a = tweet_div.find('a')
+        flag = False
+        if tweet_user_a:
+            tweet = {}
+            tweet_user_href = tweet_user_a.get('href')
+            if tweet_user_href.startswith('/u/'):
+                tweet_user_id = tweet_user_href[3:]
+            else:
+                tweet_user_id = HomePage(tweet_user_href)
+            repost_reason = tweet_div.find(class_='cmt', string=weibo_tweet.REPOST_REASON)
+            if repost_reason:
+                tweet['flag'] = weibo_tweet.FORWARD
+                comment_href = find_comment_href(tweet_div)
+                if comment_href is not None:
+                    tweet['sourceTid'] = weibo_tweet.source_tid(comment_href)
+                flag = True
+                content = weibo_tweet.split_forward_text(repost_reason.parent.get_text())[0]
+                tweet['content'] = content.strip()
+            else:
+                tweet_content = tweet_div.find('span', class_='ctt').get_text()
+                tweet['content'] = tweet_content.strip()
+            tweet_details = list(
+                filter(lambda div: div.find(class_='pms'),
+                       html.find_all('div', id=False, class_=False)))
+            tweet['sourceTid'] = parent_tid if parent_tid is not None \
+                else tweet['sourceTid'] if flag else ''
+            detail = tweet_details[0].get_text(';').replace('\xa0', '')
+            like, transfer, comment = weibo_tweet.parse_counts(detail, 0)
+            tweet['id'] = tweet_id
+            tweet['like'] = like
+            tweet['transfer'] = transfer
+            tweet['comment'] = comment
+            tweet['type'] = 'tweet_info'
+            others = tweet_div.find(class_='ct').get_text()
+            if others:
+                others = others.split(weibo_tweet.SOURCE_SEPARATOR)
+                tweet['time'] = get_time(others[0])
+                if len(others) == 2:
+                    tweet['source'] = others[1]
+            tweet['uid'] = tweet_user_id
+            return tweet
+    return None
+
+
+def parse_repost(html_content, tweet_id, parent_tid=None, first_page=False):
+    """
+    转发列表页
+    :param first_page: 第一页还要解析顶部的微博和总页数
+    :return: {'tweet_ids': [转发的微博 id], 'tweet': 顶部的微博, 'max_page': 总页数}
+    """
+    tweet_repost_html = BeautifulSoup(html_content, "lxml")
+    tweet_ids = []
+    repost_divs = tweet_repost_html.find_all(class_='c')
+    for div in repost_divs:
+        span_cc = div.find('span', class_='cc')
+        if span_cc:
+            attitube_a = span_cc.find('a')
+            if attitube_a:
+                href = attitube_a.get('href')
+                if len(href.split('/')) > 2:
+                    tweet_ids.append(href.split('/')[2])
+    result = {'tweet_ids': tweet_ids, 'tweet': None, 'max_page': None}
+    if first_page:
+        result['tweet'] = parse_tweet_content(tweet_repost_html, tweet_id, parent_tid)
+        result['max_page'] = parse_max_page(tweet_repost_html)
+    return result
+
+
+def parse_comments(html_content, tweet_id, parent_tid=None, first_page=False):
+    """
+    评论列表页
+    :param first_page: 第一页还要解析顶部的微博和总页数
+    :return: {'comments': [评论], 'tweet': 顶部的微博, 'max_page': 总页数}，评论的 userId 可能是 HomePage
+    """
+    comment_html = BeautifulSoup(html_content, "lxml")
+    comments = []
+    comment_divs = comment_html.find_all(id=comment_id_pattern, class_='c')
+    for comment_div in comment_divs:
+        comment_info = {}
+        comment_id = comment_div.get('id')
+        user_a = comment_div.find('a')
+        if user_a:
+            user_href = user_a.get('href')
+            if user_href.startswith('/u/'):
+                user_id = user_href[3:]
+            else:
+                user_id = HomePage(user_href)
+            comment_info['userId'] = user_id
+            comment_info['content'] = comment_div.find(class_='ctt').get_text()
+            others = comment_div.find(class_='ct').get_text()
+            if others:
+                others = others.split(weibo_tweet.SOURCE_SEPARATOR)
+                comment_info['pubTime'] = get_time(others[0])
+                if len(others) == 2:
+                    comment_info['source'] = others[1]
+            comment_info['id'] = comment_id
+            comment_info['tweetId'] = tweet_id
+            comment_info['type'] = 'comment_info'
+            comments.append(comment_info)
+    result = {'comments': comments, 'tweet': None, 'max_page': None}
+    if first_page:
+        result['tweet'] = parse_tweet_content(comment_html, tweet_id, parent_tid)
+        result['max_page'] = parse_max_page(comment_html)
+    return result
@@ -0,0 +1,401 @@
+# -*- coding:utf-8 -*-
+"""
+weibo.cn 页面解析的 lxml 实现，函数签名和返回结果与 weibo_parser 完全一致。
+直接解析响应的 bytes，不构建 BeautifulSoup 树，查找元素用预编译的 XPath
+"""
+import re
+
+import lxml.html
+from lxml import etree
+
+from aio import weibo_tweet
+from aio.weibo_parser import HomePage, PUBLIC_USER_ICON, ENTERPRISE_USER_ICON, user_id_pattern, \
+    total_count_pattern, comment_id_pattern
+from aio.weibo_tweet import get_time
+
+# weibo.cn 页面都是 utf-8，不再根据 xml 声明和 meta 猜编码
+HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+
+
+def has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % name
+
+
+def xpath(path):
+    return etree.XPath(path, smart_strings=False)
+
+
+# 与 BeautifulSoup 的 get_text 一致：子孙节点中的文本，不包括注释
+text_nodes = xpath('.//text()')
+all_text_nodes = xpath('//text()')
+page_input = xpath("//*[@id='pagelist']//input")
+follow_tds = xpath('//td[@style]')
+icon_imgs = xpath('.//img[@src=$src]')
+first_a = xpath('.//a')
+nk_a = xpath('.//a[%s]' % has_class('nk'))
+cc_a = xpath('.//a[%s]' % has_class('cc'))
+cmt_nodes = xpath('.//*[%s]' % has_class('cmt'))
+ct_span = xpath('.//span[%s]' % has_class('ct'))
+ct_nodes = xpath('.//*[%s]' % has_class('ct'))
+ctt_span = xpath('.//span[%s]' % has_class('ctt'))
+ctt_nodes = xpath('.//*[%s]' % has_class('ctt'))
+cc_span = xpath('.//span[%s]' % has_class('cc'))
+pms_nodes = xpath('.//*[%s]' % has_class('pms'))
+descendant_divs = xpath('.//div')
+tweet_divs = xpath('//*[@id and %s]' % has_class('c'))
+c_nodes = xpath('//*[%s]' % has_class('c'))
+info_nodes = xpath('//*[%s or %s]' % (has_class('c'), has_class('tip')))
+top_tweet_div = xpath("//*[@id='M_' and %s]" % has_class('c'))
+plain_divs = xpath('//div[not(@id) and not(@class)]')
+tip2_div = xpath('//div[%s]' % has_class('tip2'))
+head_img = xpath("//img[@alt='头像']")
+all_a = xpath('//a')
+
+total_count_number_pattern = re.compile(r'共(\d*)条')
+nickname_pattern = re.compile(u'\u6635\u79f0[:|\uff1a](.*?);')  # 昵称
+gender_pattern = re.compile(u'\u6027\u522b[:|\uff1a](.*?);')  # 性别
+place_pattern = re.compile(u'\u5730\u533a[:|\uff1a](.*?);')  # 地区（包括省份和城市）
+signature_pattern = re.compile(u'\u7b80\u4ecb[:|\uff1a](.*?);')  # 个性签名
+birthday_pattern = re.compile(u'\u751f\u65e5[:|\uff1a](.*?);')  # 生日
+sex_orientation_pattern = re.compile(u'\u6027\u53d6\u5411[:|\uff1a](.*?);')  # 性取向
+marriage_pattern = re.compile(u'\u611f\u60c5\u72b6\u51b5[:|\uff1a](.*?);')  # 婚姻状况
+view_tweet_pattern = re.compile('微博\[(\d+)\];')
+view_fans_pattern = re.compile('粉丝\[(\d+)\];')
+view_follow_pattern = re.compile('关注\[(\d+)\];')
+
+
+def document(html_content):
+    """
+    :param html_content: 响应的 bytes，也接受 str
+    :return: 根节点 html
+    """
+    if isinstance(html_content, str):
+        html_content = html_content.encode('utf-8')
+    if not html_content.strip():
+        html_content = b'<html></html>'
+    return lxml.html.document_fromstring(html_content, parser=HTML_PARSER)
+
+
+def get_text(element, separator=''):
+    return separator.join(text_nodes(element))
+
+
+def first(nodes):
+    return nodes[0] if nodes else None
+
+
+def string(element):
+    """
+    与 BeautifulSoup 的 .string 一致：只有一个子节点时取它的文本，子节点是标签时递归
+    """
+    while True:
+        children = list(element)
+        if element.text:
+            return None if children else element.text
+        if len(children) != 1 or children[0].tail:
+            return None
+        element = children[0]
+        if not isinstance(element.tag, str):  # 注释
+            return element.text
+
+
+def find_repost_reason(tweet_div):
+    for node in cmt_nodes(tweet_div):
+        if string(node) == weibo_tweet.REPOST_REASON:
+            return node
+    return None
+
+
+def parse_max_page(html):
+    page_input_list = page_input(html)
+    if page_input_list:
+        return int(page_input_list[0].get('value'))
+    return None
+
+
+def parse_follow(html_content):
+    """
+    关注列表页
+    :return: {'users': [(uid 或 HomePage, 是否需要抓取)], 'max_page': 总页数}
+    """
+    follow_html = document(html_content)
+    users = []
+    for td in follow_tds(follow_html):
+        a = first_a(td)[0].get('href')
+        usr_id_result = user_id_pattern.findall(a)
+        usr_id = usr_id_result[0] if usr_id_result else HomePage(a)
+        # 跳过公众号和企业号
+        row = td.getparent()
+        public_user = icon_imgs(row, src=PUBLIC_USER_ICON)
+        enterprise_user = icon_imgs(row, src=ENTERPRISE_USER_ICON)
+        users.append((usr_id, not public_user and not enterprise_user))
+    return {'users': users, 'max_page': parse_max_page(follow_html)}
+
+
+def find_comment_href(tweet_div):
+    """
+    转发微博的原文评论链接，没有返回 None
+    """
+    try:
+        return first(cc_a(descendant_divs(tweet_div)[-2])).get('href')
+    except Exception:
+        return None
+
+
+def extract_tweet(tweet_div):
+    """
+    搜索结果页、用户微博列表页中的一条微博
+    :return: weibo_tweet.Tweet
+    """
+    repost_reason = find_repost_reason(tweet_div)
+    if repost_reason is not None:  # 转发
+        parent = repost_reason.getparent()
+        return weibo_tweet.extract_forward(get_text(parent), get_text(ct_span(parent)[0]),
+                                           find_comment_href(tweet_div))
+    return weibo_tweet.extract_original(get_text(tweet_div), get_text(ct_span(tweet_div)[0]))
+
+
+def parse_search(html_content):
+    """
+    搜索结果页
+    :return: {'tweets': [微博], 'max_page': 总页数}，微博的 uid 可能是 HomePage
+    """
+    result_html = document(html_content)
+    max_page = None
+    total_count_str = next((text for text in all_text_nodes(result_html) if total_count_pattern.search(text)), None)
+    if total_count_str:
+        total_count_result = total_count_number_pattern.findall(total_count_str)
+        if total_count_result:
+            max_page = int(int(total_count_result[0]) / 10) - 1
+
+    tweets = []
+    for tweet_div in tweet_divs(result_html):
+        nk_div = first(nk_a(tweet_div))
+        if nk_div is not None:
+            nk_url = nk_div.get('href')
+            usr_id_result = user_id_pattern.findall(nk_url)
+            if usr_id_result:
+                usr_id = usr_id_result[0]
+            else:
+                usr_id = HomePage(nk_url)
+        else:
+            usr_id = 'unknown'
+        tweets.append(weibo_tweet.to_record(extract_tweet(tweet_div), tweet_div.get('id').strip('M_'), usr_id))
+    return {'tweets': tweets, 'max_page': max_page}
+
+
+def parse_user_tweet(html_content, uid):
+    """
+    用户微博列表页
+    :return: {'tweets': [微博], 'max_page': 总页数}
+    """
+    user_tweet_html = document(html_content)
+    tweets = []
+    for tweet_div in tweet_divs(user_tweet_html):
+        tweets.append(weibo_tweet.to_record(extract_tweet(tweet_div), tweet_div.get('id'), uid))
+    return {'tweets': tweets, 'max_page': parse_max_page(user_tweet_html)}
+
+
+def parse_user_info(html_content, user_id):
+    """
+    用户资料页，不包括微博数、粉丝数、关注数（在个人主页上，见 parse_view）
+    :return: 用户信息，没有昵称返回 None
+    """
+    user_info_html = document(html_content)
+    div_list = info_nodes(user_info_html)
+
+    base_info_index, edu_info_index, work_info_index = -1, -1, -1
+    base_info = ''
+    edu_info = ''
+    work_info = ''
+    tags = ''
+    user_info = {}
+    for index, div in enumerate(div_list):
+        text = get_text(div)
+        if text == u'基本信息':
+            base_info_index = index
+        elif text == u'学习经历':
+            edu_info_index = index
+        elif text == u'工作经历':
+            work_info_index = index
+    if base_info_index != -1:
+        b = div_list[base_info_index + 1]
+        tags = ','.join(map(get_text, first_a(b)))
+        base_info = get_text(b, ';')
+    if edu_info_index != -1:
+        edu_info = get_text(div_list[edu_info_index + 1], ';')
+
+    if work_info_index != -1:
+        work_info = get_text(div_list[work_info_index + 1], ';')
+    base_info += ';'
+    nickname = nickname_pattern.findall(base_info)
+    if not nickname:
+        return None
+    user_info['nickname'] = nickname[0] if nickname else 'unknown'
+    gender = gender_pattern.findall(base_info)
+    place = place_pattern.findall(base_info)
+    signature = signature_pattern.findall(base_info)
+    birthday = birthday_pattern.findall(base_info)
+    sex_orientation = sex_orientation_pattern.findall(base_info)
+    marriage = marriage_pattern.findall(base_info)
+    head_url = first(head_img(user_info_html))
+    if head_url is not None:
+        user_info['head'] = head_url.get('src')
+    user_info['tags'] = tags
+    user_info['gender'] = gender[0] if gender else 'unknown'
+    user_info['place'] = place[0] if place else 'unknown'
+    user_info['signature'] = signature[0] if signature else 'unknown'
+    user_info['birthday'] = birthday[0] if birthday else 'unknown'
+    user_info['sexOrientation'] = sex_orientation[0] if sex_orientation else 'unknown'
+    user_info['eduInfo'] = edu_info if edu_info else 'unknown'
+    user_info['marriage'] = marriage[0] if marriage else 'unknown'
+    user_info['workInfo'] = work_info if work_info else 'unknown'
+
+    user_info['type'] = 'user_info'
+    user_info['id'] = user_id
+    return user_info
+
+
+def parse_view(html_content):
+    """
+    个人主页上的微博数、粉丝数、关注数
+    :return: dict
+    """
+    home_page_html = document(html_content)
+    v = first(tip2_div(home_page_html))
+    result = {}
+    if v is not None:
+        content = get_text(v, ';')
+    else:
+        content = ''
+    tweet_r = view_tweet_pattern.findall(content)
+    result['tweetNum'] = tweet_r[0] if tweet_r else -1
+    fans_r = view_fans_pattern.findall(content)
+    result['fansNum'] = fans_r[0] if fans_r else -1
+    follow_r = view_follow_pattern.findall(content)
+    result['followNum'] = follow_r[0] if follow_r else -1
+    return result
+
+
+def parse_home_page_user_id(html_content):
+    """
+    从个人主页的“资料”链接中取 uid
+    :return: uid，没有找到返回 0
+    """
+    home_page_html = document(html_content)
+    for a in all_a(home_page_html):
+        if string(a) == '资料':
+            return a.get('href').split('/')[1]
+    return 0
+
+
+def parse_tweet_content(html, tweet_id, parent_tid=None):
+    """
+    评论页、转发页第一页顶部的微博
+    :param html: document 返回的根节点
+    :return: 微博，uid 可能是 HomePage；没有微博返回 None
+    """
+    tweet_div = first(top_tweet_div(html))
+    if tweet_div is not None:
+        tweet_user_a = first(first_a(tweet_div))
+        flag = False
+        if tweet_user_a is not None:
+            tweet = {}
+            tweet_user_href = tweet_user_a.get('href')
+            if tweet_user_href.startswith('/u/'):
+                tweet_user_id = tweet_user_href[3:]
+            else:
+                tweet_user_id = HomePage(tweet_user_href)
+            repost_reason = find_repost_reason(tweet_div)
+            if repost_reason is not None:
+                tweet['flag'] = weibo_tweet.FORWARD
+                comment_href = find_comment_href(tweet_div)
+                if comment_href is not None:
+                    tweet['sourceTid'] = weibo_tweet.source_tid(comment_href)
+                flag = True
+                content = weibo_tweet.split_forward_text(get_text(repost_reason.getparent()))[0]
+                tweet['content'] = content.strip()
+            else:
+                tweet_content = get_text(ctt_span(tweet_div)[0])
+                tweet['content'] = tweet_content.strip()
+            tweet_details = [div for div in plain_divs(html) if pms_nodes(div)]
+            tweet['sourceTid'] = parent_tid if parent_tid is not None \
+                else tweet['sourceTid'] if flag else ''
+            detail = get_text(tweet_details[0], ';').replace('\xa0', '')
+            like, transfer, comment = weibo_tweet.parse_counts(detail, 0)
+            tweet['id'] = tweet_id
+            tweet['like'] = like
+            tweet['transfer'] = transfer
+            tweet['comment'] = comment
+            tweet['type'] = 'tweet_info'
+            others = get_text(ct_nodes(tweet_div)[0])
+            if others:
+                others = others.split(weibo_tweet.SOURCE_SEPARATOR)
+                tweet['time'] = get_time(others[0])
+                if len(others) == 2:
+                    tweet['source'] = others[1]
+            tweet['uid'] = tweet_user_id
+            return tweet
+    return None
+
+
+def parse_repost(html_content, tweet_id, parent_tid=None, first_page=False):
+    """
+    转发列表页
+    :param first_page: 第一页还要解析顶部的微博和总页数
+    :return: {'tweet_ids': [转发的微博 id], 'tweet': 顶部的微博, 'max_page': 总页数}
+    """
+    tweet_repost_html = document(html_content)
+    tweet_ids = []
+    for div in c_nodes(tweet_repost_html):
+        span_cc = first(cc_span(div))
+        if span_cc is not None:
+            attitube_a = first(first_a(span_cc))
+            if attitube_a is not None:
+                href = attitube_a.get('href')
+                if len(href.split('/')) > 2:
+                    tweet_ids.append(href.split('/')[2])
+    result = {'tweet_ids': tweet_ids, 'tweet': None, 'max_page': None}
+    if first_page:
+        result['tweet'] = parse_tweet_content(tweet_repost_html, tweet_id, parent_tid)
+        result['max_page'] = parse_max_page(tweet_repost_html)
+    return result
+
+
+def parse_comments(html_content, tweet_id, parent_tid=None, first_page=False):
+    """
+    评论列表页
+    :param first_page: 第一页还要解析顶部的微博和总页数
+    :return: {'comments': [评论], 'tweet': 顶部的微博, 'max_page': 总页数}，评论的 userId 可能是 HomePage
+    """
+    comment_html = document(html_content)
+    comments = []
+    for comment_div in tweet_divs(comment_html):
+        comment_id = comment_div.get('id')
+        if not comment_id_pattern.search(comment_id):
+            continue
+        comment_info = {}
+        user_a = first(first_a(comment_div))
+        if user_a is not None:
+            user_href = user_a.get('href')
+            if user_href.startswith('/u/'):
+                user_id = user_href[3:]
+            else:
+                user_id = HomePage(user_href)
+            comment_info['userId'] = user_id
+            comment_info['content'] = get_text(ctt_nodes(comment_div)[0])
+            others = get_text(ct_nodes(comment_div)[0])
+            if others:
+                others = others.split(weibo_tweet.SOURCE_SEPARATOR)
+                comment_info['pubTime'] = get_time(others[0])
+                if len(others) == 2:
+                    comment_info['source'] = others[1]
+            comment_info['id'] = comment_id
+            comment_info['tweetId'] = tweet_id
+            comment_info['type'] = 'comment_info'
+            comments.append(comment_info)
+    result = {'comments': comments, 'tweet': None, 'max_page': None}
+    if first_page:
+        result['tweet'] = parse_tweet_content(comment_html, tweet_id, parent_tid)
+        result['max_page'] = parse_max_page(comment_html)
+    return result
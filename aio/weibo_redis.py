@@ -1,20 +1,93 @@
 import asyncio
 import aioredis
 import json
-from setting import LOGGER
-from pybloom import ScalableBloomFilter
+import os
+import random
+import socket
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from setting import LOGGER, JOB_FETCH_TIMEOUT, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_MAX_ATTEMPTS, \
+    RETRY_MOVE_INTERVAL, DEDUP_BACKEND, JOB_RELIABLE, JOB_VISIBILITY_TIMEOUT, JOB_POLL_INTERVAL, JOB_REAP_INTERVAL, \
+    COOKIE_POOL_STRATEGY, COOKIE_POOL_REFRESH_INTERVAL, HOMEPAGE_CACHE_SIZE, HOMEPAGE_NEGATIVE_TTL, \
+    CURSOR_STALE_TIMEOUT, CURSOR_RESUME_INTERVAL, JOB_CODEC
+from aio.weibo_bloom import LocalBloomFilter, RedisBloomFilter
+from aio.weibo_job_codec import JobCodec
+
+
+# 把到期的重试任务放回原队列，member 格式为 job_type|任务（JobCodec 编码）
+MOVE_DUE_JOBS_SCRIPT = """
+local jobs = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(jobs) do
+    local sep = string.find(member, '|', 1, true)
+    redis.call('lpush', string.sub(member, 1, sep - 1), string.sub(member, sep + 1))
+    redis.call('zrem', KEYS[1], member)
+end
+return #jobs
+"""
+
+# 可靠队列取任务：KEYS = [处理中列表, 租约有序集合, 队列...]，ARGV = [租约到期时间, worker_id]
+# 依次尝试各个队列，取到的任务原子地放入处理中列表并写入租约，member 格式为 worker_id|job_type|任务
+RELIABLE_FETCH_SCRIPT = """
+for i = 3, #KEYS do
+    local job = redis.call('rpoplpush', KEYS[i], KEYS[1])
+    if job then
+        redis.call('zadd', KEYS[2], ARGV[1], ARGV[2] .. '|' .. KEYS[i] .. '|' .. job)
+        return {KEYS[i], job}
+    end
+end
+return false
+"""
+
+# 把租约过期的任务从 worker 的处理中列表移回队列头部
+REAP_LEASES_SCRIPT = """
+local leases = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(leases) do
+    local first = string.find(member, '|', 1, true)
+    local second = string.find(member, '|', first + 1, true)
+    local job_type = string.sub(member, first + 1, second - 1)
+    local job = string.sub(member, second + 1)
+    redis.call('lrem', ARGV[3] .. string.sub(member, 1, first - 1), 1, job)
+    redis.call('rpush', job_type, job)
+    redis.call('zrem', KEYS[1], member)
+end
+return #leases
+"""
 
 
 class RedisJob(object):
     _pool = None
+    retry_key = 'retry'
+    dead_key = 'retry:dead'
+    lease_key = 'leases'
+    processing_prefix = 'processing:'
 
-    url_filter = ScalableBloomFilter(mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+    url_filter = LocalBloomFilter()
 
     def __init__(self, **kwargs):
         self._host = kwargs['host'] if 'host' in kwargs else 'redis://localhost:6378'
         self._db = kwargs['db'] if 'db' in kwargs else 1
         self._minsize = kwargs['minsize'] if 'minsize' in kwargs else 5
         self._maxsize = kwargs['maxsize'] if 'maxsize' in kwargs else 10
+        # dedup 为 redis 时 url 去重使用集群共用的 redis 布隆过滤器
+        if (kwargs['dedup'] if 'dedup' in kwargs else DEDUP_BACKEND) == 'redis':
+            self.url_filter = RedisBloomFilter('bloom:url', host=self._host, db=self._db)
+        self._reliable = kwargs['reliable'] if 'reliable' in kwargs else JOB_RELIABLE
+        self._visibility_timeout = kwargs['visibility_timeout'] if 'visibility_timeout' in kwargs \
+            else JOB_VISIBILITY_TIMEOUT
+        self.worker_id = kwargs['worker_id'] if 'worker_id' in kwargs else '%s:%d' % (socket.gethostname(), os.getpid())
+        self.processing_key = self.processing_prefix + self.worker_id
+        self._retry_base_delay = kwargs['retry_base_delay'] if 'retry_base_delay' in kwargs else RETRY_BASE_DELAY
+        self._retry_move_interval = kwargs['retry_move_interval'] if 'retry_move_interval' in kwargs \
+            else RETRY_MOVE_INTERVAL
+        # 任务在 redis 中的编码，默认按 weibo.cn 的 url 模板
+        self.codec = kwargs['codec'] if 'codec' in kwargs else JobCodec(compact=JOB_CODEC == 'compact')
+        # 可靠模式下还没有 ack 的任务：id(job_info) -> (job_type, 任务编码后的 bytes)
+        self._in_flight = {}
+        # connect() 创建的专用连接，close 时关闭还没有释放的
+        self._connections = set()
+        # 停止后 jobs() 不再取新任务
+        self.stopping = False
 
     async def init_pool(self):
         LOGGER.info("init redis pool (host: %s, db: %d, minsize: %d, maxsize: %d)" %
@@ -23,30 +96,222 @@ class RedisJob(object):
             self._host, db=self._db,
             minsize=self._minsize, maxsize=self._maxsize)
 
-    async def push_job(self, job_type, job_info):
+    async def push_job(self, job_type, job_info, dedup=True):
+        await self.push_jobs(job_type, [job_info], dedup)
+
+    async def push_jobs(self, job_type, job_infos, dedup=True):
+        """
+        批量放入任务：整批去重后只用一次 LPUSH 写入。
+        LPUSH 成功后才把 url 写入布隆过滤器，写入失败或进程退出时 url 不会被永久标记为已抓取；
+        多个节点同时放入同一个 url 时可能重复抓取一次，但不会漏掉
+        :param job_type: 队列名
+        :param job_infos: 任务列表
+        :param dedup: 是否按 url 去重，定时重新抓取的任务 url 和之前的相同，不能去重
+        """
         if not self._pool:
             await self.init_pool()
-        url = job_info.get('url', '')
-        if url and url in self.url_filter:
-            LOGGER.warn("%s job filtered. %s" % (job_type, str(job_info)))
+        urls = [job_info['url'] for job_info in job_infos if job_info.get('url')] if dedup else []
+        seen = iter(await self.url_filter.contains_many(urls))
+        jobs, new_urls, batch_urls = [], [], set()
+        for job_info in job_infos:
+            url = job_info.get('url') if dedup else None
+            # 同一批中重复的 url 也只放入一次
+            if url and (next(seen) or url in batch_urls):
+                LOGGER.warn("%s job filtered. %s" % (job_type, str(job_info)))
+                continue
+            if url:
+                new_urls.append(url)
+                batch_urls.add(url)
+            jobs.append(job_info)
+        if not jobs:
             return
-        else:
-            self.url_filter.add(url)
         with await self._pool as conn:
-            await conn.execute('lpush', str(job_type), json.dumps(job_info))
-            LOGGER.info("push %s job into redis: %s" % (job_type, str(job_info)))
+            await conn.execute('lpush', str(job_type), *[self.codec.encode(job_type, job_info) for job_info in jobs])
+        await self.url_filter.add_many(new_urls)
+        if len(jobs) == 1:
+            LOGGER.info("push %s job into redis: %s" % (job_type, jobs[0]))
+        else:
+            LOGGER.info("push %d %s jobs into redis" % (len(jobs), job_type))
 
     async def fetch_job(self, job_type):
         if not self._pool:
             await self.init_pool()
         with await self._pool as conn:
-            job_info = await conn.execute('rpop', job_type)
-            if job_info:
+            job = await conn.execute('rpop', job_type)
+            if job:
+                job_info = self.codec.decode(job)
                 LOGGER.info('fetched job: %s' % job_info)
-                return json.loads(job_info)
+                return job_info
             else:
                 return None
 
+    async def fetch_job_blocking(self, job_types, timeout=JOB_FETCH_TIMEOUT, conn=None):
+        """
+        阻塞地从多个队列中取任务（BRPOP），所有队列都为空时最多等待 timeout 秒
+        :param job_types: 队列名列表，排在前面的优先
+        :param timeout: 超时时间（秒）
+        :param conn: 专用连接，不传则从连接池中借用
+        :return: (job_type, job_info)，超时返回 (None, None)
+        """
+        if isinstance(job_types, str):
+            job_types = [job_types]
+        if self._reliable:
+            return await self._fetch_reliable(job_types, timeout, conn)
+        result = await self._execute(conn, 'brpop', *job_types, timeout)
+        if result:
+            job_type, job = result
+            job_info = self.codec.decode(job)
+            LOGGER.info('fetched job: %s' % job_info)
+            return job_type.decode('utf-8'), job_info
+        return None, None
+
+    async def _execute(self, conn, *args):
+        if conn:
+            return await conn.execute(*args)
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            return await conn.execute(*args)
+
+    async def _fetch_reliable(self, job_types, timeout, conn):
+        """
+        可靠模式取任务，lua 脚本没法阻塞，队列为空时按 JOB_POLL_INTERVAL 轮询直到超时
+        """
+        keys = [self.processing_key, self.lease_key] + list(job_types)
+        deadline = time.time() + timeout
+        while True:
+            result = await self._execute(conn, 'eval', RELIABLE_FETCH_SCRIPT, len(keys), *keys,
+                                         time.time() + self._visibility_timeout, self.worker_id)
+            if result:
+                # 租约和处理中列表里是编码后的原始 bytes，ack 时原样删除
+                job_type, job = result[0].decode('utf-8'), result[1]
+                job_info = self.codec.decode(job)
+                LOGGER.info('fetched job: %s' % job_info)
+                self._in_flight[id(job_info)] = (job_type, job)
+                return job_type, job_info
+            if time.time() >= deadline:
+                return None, None
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    async def ack(self, *job_infos):
+        """
+        可靠模式下确认任务已处理完，从处理中列表和租约中删除，多个任务的 ack 在一个连接上 pipeline 发送。
+        非可靠模式下什么也不做
+        """
+        acked = [self._in_flight.pop(id(job_info)) for job_info in job_infos if id(job_info) in self._in_flight]
+        if not acked:
+            return
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            commands = []
+            for job_type, job in acked:
+                commands.append(conn.execute('lrem', self.processing_key, 1, job))
+                commands.append(conn.execute('zrem', self.lease_key,
+                                             ('%s|%s|' % (self.worker_id, job_type)).encode('utf-8') + job))
+            await asyncio.gather(*commands)
+
+    async def reap_expired_leases(self, interval=JOB_REAP_INTERVAL, batch=100):
+        """
+        定时把租约过期的任务放回队列，多个节点同时运行也不会重复放回
+        """
+        while True:
+            reaped = await self._execute(None, 'eval', REAP_LEASES_SCRIPT, 1, self.lease_key,
+                                         time.time(), batch, self.processing_prefix)
+            if reaped:
+                LOGGER.warn('%d jobs with expired lease moved back to queue' % reaped)
+            if reaped < batch:
+                await asyncio.sleep(interval)
+
+    async def connect(self):
+        """
+        BRPOP 会一直占用连接，阻塞取任务的协程使用自己的专用连接，不占连接池
+        """
+        conn = await aioredis.create_connection(self._host, db=self._db)
+        self._connections.add(conn)
+        return conn
+
+    async def disconnect(self, conn):
+        """
+        关闭 connect() 创建的专用连接
+        """
+        self._connections.discard(conn)
+        conn.close()
+        await conn.wait_closed()
+
+    async def depths(self, job_types):
+        """
+        :return: 各个队列的长度，LLEN 在一个连接上 pipeline 发送
+        """
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            return await asyncio.gather(*[conn.execute('llen', job_type) for job_type in job_types])
+
+    def stop(self):
+        self.stopping = True
+
+    async def jobs(self, *job_types, timeout=JOB_FETCH_TIMEOUT):
+        """
+        任务的异步迭代器，队列为空时阻塞在 redis 上而不是空转，调用 stop 后迭代结束。
+        每个迭代器使用自己的专用连接，可靠模式下取到的任务处理完后需要调用 ack
+        :param job_types: 队列名
+        :param timeout: 单次 BRPOP 的超时时间（秒）
+        """
+        conn = await self.connect()
+        try:
+            while not self.stopping:
+                job_type, job_info = await self.fetch_job_blocking(job_types, timeout, conn=conn)
+                if job_info:
+                    yield job_type, job_info
+        finally:
+            await self.disconnect(conn)
+
+    def member(self, job_type, job_info):
+        """
+        重试有序集合、死信队列中的 member：job_type|任务
+        """
+        return ('%s|' % job_type).encode('utf-8') + self.codec.encode(job_type, job_info)
+
+    async def retry_job(self, job_type, job_info, attempt=True):
+        """
+        失败的任务放入重试有序集合，score 为下次执行的时间，指数退避加随机抖动，
+        超过最大重试次数放入死信队列
+        :param attempt: False 时不计入重试次数，用于没有可用账号等和任务本身无关的失败
+        :return: 超过最大重试次数放入死信队列时返回 False
+        """
+        if not self._pool:
+            await self.init_pool()
+        attempts = job_info.get('retry', 0) + (1 if attempt else 0)
+        if attempt:
+            job_info = dict(job_info, retry=attempts)
+        with await self._pool as conn:
+            if attempts > RETRY_MAX_ATTEMPTS:
+                LOGGER.error('%s job failed %d times, give up: %s' % (job_type, attempts - 1, str(job_info)))
+                await conn.execute('lpush', self.dead_key, self.member(job_type, job_info))
+                return False
+            delay = min(RETRY_MAX_DELAY, self._retry_base_delay * 2 ** max(0, attempts - 1))
+            delay = random.uniform(delay / 2, delay)
+            await conn.execute('zadd', self.retry_key, time.time() + delay, self.member(job_type, job_info))
+            LOGGER.info('retry %s job in %ds: %s' % (job_type, delay, str(job_info)))
+        return True
+
+    async def move_due_jobs(self, interval=None, batch=100):
+        """
+        定时把到期的重试任务放回原来的队列，多个节点同时运行也不会重复放回
+        :param interval: 检查间隔，默认 retry_move_interval
+        """
+        interval = interval or self._retry_move_interval
+        if not self._pool:
+            await self.init_pool()
+        while True:
+            with await self._pool as conn:
+                moved = await conn.execute('eval', MOVE_DUE_JOBS_SCRIPT, 1, self.retry_key, time.time(), batch)
+            if moved:
+                LOGGER.info('%d retry jobs moved back to queue' % moved)
+            if moved < batch:
+                await asyncio.sleep(interval)
+
     async def clean(self):
         if not self._pool:
             await self.init_pool()
@@ -56,9 +321,22 @@ class RedisJob(object):
                 LOGGER.info("del %s" % key)
                 await conn.execute('del', key)
 
+    async def close(self):
+        """
+        关闭连接池、没有释放的专用连接（阻塞取任务的协程被取消时可能没有走到 finally）和 url 去重过滤器
+        """
+        for conn in list(self._connections):
+            await self.disconnect(conn)
+        if self._pool:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+        await self.url_filter.close()
+
 
 class RedisCookie(object):
     _pool = None
+    invalidate_channel = 'account:invalidate'
 
     def __init__(self, **kwargs):
         self._host = kwargs['host'] if 'host' in kwargs else 'redis://localhost:6378'
@@ -78,12 +356,14 @@ class RedisCookie(object):
             await self.init_pool()
         with await self._pool as conn:
             user = await conn.execute('spop', 'users')
+            if user is None:
+                LOGGER.warn('cookies not get')
+                return None
             cookies_info = await conn.execute('hget', 'account', user)
             if cookies_info:
                 user_cookies = cookies_info.decode('utf-8')
                 user_cookies_json = json.loads(user_cookies)
-                conn.execute('sadd', 'users', user)
-                conn.close()
+                await conn.execute('sadd', 'users', user)
                 return user_cookies_json
 
     async def close(self):
@@ -97,6 +377,308 @@ class RedisCookie(object):
         await self.close()
 
 
+class LocalCookiePool(RedisCookie):
+    """
+    进程内的 cookie 池：启动时一次性把所有账号加载到内存，之后按轮询或最久未使用分配账号，
+    取 cookie 不再访问 redis。后台按间隔或收到 account:invalidate 通知时从 redis 重新加载
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._strategy = kwargs['strategy'] if 'strategy' in kwargs else COOKIE_POOL_STRATEGY
+        self._refresh_interval = kwargs['refresh_interval'] if 'refresh_interval' in kwargs \
+            else COOKIE_POOL_REFRESH_INTERVAL
+        # user_name -> cookies，lru 策略下按最近使用排序
+        self._accounts = OrderedDict()
+        self._order = []
+        self._index = 0
+        self._loading = None
+        self._refresher = None
+
+    async def load(self):
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            users = await conn.execute('smembers', 'users')
+            values = await conn.execute('hmget', 'account', *users) if users else []
+        accounts = OrderedDict()
+        for value in values:
+            if value:
+                user_cookies_json = json.loads(value.decode('utf-8'))
+                accounts[user_cookies_json['user_name']] = user_cookies_json
+        # 保留原来的使用顺序，新账号排在最前面
+        for user_name in reversed(list(accounts)):
+            if user_name not in self._accounts:
+                accounts.move_to_end(user_name, last=False)
+        for user_name in self._accounts:
+            if user_name in accounts:
+                accounts.move_to_end(user_name)
+        self._accounts = accounts
+        self._order = list(accounts)
+        LOGGER.info('%d accounts loaded into cookie pool' % len(accounts))
+
+    async def _refresh_loop(self):
+        conn = await aioredis.create_connection(self._host, db=self._db)
+        try:
+            channel, = await conn.execute_pubsub('subscribe', self.invalidate_channel)
+            while True:
+                try:
+                    user_name = await asyncio.wait_for(channel.get(), self._refresh_interval)
+                    LOGGER.info('cookies of %s invalidated' % user_name)
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    await self.load()
+                except Exception as e:
+                    LOGGER.error('refresh cookie pool failed: %s' % e)
+        finally:
+            conn.close()
+
+    def remove(self, user_name):
+        """
+        账号冷却或下线时立即从本进程的池中移除，其他节点通过 account:invalidate 通知刷新
+        """
+        if self._accounts.pop(user_name, None) is not None:
+            self._order = list(self._accounts)
+
+    async def accounts(self):
+        """
+        第一次调用时加载账号并启动后台刷新
+        :return: user_name -> cookies，按最近使用排序，最久未使用的在前
+        """
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self.load())
+            self._refresher = asyncio.ensure_future(self._refresh_loop())
+        if not self._accounts:
+            await self._loading
+        return self._accounts
+
+    def touch(self, user_name):
+        """
+        标记账号刚被使用过
+        """
+        if user_name in self._accounts:
+            self._accounts.move_to_end(user_name)
+
+    async def fetch_cookies(self):
+        accounts = await self.accounts()
+        if not accounts:
+            LOGGER.warn('cookies not get')
+            return None
+        if self._strategy == 'lru':
+            user_name = next(iter(accounts))
+            self.touch(user_name)
+            return accounts[user_name]
+        self._index = (self._index + 1) % len(self._order)
+        return self._accounts[self._order[self._index]]
+
+    async def close(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+            self._loading = None
+        await super().close()
+
+
+class PageCursor(object):
+    """
+    游标分页的进度：每个资源（用户的微博列表、一条微博的评论）在 cursor:<任务类型> hash 中保存下一页的页码，
+    队列里同时只有一个该资源的分页任务。页码和检查点不一致的任务是过期的重复任务，直接丢弃；
+    检查点长时间没有推进说明任务丢失，由 resume_stale 重新放回队列
+    """
+    _pool = None
+    key_prefix = 'cursor:'
+
+    def __init__(self, **kwargs):
+        self._host = kwargs['host'] if 'host' in kwargs else 'redis://localhost:6378'
+        self._db = kwargs['db'] if 'db' in kwargs else 1
+        self._stale_timeout = kwargs['stale_timeout'] if 'stale_timeout' in kwargs else CURSOR_STALE_TIMEOUT
+
+    async def init_pool(self):
+        self._pool = await aioredis.create_pool(self._host, db=self._db, minsize=1, maxsize=5)
+
+    async def _execute(self, *args):
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            return await conn.execute(*args)
+
+    async def get(self, job_type, resource_id):
+        """
+        :return: {'page': 下一页, 'max_page': 总页数, 'time': 更新时间, ...}，没有进行中的分页返回 None
+        """
+        value = await self._execute('hget', self.key_prefix + job_type, resource_id)
+        return json.loads(value.decode('utf-8')) if value else None
+
+    async def save(self, job_type, resource_id, checkpoint):
+        """
+        :param checkpoint: 至少包含 page、max_page，其他字段是分页结束时需要的状态
+        """
+        await self._execute('hset', self.key_prefix + job_type, resource_id,
+                            json.dumps(dict(checkpoint, time=time.time())))
+
+    async def finish(self, job_type, resource_id):
+        await self._execute('hdel', self.key_prefix + job_type, resource_id)
+
+    async def abandon(self, job_type, resource_id, page):
+        """
+        第 page 页的任务进入死信队列后删除检查点，否则 resume_stale 会一直把它放回队列。
+        检查点已经不在这一页（过期的重复任务）时不删除
+        """
+        checkpoint = await self.get(job_type, resource_id)
+        if checkpoint is not None and checkpoint['page'] == page:
+            LOGGER.warn('abandon %s cursor of %s at page %d' % (job_type, resource_id, page))
+            await self.finish(job_type, resource_id)
+
+    async def stale(self, job_type):
+        """
+        :return: 超过 stale_timeout 没有推进的 [(资源 id, 检查点)]
+        """
+        values = await self._execute('hgetall', self.key_prefix + job_type)
+        deadline = time.time() - self._stale_timeout
+        cursors = []
+        for resource_id, value in zip(values[::2], values[1::2]):
+            checkpoint = json.loads(value.decode('utf-8'))
+            if checkpoint['time'] < deadline:
+                cursors.append((resource_id.decode('utf-8'), checkpoint))
+        return cursors
+
+    async def resume_stale(self, job_types, make_job, push_job, interval=CURSOR_RESUME_INTERVAL):
+        """
+        定时把丢失的分页任务按检查点重新放回队列
+        :param make_job: (任务类型, 资源 id, 检查点) -> 任务
+        :param push_job: RedisJob.push_job
+        """
+        while True:
+            for job_type in job_types:
+                for resource_id, checkpoint in await self.stale(job_type):
+                    LOGGER.warn('resume %s cursor of %s at page %d' % (job_type, resource_id, checkpoint['page']))
+                    await self.save(job_type, resource_id, checkpoint)
+                    await push_job(job_type, make_job(job_type, resource_id, checkpoint))
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        if self._pool:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+
+class TimelineWatermark(object):
+    """
+    每个用户已经抓到的最新一条微博 {'id': 微博 id, 'time': 发布时间}，保存在 watermark:tweet hash 中，
+    再次抓取用户微博时翻到已经抓过的微博就停止
+    """
+    _pool = None
+    key = 'watermark:tweet'
+
+    def __init__(self, **kwargs):
+        self._host = kwargs['host'] if 'host' in kwargs else 'redis://localhost:6378'
+        self._db = kwargs['db'] if 'db' in kwargs else 1
+
+    async def init_pool(self):
+        self._pool = await aioredis.create_pool(self._host, db=self._db, minsize=1, maxsize=5)
+
+    async def get(self, uid):
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            value = await conn.execute('hget', self.key, uid)
+        return json.loads(value.decode('utf-8')) if value else None
+
+    async def set(self, uid, mark):
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            await conn.execute('hset', self.key, uid, json.dumps(mark))
+
+    async def close(self):
+        if self._pool:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+
+class HomePageCache(object):
+    """
+    个人主页（weibo.cn/someone 这样的自定义域名）到 uid 的缓存，所有节点共用 redis 中的 hash，
+    前面加一个进程内的 LRU。个人主页上没有 uid 的也缓存，negative_ttl 秒后重新下载确认
+    """
+    _pool = None
+    key = 'homepage:uid'
+
+    def __init__(self, **kwargs):
+        self._host = kwargs['host'] if 'host' in kwargs else 'redis://localhost:6378'
+        self._db = kwargs['db'] if 'db' in kwargs else 1
+        self._max_size = kwargs['max_size'] if 'max_size' in kwargs else HOMEPAGE_CACHE_SIZE
+        self._negative_ttl = kwargs['negative_ttl'] if 'negative_ttl' in kwargs else HOMEPAGE_NEGATIVE_TTL
+        # 个人主页路径 -> (uid, 过期时间)，uid 为 0 表示主页上没有 uid，找到的 uid 不过期
+        self._local = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def init_pool(self):
+        self._pool = await aioredis.create_pool(self._host, db=self._db, minsize=1, maxsize=5)
+
+    @staticmethod
+    def path_of(url):
+        """
+        相对路径和完整 url 统一成路径作为 key
+        """
+        return urlsplit(url).path
+
+    def _remember(self, path, uid, expire_at):
+        self._local[path] = (uid, expire_at)
+        self._local.move_to_end(path)
+        while len(self._local) > self._max_size:
+            self._local.popitem(last=False)
+
+    async def get(self, url):
+        """
+        :return: uid，主页上没有 uid 返回 0，不在缓存中返回 None
+        """
+        path = self.path_of(url)
+        now = time.time()
+        if path in self._local:
+            uid, expire_at = self._local[path]
+            if expire_at is None or expire_at > now:
+                self._local.move_to_end(path)
+                self.hits += 1
+                return uid
+            del self._local[path]
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            value = await conn.execute('hget', self.key, path)
+        if value is not None:
+            # 没有 uid 的记录保存为 0|过期时间
+            uid, _, expire_at = value.decode('utf-8').partition('|')
+            expire_at = float(expire_at) if expire_at else None
+            if expire_at is None or expire_at > now:
+                uid = 0 if uid == '0' else uid
+                self._remember(path, uid, expire_at)
+                self.hits += 1
+                return uid
+        self.misses += 1
+        return None
+
+    async def set(self, url, uid):
+        path = self.path_of(url)
+        if uid:
+            expire_at, value = None, str(uid)
+        else:
+            expire_at = time.time() + self._negative_ttl
+            uid, value = 0, '0|%d' % expire_at
+        self._remember(path, uid, expire_at)
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            await conn.execute('hset', self.key, path, value)
+
+    async def close(self):
+        if self._pool:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+
 if __name__ == '__main__':
     from weibo_cn import JobType
     loop = asyncio.get_event_loop()
@@ -0,0 +1,192 @@
+# -*- coding:utf-8 -*-
+"""
+关注列表的定时重新抓取：用户和热门微博放在 schedule 有序集合中，score 为下次抓取的时间，
+到期后放入 user/tweet 或 comment 任务。有新内容的缩短间隔，没有变化的间隔加倍，账号额度留给正在变化的内容。
+python -m aio.weibo_scheduler watch <uid> [<uid> ...]
+python -m aio.weibo_scheduler unwatch <uid> [<uid> ...]
+python -m aio.weibo_scheduler list
+"""
+import asyncio
+import json
+import sys
+import time
+
+import aioredis
+
+from setting import LOGGER, SCHEDULE_USER_INTERVAL, SCHEDULE_TWEET_INTERVAL, SCHEDULE_MIN_INTERVAL, \
+    SCHEDULE_MAX_INTERVAL, SCHEDULE_TWEET_HORIZON, SCHEDULE_RELEASE_INTERVAL
+from aio import weibo_tweet
+
+USER = 'user'
+COMMENT = 'comment'
+
+# 取出到期的成员，同时按各自的间隔推后下次抓取时间，多个节点同时运行也不会重复放出。
+# KEYS = [有序集合, 状态 hash]，ARGV = [当前时间, 数量]，返回 [member, 状态, ...]
+RELEASE_DUE_SCRIPT = """
+local members = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local result = {}
+for _, member in ipairs(members) do
+    local state = redis.call('hget', KEYS[2], member)
+    if state then
+        redis.call('zadd', KEYS[1], tonumber(ARGV[1]) + cjson.decode(state)['interval'], member)
+        result[#result + 1] = member
+        result[#result + 1] = state
+    else
+        redis.call('zrem', KEYS[1], member)
+    end
+end
+return result
+"""
+
+
+def timestamp_of(tweet_time):
+    """
+    get_time 转换后的时间转成时间戳，无法转换返回 None
+    """
+    if not weibo_tweet.time_comparable_pattern.match(tweet_time):
+        return None
+    return time.mktime(time.strptime(tweet_time[:16], '%Y-%m-%d %H:%M'))
+
+
+class RecrawlScheduler(object):
+    _pool = None
+    key = 'schedule'
+    state_key = 'schedule:state'
+
+    def __init__(self, **kwargs):
+        self._host = kwargs['host'] if 'host' in kwargs else 'redis://localhost:6378'
+        self._db = kwargs['db'] if 'db' in kwargs else 1
+        self._min_interval = kwargs['min_interval'] if 'min_interval' in kwargs else SCHEDULE_MIN_INTERVAL
+        self._max_interval = kwargs['max_interval'] if 'max_interval' in kwargs else SCHEDULE_MAX_INTERVAL
+        self._tweet_horizon = kwargs['tweet_horizon'] if 'tweet_horizon' in kwargs else SCHEDULE_TWEET_HORIZON
+        self.initial_intervals = {USER: SCHEDULE_USER_INTERVAL, COMMENT: SCHEDULE_TWEET_INTERVAL}
+
+    async def init_pool(self):
+        self._pool = await aioredis.create_pool(self._host, db=self._db, minsize=1, maxsize=5)
+
+    async def _execute(self, *args):
+        if not self._pool:
+            await self.init_pool()
+        with await self._pool as conn:
+            return await conn.execute(*args)
+
+    async def watch(self, kind, resource_id, due=None):
+        """
+        加入关注列表，已经在列表中的保持原来的间隔
+        :param kind: USER 或 COMMENT
+        :param due: 第一次抓取的时间，默认立即
+        """
+        member = '%s|%s' % (kind, resource_id)
+        state = {'interval': self.initial_intervals[kind], 'since': time.time()}
+        if await self._execute('hsetnx', self.state_key, member, json.dumps(state)):
+            await self._execute('zadd', self.key, due or time.time(), member)
+            LOGGER.info('%s %s added to schedule' % (kind, resource_id))
+
+    async def unwatch(self, kind, resource_id):
+        member = '%s|%s' % (kind, resource_id)
+        await self._execute('zrem', self.key, member)
+        await self._execute('hdel', self.state_key, member)
+
+    async def state(self, kind, resource_id):
+        """
+        :return: 状态，不在关注列表中返回 None
+        """
+        value = await self._execute('hget', self.state_key, '%s|%s' % (kind, resource_id))
+        return json.loads(value.decode('utf-8')) if value else None
+
+    async def observe(self, kind, resource_id, changed, **fields):
+        """
+        抓取结果的反馈：有变化时间隔减半，没有变化时加倍，不在关注列表中的忽略
+        :param fields: 一起保存的其他状态，比如微博的评论数
+        """
+        state = await self.state(kind, resource_id)
+        if state is None:
+            return
+        interval = state['interval'] / 2 if changed else state['interval'] * 2
+        state.update(fields, interval=min(self._max_interval, max(self._min_interval, interval)))
+        member = '%s|%s' % (kind, resource_id)
+        await self._execute('hset', self.state_key, member, json.dumps(state))
+        await self._execute('zadd', self.key, 'XX', time.time() + state['interval'], member)
+
+    async def watch_tweets(self, uid, tweets, since=None):
+        """
+        关注列表中的用户发的新微博，在 tweet_horizon 内定时重新抓取评论
+        :param since: 上次抓到的最新微博，只关注比它新的
+        """
+        if await self.state(USER, uid) is None:
+            return
+        now = time.time()
+        for tweet in tweets:
+            published = timestamp_of(tweet['time'])
+            if published is None or now - published > self._tweet_horizon:
+                continue
+            if since is not None and tweet['time'] <= since['time']:
+                continue
+            await self.watch(COMMENT, tweet['id'])
+
+    async def release_due(self, batch=100):
+        """
+        :return: 到期的 [(kind, 资源 id, 状态)]，超过 tweet_horizon 的微博移出关注列表
+        """
+        values = await self._execute('eval', RELEASE_DUE_SCRIPT, 2, self.key, self.state_key, time.time(), batch)
+        due = []
+        for member, value in zip(values[::2], values[1::2]):
+            kind, resource_id = member.decode('utf-8').split('|', 1)
+            state = json.loads(value.decode('utf-8'))
+            if kind == COMMENT and time.time() - state['since'] > self._tweet_horizon:
+                await self.unwatch(kind, resource_id)
+                continue
+            due.append((kind, resource_id, state))
+        return due
+
+    async def run(self, push_due, interval=SCHEDULE_RELEASE_INTERVAL, batch=100):
+        """
+        定时放出到期的任务
+        :param push_due: 参数为 release_due 的结果
+        """
+        while True:
+            due = await self.release_due(batch)
+            if due:
+                LOGGER.info('%d scheduled recrawls due' % len(due))
+                await push_due(due)
+            if len(due) < batch:
+                await asyncio.sleep(interval)
+
+    async def members(self):
+        """
+        :return: [(member, 下次抓取时间, 状态)]
+        """
+        values = await self._execute('zrange', self.key, 0, -1, 'WITHSCORES')
+        states = await self._execute('hgetall', self.state_key)
+        states = dict(zip(states[::2], states[1::2]))
+        return [(member.decode('utf-8'), float(score), json.loads(states[member].decode('utf-8')))
+                for member, score in zip(values[::2], values[1::2]) if member in states]
+
+    async def close(self):
+        if self._pool:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+
+async def command(action, uids):
+    scheduler = RecrawlScheduler()
+    try:
+        if action == 'watch':
+            for uid in uids:
+                await scheduler.watch(USER, uid)
+        elif action == 'unwatch':
+            for uid in uids:
+                await scheduler.unwatch(USER, uid)
+        else:
+            for member, due, state in await scheduler.members():
+                print('%-40s due %s  interval %ds' % (member, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(due)),
+                                                      state['interval']))
+    finally:
+        await scheduler.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('watch', 'unwatch', 'list'):
+        print(__doc__)
+        sys.exit(1)
+    asyncio.get_event_loop().run_until_complete(command(sys.argv[1], sys.argv[2:]))
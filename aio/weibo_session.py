@@ -0,0 +1,109 @@
+# -*- coding:utf-8 -*-
+import asyncio
+from collections import OrderedDict
+
+import aiohttp
+
+from setting import LOGGER, SESSION_POOL_SIZE, SESSION_LIMIT_PER_HOST, SESSION_KEEPALIVE_TIMEOUT, SESSION_DNS_TTL
+
+
+class SessionEntry(object):
+    __slots__ = ('login_time', 'session', 'users', 'retired')
+
+    def __init__(self, login_time, session):
+        self.login_time = login_time
+        self.session = session
+        # 正在使用这个 session 的请求数
+        self.users = 0
+        # 已经从池中移除，最后一个请求结束后关闭
+        self.retired = False
+
+
+class SessionPool(object):
+    """
+    每个账号对应一个长期存活的 aiohttp session，复用 keep-alive 连接和 DNS 缓存，
+    避免每次请求都重新建立 TCP 连接和 TLS 握手。
+    被淘汰、账号下线或重新登录的 session 先从池中移除，等正在进行的请求结束后再关闭
+    """
+
+    def __init__(self, **kwargs):
+        self._max_size = kwargs['max_size'] if 'max_size' in kwargs else SESSION_POOL_SIZE
+        self._limit_per_host = kwargs['limit_per_host'] if 'limit_per_host' in kwargs else SESSION_LIMIT_PER_HOST
+        self._keepalive_timeout = kwargs['keepalive_timeout'] if 'keepalive_timeout' in kwargs \
+            else SESSION_KEEPALIVE_TIMEOUT
+        self._dns_ttl = kwargs['dns_ttl'] if 'dns_ttl' in kwargs else SESSION_DNS_TTL
+        # user_name -> SessionEntry，按最近使用排序
+        self._sessions = OrderedDict()
+        # 已经移除、还有请求在使用的 session
+        self._retired = set()
+        # 正在关闭的 session
+        self._closing = set()
+
+    def _create_session(self, cookies):
+        connector = aiohttp.TCPConnector(limit_per_host=self._limit_per_host,
+                                         keepalive_timeout=self._keepalive_timeout,
+                                         use_dns_cache=True,
+                                         ttl_dns_cache=self._dns_ttl,
+                                         verify_ssl=False)
+        return aiohttp.ClientSession(cookies=cookies['cookies'], connector=connector)
+
+    def acquire(self, cookies):
+        """
+        获取账号对应的 session，账号重新登录后（login_time 变化）会重建 session。
+        查找和创建之间没有 await，同一个账号的并发请求不会各自创建 session；用完必须调用 release
+        :param cookies: RedisCookie.fetch_cookies 返回的账号信息
+        :return: SessionEntry，entry.session 为 aiohttp.ClientSession
+        """
+        user_name = cookies['user_name']
+        login_time = cookies.get('login_time')
+        entry = self._sessions.get(user_name)
+        if entry and (entry.login_time != login_time or entry.session.closed):
+            self.evict(user_name)
+            entry = None
+        if entry is None:
+            entry = SessionEntry(login_time, self._create_session(cookies))
+            self._sessions[user_name] = entry
+            while len(self._sessions) > self._max_size:
+                self.evict(next(iter(self._sessions)))
+        else:
+            self._sessions.move_to_end(user_name)
+        entry.users += 1
+        return entry
+
+    def release(self, entry):
+        entry.users -= 1
+        if entry.retired and entry.users == 0:
+            self._retired.discard(entry)
+            self._close(entry)
+
+    def evict(self, user_name):
+        """
+        从池中移除账号的 session，没有请求在使用时立即关闭，否则等最后一个请求 release 后关闭
+        """
+        entry = self._sessions.pop(user_name, None)
+        if entry is None:
+            return
+        LOGGER.info('close session of %s' % user_name)
+        entry.retired = True
+        if entry.users:
+            self._retired.add(entry)
+        else:
+            self._close(entry)
+
+    def _close(self, entry):
+        task = asyncio.ensure_future(entry.session.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def close(self):
+        for user_name in list(self._sessions):
+            self.evict(user_name)
+        # 关闭爬虫时还在使用的 session 也一起关闭
+        for entry in self._retired:
+            self._close(entry)
+        self._retired.clear()
+        if self._closing:
+            await asyncio.wait(list(self._closing))
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+"""
+多进程运行爬虫：每个子进程有自己的事件循环（可选 uvloop），异常退出的子进程按退避时间重启，
+主进程定时汇总子进程上报的统计。收到 SIGTERM/SIGINT 时通知子进程停止取任务，
+等处理中的任务完成后退出，超过 DRAIN_TIMEOUT 还没退出的子进程直接杀掉
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from aio.weibo_cn_async import WeiboCnSpider
+from setting import LOGGER, USE_UVLOOP, RESTART_BACKOFF, RESTART_BACKOFF_MAX, DRAIN_TIMEOUT, STATS_INTERVAL
+
+
+def install_uvloop():
+    try:
+        import uvloop
+    except ImportError:
+        LOGGER.warn('uvloop is not installed, using the default event loop')
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def run_spider(args, tasks, uvloop=USE_UVLOOP, stats_queue=None):
+    """
+    在当前进程运行爬虫，直到所有任务协程结束或者收到 SIGTERM/SIGINT
+    :param stats_queue: 子进程把 (pid, 统计) 放入这个队列
+    """
+    if uvloop:
+        install_uvloop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    report = None
+    if stats_queue is not None:
+        pid = os.getpid()
+        report = lambda stats: stats_queue.put((pid, stats))
+    WeiboCnSpider(tasks=tasks, loop=loop).start(args, report=report)
+
+
+def _child(args, tasks, uvloop, stats_queue):
+    # fork 出来的子进程继承了主进程的信号处理，恢复默认，由爬虫自己的事件循环处理
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    run_spider(args, tasks, uvloop, stats_queue)
+
+
+def combine_stats(stats_list):
+    """
+    各个进程的统计按 key 相加，嵌套的 dict 递归相加
+    """
+    combined = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                combined[key] = combine_stats([combined.get(key, {}), value])
+            else:
+                combined[key] = combined.get(key, 0) + value
+    return combined
+
+
+class Supervisor(object):
+
+    def __init__(self, args, processes, tasks=4, **kwargs):
+        """
+        :param args: 要运行的任务类型，见 start.py
+        :param processes: 子进程数
+        :param tasks: 每个子进程的 WeiboCnSpider(tasks=...)
+        """
+        self.args = args
+        self.processes = processes
+        self.tasks = tasks
+        self.uvloop = kwargs['uvloop'] if 'uvloop' in kwargs else USE_UVLOOP
+        self._backoff = kwargs['backoff'] if 'backoff' in kwargs else RESTART_BACKOFF
+        self._backoff_max = kwargs['backoff_max'] if 'backoff_max' in kwargs else RESTART_BACKOFF_MAX
+        self._drain_timeout = kwargs['drain_timeout'] if 'drain_timeout' in kwargs else DRAIN_TIMEOUT
+        self._stats_interval = kwargs['stats_interval'] if 'stats_interval' in kwargs else STATS_INTERVAL
+        self._stats_queue = multiprocessing.Queue()
+        # 编号 -> (Process, 启动时间)
+        self._children = {}
+        # 等待重启的编号 -> 重启时间
+        self._pending = {}
+        # 编号 -> 上次重启的等待时间
+        self._delays = {}
+        # pid -> 最近一次上报的统计，只保留正在运行的子进程
+        self._stats = {}
+        self.restarts = 0
+        self.stopping = False
+
+    def _start_child(self, slot):
+        process = multiprocessing.Process(target=_child, name='weibo-spider-%d' % slot,
+                                          args=(self.args, self.tasks, self.uvloop, self._stats_queue))
+        process.start()
+        self._children[slot] = (process, time.time())
+        LOGGER.info('spider %d started, pid %d' % (slot, process.pid))
+
+    def _check_children(self):
+        """
+        正常退出（exitcode 0）的子进程不再启动，异常退出的按退避时间重启
+        """
+        now = time.time()
+        for slot, (process, started) in list(self._children.items()):
+            if process.is_alive():
+                continue
+            del self._children[slot]
+            self._stats.pop(process.pid, None)
+            if process.exitcode == 0:
+                LOGGER.info('spider %d (pid %d) exited' % (slot, process.pid))
+                continue
+            delay = self._delays.get(slot)
+            if delay is None or now - started > self._backoff_max:
+                delay = self._backoff
+            else:
+                delay = min(self._backoff_max, delay * 2)
+            self._delays[slot] = delay
+            self._pending[slot] = now + delay
+            LOGGER.error('spider %d (pid %d) exited with code %s, restart in %.1fs' %
+                         (slot, process.pid, process.exitcode, delay))
+        for slot, restart_at in list(self._pending.items()):
+            if restart_at <= now:
+                del self._pending[slot]
+                self.restarts += 1
+                self._start_child(slot)
+
+    def _collect(self, timeout):
+        """
+        读取子进程上报的统计，最多等待 timeout 秒
+        """
+        try:
+            pid, stats = self._stats_queue.get(timeout=timeout) if timeout else self._stats_queue.get_nowait()
+            self._stats[pid] = stats
+            while True:
+                pid, stats = self._stats_queue.get_nowait()
+                self._stats[pid] = stats
+        except queue.Empty:
+            pass
+
+    def stats(self):
+        return dict(combine_stats(self._stats.values()), processes=len(self._children), restarts=self.restarts)
+
+    def _stop(self, signum, frame):
+        if not self.stopping:
+            LOGGER.info('received signal %d, stopping spiders' % signum)
+        self.stopping = True
+
+    def _shutdown(self):
+        """
+        给子进程发送 SIGTERM，子进程处理完手上的任务后退出，超时的直接杀掉
+        """
+        for process, _ in self._children.values():
+            if process.is_alive():
+                process.terminate()
+        # 子进程退出前要把上报的统计写完，一边等待一边读取队列
+        deadline = time.time() + self._drain_timeout + 10
+        for slot, (process, _) in self._children.items():
+            while process.is_alive() and time.time() < deadline:
+                self._collect(0.5)
+            if process.is_alive():
+                LOGGER.error('spider %d (pid %d) did not exit in time, killed' % (slot, process.pid))
+                process.kill()
+            process.join()
+        self._collect(0)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for slot in range(self.processes):
+            self._start_child(slot)
+        last_report = time.time()
+        try:
+            while not self.stopping and (self._children or self._pending):
+                self._check_children()
+                self._collect(0.5)
+                if time.time() - last_report >= self._stats_interval:
+                    LOGGER.info('spider stats: %s' % self.stats())
+                    last_report = time.time()
+        finally:
+            self._shutdown()
+            LOGGER.info('spider stats: %s' % dict(combine_stats(self._stats.values()), restarts=self.restarts))
@@ -0,0 +1,163 @@
+# -*- coding:utf-8 -*-
+"""
+微博列表中一条微博的字段提取，搜索页、用户微博页、评论页顶部的微博和 weibo_cn.py 共用。
+只处理文本，查找节点由各个解析后端完成，所以 BeautifulSoup 和 lxml 的结果一致
+"""
+import datetime
+import re
+from collections import namedtuple
+
+# 一条微博：flag 转发/原创，source_tid 被转发微博的 id（没有为 None），content、time 为页面上的原始文本
+Tweet = namedtuple('Tweet', ['flag', 'source_tid', 'content', 'time', 'source', 'like', 'transfer', 'comment'])
+
+FORWARD = '转发'
+ORIGINAL = '原创'
+REPOST_REASON = '转发理由:'
+SOURCE_SEPARATOR = '\u6765\u81ea'  # 来自
+
+# 点赞数、转载数、评论数一次扫描
+count_pattern = re.compile(u'(\u8d5e|\u8f6c\u53d1|\u8bc4\u8bba)\[(\d+)\];')
+count_index = {u'\u8d5e': 0, u'\u8f6c\u53d1': 1, u'\u8bc4\u8bba': 2}
+
+time_current_pattern = re.compile(r'(\d*)分钟前')
+time_today_pattern = re.compile(r'今天\s*(\d*):(\d*)')
+time_year_pattern = re.compile(r'(\d*)月(\d*)日\s*(\d*):(\d*)')
+# get_time 转换后的时间，可以按字符串比较先后
+time_comparable_pattern = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}')
+
+# “n 分钟前”、“今天”相对的时间，None 为当前时间；重新解析归档时设为页面的抓取时间
+clock = None
+
+
+def set_clock(timestamp):
+    global clock
+    clock = timestamp
+
+
+def get_time(time_str):
+    current_result = time_current_pattern.findall(time_str)
+    time_now = datetime.datetime.now() if clock is None else datetime.datetime.fromtimestamp(clock)
+    if current_result:
+        result_time = time_now - datetime.timedelta(minutes=int(current_result[0]))
+        return result_time.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        current_result = time_today_pattern.findall(time_str)
+        if current_result:
+            result_time = datetime.datetime(time_now.year, time_now.month,
+                                            time_now.day, int(current_result[0][0]), int(current_result[0][0]))
+            return result_time.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            current_result = time_year_pattern.findall(time_str)
+            if current_result:
+                result_time = datetime.datetime(time_now.year, int(current_result[0][0]),
+                                                int(current_result[0][1]), int(current_result[0][2]),
+                                                int(current_result[0][3]))
+                return result_time.strftime('%Y-%m-%d %H:%M:%S')
+            else:
+                return time_str
+
+
+def parse_counts(text, default=-1):
+    """
+    :return: (点赞数, 转载数, 评论数)，每种取第一次出现的值
+    """
+    counts = [None, None, None]
+    for match in count_pattern.finditer(text):
+        index = count_index[match.group(1)]
+        if counts[index] is None:
+            counts[index] = match.group(2)
+    return tuple(default if count is None else count for count in counts)
+
+
+def split_time_source(ct_text):
+    """
+    :return: (时间, 来源)，没有来源为 'unknown'
+    """
+    time_source = ct_text.split(SOURCE_SEPARATOR)
+    return time_source[0], time_source[1] if len(time_source) == 2 else 'unknown'
+
+
+def split_forward_text(text):
+    """
+    “转发理由:”所在 div 的文本
+    :return: (转发理由, 其余字段)
+    """
+    fields = text.split('\xa0')
+    return fields[0][5:], ';'.join(fields[1:])
+
+
+def source_tid(comment_href):
+    return comment_href.split('?')[0].split('/')[-1]
+
+
+def extract_forward(text, ct_text, comment_href):
+    """
+    :param text: “转发理由:”所在 div 的文本
+    :param ct_text: 该 div 中 span.ct 的文本
+    :param comment_href: 原文评论链接，没有为 None
+    """
+    content, other = split_forward_text(text)
+    time, source = split_time_source(ct_text)
+    like, transfer, comment = parse_counts(other)
+    return Tweet(FORWARD, source_tid(comment_href) if comment_href is not None else None,
+                 content, time, source, like, transfer, comment)
+
+
+def extract_original(text, ct_text):
+    """
+    :param text: 微博 div 的文本
+    :param ct_text: 微博 div 中 span.ct 的文本
+    """
+    time, source = split_time_source(ct_text)
+    fields = text.split('\u200b')
+    like, transfer, comment = parse_counts(';'.join(fields[-1].split('\xa0')[1:]))
+    return Tweet(ORIGINAL, None, fields[0], time, source, like, transfer, comment)
+
+
+def newest_tweet(tweets, mark=None):
+    """
+    :param tweets: to_record 产生的微博
+    :param mark: 目前为止最新的 {'id', 'time'}
+    :return: 发布时间最新的 {'id', 'time'}，时间无法比较的微博忽略
+    """
+    for tweet in tweets:
+        if time_comparable_pattern.match(tweet['time']) and (mark is None or tweet['time'] > mark['time']):
+            mark = {'id': tweet['id'], 'time': tweet['time']}
+    return mark
+
+
+def reached_mark(tweets, mark):
+    """
+    用户微博列表按时间倒序（只有置顶微博例外，总在第一条），页面上最早的一条不晚于 mark 时，
+    后面的页都已经抓过了
+    :return: 是否已经翻到 mark
+    """
+    if mark is None:
+        return False
+    # 第一条可能是很早以前的置顶微博，不参与判断
+    rest = tweets[1:] or tweets
+    times = [tweet['time'] for tweet in rest if time_comparable_pattern.match(tweet['time'])]
+    if times and min(times) < mark['time']:
+        return True
+    # 时间只精确到分钟，同一分钟的用 id 判断
+    return any(tweet['id'] == mark['id'] for tweet in rest)
+
+
+def to_record(tweet, tweet_id, uid, raw=False):
+    """
+    :param raw: 保留页面上的内容和时间文本（weibo_cn.py 的格式）
+    :return: 发送到 kafka 的微博，字段顺序与原来一致
+    """
+    record = {'flag': tweet.flag}
+    if tweet.source_tid is not None:
+        record['sourceTid'] = tweet.source_tid
+    record['content'] = tweet.content if raw else tweet.content.strip()
+    record['id'] = tweet_id
+    record['time'] = tweet.time if raw else get_time(str(tweet.time))
+    record['source'] = tweet.source
+    record['like'] = tweet.like
+    record['transfer'] = tweet.transfer
+    record['comment'] = tweet.comment
+    record['type'] = 'tweet_info'
+    record['uid'] = uid
+    return record
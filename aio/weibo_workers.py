@@ -0,0 +1,140 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import math
+import random
+
+from setting import LOGGER, WORKER_MIN, WORKER_MAX, WORKER_WEIGHTS, WORKER_SCALE_INTERVAL, WORKER_FETCH_TIMEOUT
+
+
+class WorkerPool(object):
+    """
+    所有任务类型共用的 worker 池：每个 worker 每次取任务时按权重和队列长度重新排列所有队列，
+    BRPOP 从排在最前的非空队列取任务，只要有一个队列有任务，worker 就不会空闲。
+    后台按积压和繁忙的 worker 数在 min_workers 到 max_workers 之间调整 worker 数量
+    """
+
+    def __init__(self, redis_job, handlers, run_job, loop=None, **kwargs):
+        """
+        :param handlers: 队列名 -> 任务处理函数
+        :param run_job: WeiboCnSpider.run_job，负责重试和 ack
+        """
+        self.redis_job = redis_job
+        self.handlers = handlers
+        self.run_job = run_job
+        self.loop = loop or asyncio.get_event_loop()
+        self.job_types = list(handlers)
+        self.weights = kwargs['weights'] if 'weights' in kwargs else WORKER_WEIGHTS
+        self.min_workers = kwargs['min_workers'] if 'min_workers' in kwargs else WORKER_MIN
+        self.max_workers = kwargs['max_workers'] if 'max_workers' in kwargs else WORKER_MAX
+        self._scale_interval = kwargs['scale_interval'] if 'scale_interval' in kwargs else WORKER_SCALE_INTERVAL
+        self._fetch_timeout = kwargs['fetch_timeout'] if 'fetch_timeout' in kwargs else WORKER_FETCH_TIMEOUT
+        initial = kwargs['workers'] if 'workers' in kwargs else self.min_workers
+        self.target = min(self.max_workers, max(self.min_workers, initial))
+        # worker 编号 -> task
+        self._workers = {}
+        self._next_id = 0
+        self.depths = {job_type: 0 for job_type in self.job_types}
+        self.busy = 0
+        self.processed = 0
+        # drain 以后不再取新任务，worker 处理完手上的任务就退出
+        self.draining = False
+        self._wakeup = None
+
+    def order(self):
+        """
+        按权重随机排列队列（权重越大越可能排在前面），权重乘上 1 + log(1 + 队列长度)，
+        积压多的队列更靠前；空队列排在最后，但仍然参与 BRPOP
+        """
+        keys = []
+        for job_type in self.job_types:
+            depth = self.depths.get(job_type, 0)
+            weight = self.weights.get(job_type, 1) * (1 + math.log1p(depth))
+            keys.append((random.random() ** (1.0 / weight) if depth and weight > 0 else -1.0, job_type))
+        return [job_type for _, job_type in sorted(keys, reverse=True)]
+
+    async def _work(self, worker_id):
+        conn = await self.redis_job.connect()
+        try:
+            while True:
+                # 缩容时多出来的 worker 在两个任务之间退出，不会丢掉已经取出的任务
+                if len(self._workers) > self.target:
+                    return
+                try:
+                    job_type, job_info = await self.redis_job.fetch_job_blocking(self.order(), self._fetch_timeout,
+                                                                                 conn=conn)
+                except Exception as e:
+                    LOGGER.error('fetch job failed: %s' % e)
+                    await asyncio.sleep(1)
+                    continue
+                if not job_info:
+                    continue
+                self.busy += 1
+                try:
+                    await self.run_job(job_type, job_info, self.handlers[job_type])
+                finally:
+                    self.busy -= 1
+                    self.processed += 1
+        finally:
+            self._workers.pop(worker_id, None)
+            await self.redis_job.disconnect(conn)
+
+    def _spawn(self):
+        while len(self._workers) < self.target:
+            worker_id = self._next_id
+            self._next_id += 1
+            self._workers[worker_id] = self.loop.create_task(self._work(worker_id))
+
+    def _scale(self):
+        """
+        所有 worker 都在忙且还有积压时扩容一半，没有积压且有空闲 worker 时每次缩容一个
+        """
+        backlog = sum(self.depths.values())
+        idle = len(self._workers) - self.busy
+        target = self.target
+        if backlog and idle <= 0:
+            target = min(self.max_workers, target + max(1, target // 2))
+        elif not backlog and idle > 0:
+            target = max(self.min_workers, target - 1)
+        if target != self.target:
+            LOGGER.info('scale workers %d -> %d (backlog: %d, busy: %d)' % (self.target, target, backlog, self.busy))
+            self.target = target
+
+    def drain(self):
+        self.draining = True
+        self.target = 0
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        """
+        启动 worker 并定时更新队列长度、调整 worker 数量，drain 后所有 worker 退出时返回，
+        取消时同时取消所有 worker
+        """
+        self._wakeup = asyncio.Event()
+        try:
+            while not self.draining:
+                try:
+                    depths = await self.redis_job.depths(self.job_types)
+                    self.depths = dict(zip(self.job_types, depths))
+                    self._scale()
+                except Exception as e:
+                    LOGGER.error('update queue depths failed: %s' % e)
+                if not self.draining:
+                    self._spawn()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._scale_interval)
+                except asyncio.TimeoutError:
+                    pass
+            workers = list(self._workers.values())
+            if workers:
+                await asyncio.wait(workers)
+        finally:
+            workers = list(self._workers.values())
+            for worker in workers:
+                worker.cancel()
+            if workers:
+                await asyncio.wait(workers)
+
+    def stats(self):
+        return {'workers': len(self._workers), 'target': self.target, 'busy': self.busy,
+                'processed': self.processed, 'depths': dict(self.depths)}
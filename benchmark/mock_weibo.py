@@ -0,0 +1,249 @@
+# -*- coding:utf-8 -*-
+"""
+模拟 weibo.cn 的 aiohttp 服务，按模板生成搜索、用户微博、评论、转发、关注、资料和个人主页，
+可以配置响应延迟、错误率和分页深度，用于压测爬虫的整条流水线：
+python -m benchmark.mock_weibo [--port 8900] [--latency 50] [--error-rate 0.01] [--depth 3]
+"""
+import argparse
+import asyncio
+import random
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+UID_BASE = 1000000000
+
+HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+       '<!DOCTYPE html PUBLIC "-//WAPFORUM//DTD XHTML Mobile 1.0//EN" ' \
+       '"http://www.wapforum.org/DTD/xhtml-mobile10.dtd">\n' \
+       '<html xmlns="http://www.w3.org/1999/xhtml"><head>' \
+       '<meta http-equiv="Content-Type" content="text/html; charset=utf-8"/><title>{title}</title></head><body>\n' \
+       '<div class="n" style="padding: 6px 4px 0 4px;"><a href="/?tf=5_009">首页</a></div>\n'
+TAIL = '</body></html>\n'
+PAGE_LIST = '<div class="pa" id="pagelist"><form action="{path}" method="post"><div>' \
+            '<a href="{path}?page=2">下页</a>&nbsp;<input name="mp" type="hidden" value="{max_page}" />' \
+            '<input type="text" name="page" size="2" value=""/><input type="submit" value="跳页" />' \
+            '&nbsp;{page}/{max_page}页</div></form></div>\n'
+VIEW = '<div class="u"><div class="ut"><span class="ctt">{nickname}&nbsp;<a href="/{uid}/info">资料</a></span></div>' \
+       '<div class="tip2"><span class="tc">微博[{tweets}]</span>&nbsp;<a href="/{uid}/follow">关注[{follows}]</a>' \
+       '&nbsp;<a href="/{uid}/fans">粉丝[{fans}]</a>&nbsp;<a href="/attgroup/opening?uid={uid}">分组[1]</a>' \
+       '</div></div>\n'
+TWEET = '<div class="c" id="M_{tid}"><div>{nk}<span class="ctt">{text}\u200b</span>&nbsp;</div><div>' \
+        '<a href="/attitude/{tid}/add?uid={uid}&amp;rl=0">赞[{like}]</a>&nbsp;' \
+        '<a href="/repost/{tid}?uid={uid}&amp;rl=0">转发[{transfer}]</a>&nbsp;' \
+        '<a href="/comment/{tid}?uid={uid}&amp;rl=0#cmtfrm" class="cc">评论[{comment}]</a>&nbsp;' \
+        '<span class="ct">{minutes}分钟前&nbsp;来自{source}</span></div></div>\n<div class="s"></div>\n'
+TOP_TWEET = '<div class="c" id="M_"><div><a href="{user_href}">{nickname}</a>:<span class="ctt">{text}</span>' \
+            '&nbsp;</div><div><span class="ct">今天 08:30&nbsp;来自{source}</span></div></div>\n' \
+            '<div><span class="pms">&nbsp;评论[{comment}]&nbsp;</span><span class="pms">&nbsp;' \
+            '<a href="/repost/{tid}">转发[{transfer}]</a>&nbsp;</span><span class="pms">&nbsp;' \
+            '<a href="/attitude/{tid}">赞[{like}]</a>&nbsp;</span></div>\n'
+COMMENT = '<div class="c" id="C_{cid}"><a href="{user_href}">{nickname}</a>:<span class="ctt">{text}</span>&nbsp;' \
+          '<span class="cc"><a href="/comment/{tid}?rl=1">回复</a></span>&nbsp;' \
+          '<span class="ct">{minutes}分钟前&nbsp;来自{source}</span></div>\n'
+REPOST = '<div class="c"><a href="{user_href}">{nickname}</a>:{text}&nbsp;' \
+         '<span class="cc"><a href="/attitude/{tid}/add?rl=1">赞[0]</a></span>&nbsp;' \
+         '<span class="ct">&nbsp;{minutes}分钟前&nbsp;来自{source}</span></div>\n'
+FOLLOW = '<table><tr><td valign="top" style="width: 52px"><a href="{user_href}"><img src="/avatar/{uid}.jpg" alt="pic" />' \
+         '</a></td><td valign="top"><a href="{user_href}">{nickname}</a>{icon}<br/>粉丝{fans}人</td></tr></table>' \
+         '<div class="s"></div>\n'
+INFO = '<div class="c"><img src="/avatar/{uid}.jpg" alt="头像" /></div>\n<div class="tip">基本信息</div>\n' \
+       '<div class="c">昵称:{nickname}<br/>性别:{gender}<br/>地区:北京 海淀区<br/>简介:模拟用户{uid}<br/>' \
+       '标签:<a href="/search/?keyword=a">旅游</a>&nbsp;<a href="/search/?keyword=b">摄影</a><br/></div>\n' \
+       '<div class="tip">学习经历</div>\n<div class="c">·某某大学(2008年)<br/></div>\n'
+# 真实页面上都有 class="c" 的表单或标题
+FORM = '<div class="c"><form action="{path}" method="post"><div><input type="text" name="content"/></div></form></div>\n'
+# 搜索页的总页数按 int(总条数 / 10) - 1 计算
+SEARCH_COUNT = '<div class="c">共{count}条<span class="cmt">&nbsp;</span></div>\n'
+ENTERPRISE_ICON = '<img src="https://h5.sinaimg.cn/upload/2016/05/26/319/5337.gif" alt="V"/>'
+SOURCES = ['iPhone客户端', 'Android', '微博 weibo.com', '专业版微博']
+
+
+def stable_hash(*parts):
+    return zlib.crc32(repr(parts).encode('utf-8'))
+
+
+class MockWeibo(object):
+    """
+    用户 uid 为 UID_BASE + n（n < users），每 vanity_every 个用户有一个个性域名 /user<n>，
+    需要先下载个人主页才能拿到 uid。页面内容由 uid、微博 id 和页码决定，同一个 url 每次返回相同的内容
+    """
+
+    def __init__(self, **kwargs):
+        self.latency = (kwargs['latency'] if 'latency' in kwargs else 50) / 1000.0
+        self.error_rate = kwargs['error_rate'] if 'error_rate' in kwargs else 0.0
+        self.depth = kwargs['depth'] if 'depth' in kwargs else 3
+        self.page_size = kwargs['page_size'] if 'page_size' in kwargs else 10
+        self.users = kwargs['users'] if 'users' in kwargs else 1000
+        self.vanity_every = kwargs['vanity_every'] if 'vanity_every' in kwargs else 5
+        self.requests = Counter()
+        self.errors = 0
+        self._random = random.Random(kwargs['seed'] if 'seed' in kwargs else 0)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/search/mblog/', self.search)
+        app.router.add_get('/comment/{tid}', self.comment)
+        app.router.add_get('/repost/{tid}', self.repost)
+        app.router.add_get('/{uid}/info', self.info)
+        app.router.add_get('/{uid}/follow', self.follow)
+        app.router.add_get('/{uid}/fans', self.follow)
+        app.router.add_get('/{name}', self.timeline)
+        return app
+
+    def user(self, seed):
+        """
+        :return: (uid, 页面上的用户链接, 昵称)
+        """
+        n = seed % self.users
+        uid = UID_BASE + n
+        if self.vanity_every and n % self.vanity_every == 0:
+            return uid, '/user%d' % n, 'user%d' % n
+        return uid, 'https://weibo.cn/u/%d' % uid, 'user%d' % n
+
+    @staticmethod
+    def page_of(request):
+        try:
+            return int(request.query.get('page', 1))
+        except ValueError:
+            return 1
+
+    def page_list(self, path, page):
+        return PAGE_LIST.format(path=path, page=page, max_page=self.depth) if self.depth > 1 else ''
+
+    def tweets(self, uid, page, nk=False):
+        divs = []
+        for i in range(self.page_size):
+            seed = stable_hash((uid, page, i))
+            tweet_uid, user_href, nickname = self.user(seed) if nk else (uid, '', '')
+            divs.append(TWEET.format(
+                tid='T%dP%dI%d' % (uid, page, i), uid=tweet_uid,
+                nk='<a class="nk" href="%s">%s</a>:' % (user_href, nickname) if nk else '',
+                text='模拟微博 %d %d %d' % (uid, page, i), like=seed % 1000, transfer=seed % 100,
+                comment=seed % 50, minutes=seed % 60, source=SOURCES[seed % len(SOURCES)]))
+        return ''.join(divs)
+
+    async def respond(self, kind, body_fn):
+        self.requests[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self._random.uniform(0.5, 1.5) * self.latency)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, text='server error')
+        return web.Response(body=body_fn().encode('utf-8'), content_type='text/html', charset='utf-8')
+
+    async def search(self, request):
+        page = self.page_of(request)
+        keyword = request.query.get('keyword', '')
+        seed = stable_hash(keyword)
+        return await self.respond('search', lambda: HEAD.format(title='搜索') +
+                                  SEARCH_COUNT.format(count=(self.depth + 1) * 10) +
+                                  self.tweets(seed, page, nk=True) + self.page_list(request.path, page) + TAIL)
+
+    async def timeline(self, request):
+        name = request.match_info['name']
+        page = self.page_of(request)
+        if name.isdigit():
+            uid = int(name)
+        elif name.startswith('user') and name[4:].isdigit():
+            uid = UID_BASE + int(name[4:])
+        else:
+            uid = UID_BASE + stable_hash(name) % self.users
+        view = VIEW.format(uid=uid, nickname='user%d' % (uid - UID_BASE), tweets=uid % 5000,
+                           follows=uid % 300, fans=uid % 100000)
+        return await self.respond('timeline', lambda: HEAD.format(title='微博') + view + self.tweets(uid, page) +
+                                  self.page_list(request.path, page) + TAIL)
+
+    async def comment(self, request):
+        tid = request.match_info['tid']
+        page = self.page_of(request)
+        seed = stable_hash(tid)
+
+        def body():
+            uid, user_href, nickname = self.user(seed)
+            top = TOP_TWEET.format(tid=tid, user_href=user_href.replace('https://weibo.cn', ''), nickname=nickname,
+                                   text='模拟微博 %s' % tid, source=SOURCES[seed % len(SOURCES)],
+                                   like=seed % 1000, transfer=seed % 100, comment=seed % 50) if page == 1 else ''
+            comments = []
+            for i in range(self.page_size):
+                comment_seed = stable_hash((tid, page, i))
+                _, href, name = self.user(comment_seed)
+                comments.append(COMMENT.format(cid=comment_seed, tid=tid, text='评论 %d' % i,
+                                               user_href=href.replace('https://weibo.cn', ''), nickname=name,
+                                               minutes=comment_seed % 60,
+                                               source=SOURCES[comment_seed % len(SOURCES)]))
+            return HEAD.format(title='评论列表') + top + FORM.format(path=request.path) + ''.join(comments) + self.page_list(request.path, page) + TAIL
+        return await self.respond('comment', body)
+
+    async def repost(self, request):
+        tid = request.match_info['tid']
+        page = self.page_of(request)
+        seed = stable_hash(tid)
+
+        def body():
+            uid, user_href, nickname = self.user(seed)
+            top = TOP_TWEET.format(tid=tid, user_href=user_href.replace('https://weibo.cn', ''), nickname=nickname,
+                                   text='模拟微博 %s' % tid, source=SOURCES[seed % len(SOURCES)],
+                                   like=seed % 1000, transfer=seed % 100, comment=seed % 50) if page == 1 else ''
+            reposts = []
+            # 转发会继续产生转发和评论任务，只在第一层生成，避免任务无限增长
+            if tid.startswith('T'):
+                for i in range(self.page_size):
+                    repost_seed = stable_hash((tid, page, i))
+                    _, href, name = self.user(repost_seed)
+                    reposts.append(REPOST.format(tid='R%d' % repost_seed, text='转发 %d' % i,
+                                                 user_href=href.replace('https://weibo.cn', ''), nickname=name,
+                                                 minutes=repost_seed % 60,
+                                                 source=SOURCES[repost_seed % len(SOURCES)]))
+            return HEAD.format(title='转发列表') + top + FORM.format(path=request.path) + ''.join(reposts) + self.page_list(request.path, page) + TAIL
+        return await self.respond('repost', body)
+
+    async def follow(self, request):
+        uid = int(request.match_info['uid']) if request.match_info['uid'].isdigit() else UID_BASE
+        page = self.page_of(request)
+
+        def body():
+            rows = []
+            for i in range(self.page_size):
+                follow_seed = stable_hash((uid, page, i))
+                follow_uid, href, name = self.user(follow_seed)
+                rows.append(FOLLOW.format(uid=follow_uid, user_href=href, nickname=name, fans=follow_seed % 10000,
+                                          icon=ENTERPRISE_ICON if follow_seed % 10 == 0 else ''))
+            return HEAD.format(title='关注的人') + FORM.format(path=request.path) + ''.join(rows) + self.page_list(request.path, page) + TAIL
+        return await self.respond('follow', body)
+
+    async def info(self, request):
+        uid = request.match_info['uid']
+        return await self.respond('info', lambda: HEAD.format(title='资料') + INFO.format(
+            uid=uid, nickname='user%s' % uid, gender='男' if stable_hash(uid) % 2 else '女') + TAIL)
+
+
+async def start_server(mock, host='127.0.0.1', port=8900):
+    """
+    :return: aiohttp 的 AppRunner，用 runner.cleanup() 关闭
+    """
+    runner = web.AppRunner(mock.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='mock weibo.cn server')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8900)
+    arg_parser.add_argument('--latency', type=float, default=50, help='平均响应延迟（毫秒）')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='返回 500 的比例')
+    arg_parser.add_argument('--depth', type=int, default=3, help='每个列表的页数')
+    arg_parser.add_argument('--page-size', type=int, default=10, help='每页的记录数')
+    arg_parser.add_argument('--users', type=int, default=1000, help='用户总数')
+    args = arg_parser.parse_args()
+    mock = MockWeibo(latency=args.latency, error_rate=args.error_rate, depth=args.depth,
+                     page_size=args.page_size, users=args.users)
+    web.run_app(mock.app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+# -*- coding:utf-8 -*-
+"""
+页面解析的基准测试，用 fixtures 下保存的页面跑每个解析函数：
+python -m benchmark.parser_bench [-n 次数] [-b bs4,lxml,weibo_cn] [--save 文件] [--compare 文件]
+
+输出每个后端、每种页面的 pages/sec、records/sec、单页耗时 p50/p99 和内存峰值，
+--save 保存为 json 基线，--compare 和之前保存的基线对比
+fixtures 中大部分是覆盖页面结构的小页面，timeline_2.html、comment_2.html 是接近线上大小的页面
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+from collections import OrderedDict
+
+from aio import weibo_parser, weibo_parser_lxml
+from aio.parser_parity import FIXTURE_PATH, load_fixtures
+import weibo_cn_parser
+
+
+# weibo_cn.py 的解析函数（weibo_cn_parser）和 aio 解析器的参数不同：转发、评论页没有 parent_tid，
+# uid 等需要下载个人主页的字段为 HomePage
+WEIBO_CN_PARSERS = {
+    'parse_user_tweet': weibo_cn_parser.parse_user_tweet,
+    'parse_comments': lambda html, tweet_id, parent_tid=None, first_page=False:
+        weibo_cn_parser.parse_comments(html, tweet_id, first_page),
+    'parse_repost': lambda html, tweet_id, parent_tid=None, first_page=False:
+        weibo_cn_parser.parse_repost(html, tweet_id, first_page),
+    'parse_follow': weibo_cn_parser.parse_follow,
+    'parse_user_info': weibo_cn_parser.parse_user_info,
+    'parse_view': weibo_cn_parser.parse_view,
+    'parse_home_page_user_id': weibo_cn_parser.parse_home_page_user_id,
+}
+
+# 后端 -> (解析函数所在的对象, 页面是否传 bytes)；weibo_cn.py 没有搜索页
+BACKENDS = OrderedDict([
+    ('bs4', (weibo_parser, False)),
+    ('lxml', (weibo_parser_lxml, True)),
+    ('weibo_cn', (WEIBO_CN_PARSERS, False)),
+])
+
+
+def count_records(result):
+    """
+    一次解析产出的记录数：微博、评论、用户、转发的微博 id 各算一条
+    """
+    if not result:
+        return 0
+    if not isinstance(result, dict) or 'type' in result or 'tweetNum' in result:
+        return 1
+    count = 0
+    for key in ('tweets', 'comments', 'users', 'tweet_ids'):
+        count += len(result.get(key) or [])
+    if result.get('tweet'):
+        count += 1
+    return count
+
+
+def percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, int(round(percent / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_case(parser, contents, args, iterations):
+    """
+    :param contents: 同一种页面的所有样本
+    :return: 一个解析函数在一种页面上的结果统计
+    """
+    records = sum(count_records(parser(content, *args)) for content in contents)
+
+    # 内存峰值单独跑一遍，tracemalloc 会拖慢计时
+    gc.collect()
+    tracemalloc.start()
+    for content in contents:
+        parser(content, *args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    durations = []
+    gc.disable()
+    try:
+        for _ in range(iterations):
+            for content in contents:
+                start = time.perf_counter()
+                parser(content, *args)
+                durations.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    durations.sort()
+    total = sum(durations)
+    return {
+        'pages': len(contents),
+        'pages_per_sec': round(len(durations) / total, 2),
+        'records_per_sec': round(iterations * records / total, 2),
+        'records_per_page': round(records / float(len(contents)), 2),
+        'p50_ms': round(percentile(durations, 50) * 1000, 4),
+        'p99_ms': round(percentile(durations, 99) * 1000, 4),
+        'peak_kb': round(peak / 1024.0, 1),
+    }
+
+
+def run(backends, iterations, fixture_path=FIXTURE_PATH):
+    """
+    :return: {'<后端> <页面类型> <解析函数>': 统计}
+    """
+    cases = OrderedDict()
+    for file_name, content, parser_name, args in load_fixtures(fixture_path):
+        kind = file_name.split('.')[0].split('_')[0]
+        cases.setdefault((kind, parser_name, args), []).append(content)
+    results = OrderedDict()
+    for backend in backends:
+        module, raw = BACKENDS[backend]
+        for (kind, parser_name, args), contents in cases.items():
+            parser = module.get(parser_name) if isinstance(module, dict) else getattr(module, parser_name)
+            if parser is None:
+                continue
+            if not raw:
+                contents = [content.decode('utf-8') for content in contents]
+            key = '%s %s %s' % (backend, kind, parser_name)
+            try:
+                results[key] = run_case(parser, contents, args, iterations)
+            except Exception as e:
+                # 解析函数在某些页面上会抛异常（比如 weibo_cn.py 遇到不完整的赞链接），记录下来，不计时
+                results[key] = {'error': '%s: %s' % (type(e).__name__, e)}
+    return results
+
+
+def print_results(results, baseline=None):
+    print('%-44s %10s %12s %9s %9s %9s' % ('case', 'pages/s', 'records/s', 'p50 ms', 'p99 ms', 'peak kb'))
+    for key, stat in results.items():
+        if 'error' in stat:
+            print('%-44s %s' % (key, stat['error']))
+            continue
+        line = '%-44s %10.1f %12.1f %9.3f %9.3f %9.1f' % (key, stat['pages_per_sec'], stat['records_per_sec'],
+                                                         stat['p50_ms'], stat['p99_ms'], stat['peak_kb'])
+        if baseline and key in baseline and 'error' not in baseline[key]:
+            old = baseline[key]
+            line += '  pages/s %+.1f%%  p99 %+.1f%%' % (
+                (stat['pages_per_sec'] / old['pages_per_sec'] - 1) * 100,
+                (stat['p99_ms'] / old['p99_ms'] - 1) * 100 if old['p99_ms'] else 0)
+        print(line)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='weibo.cn parser benchmark')
+    arg_parser.add_argument('-n', '--iterations', type=int, default=200, help='每个页面解析次数')
+    arg_parser.add_argument('-b', '--backends', default=','.join(BACKENDS), help='逗号分隔的后端')
+    arg_parser.add_argument('-f', '--fixtures', default=FIXTURE_PATH, help='页面目录')
+    arg_parser.add_argument('--save', help='把结果保存为 json 基线')
+    arg_parser.add_argument('--compare', help='与 json 基线对比')
+    args = arg_parser.parse_args()
+
+    backends = [backend for backend in args.backends.split(',') if backend]
+    unknown = [backend for backend in backends if backend not in BACKENDS]
+    if unknown:
+        arg_parser.error('unknown backends: %s' % ','.join(unknown))
+
+    # weibo.cn 页面带 xml 声明，新版 bs4 会对每个页面警告一次
+    warnings.filterwarnings('ignore', message='.*HTML parser to parse an XML document')
+    results = run(backends, args.iterations, args.fixtures)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'iterations': args.iterations,
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'results': results}, f, indent=2, ensure_ascii=False)
+        print('baseline saved to %s' % args.save)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
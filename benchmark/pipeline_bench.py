@@ -0,0 +1,287 @@
+# -*- coding:utf-8 -*-
+"""
+整条流水线的压测：WeiboCnSpider 抓取本地的模拟 weibo.cn（benchmark.mock_weibo），
+任务和账号放在单独的本地 redis 中，kafka 换成内存中的假 broker。
+python -m benchmark.pipeline_bench [--spawn-redis] [-t 4] [--types s,c,u,w,f,r] [--latency 50] [--depth 3]
+
+先写入账号和种子任务，每种任务开 N 个协程，直到所有队列清空，输出 fetches/sec、records/sec、
+队列清空耗时和事件循环延迟
+"""
+import argparse
+import asyncio
+import json
+import shutil
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import aioredis
+
+from aio.weibo_cn_async import WeiboCnSpider, JobType
+from aio.weibo_kafka import BatchProducer
+from benchmark.mock_weibo import MockWeibo, UID_BASE, start_server
+
+# 爬虫默认连接的 redis，压测会清空数据库，不允许指向它
+PRODUCTION_REDIS = 'redis://localhost:6378'
+JOB_DB = 1
+COOKIE_DB = 0
+
+TYPE_ARGS = {
+    's': JobType.search.value,
+    'c': JobType.comment.value,
+    'u': JobType.user.value,
+    'w': JobType.tweet.value,
+    'f': JobType.follower.value,
+    'r': JobType.repost.value,
+}
+
+
+class MemoryFuture(object):
+    def get(self, timeout=None):
+        return None
+
+
+class MemoryTransport(object):
+    """
+    内存中的 kafka：实现 BatchProducer 需要的 send/flush/close，只统计记录数
+    """
+
+    def __init__(self):
+        self.records = Counter()
+        self.batches = 0
+
+    def send(self, topic, value=None):
+        self.records[value['type']] += 1
+        return MemoryFuture()
+
+    def flush(self):
+        self.batches += 1
+
+    def close(self):
+        pass
+
+
+class BenchSpider(WeiboCnSpider):
+    """
+    统计抓取次数和正在执行的任务数，用于判断队列是否已经清空
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.in_flight = 0
+        self.last_active = time.time()
+
+    async def fetch_html(self, url, parser_name=None, args=()):
+        self.fetches += 1
+        try:
+            return await super().fetch_html(url, parser_name, args)
+        except Exception:
+            self.fetch_errors += 1
+            raise
+
+    async def run_job(self, job_type, job_info, handler):
+        self.in_flight += 1
+        try:
+            await super().run_job(job_type, job_info, handler)
+        finally:
+            self.in_flight -= 1
+            self.last_active = time.time()
+
+
+class LoopLag(object):
+    """
+    每隔 interval 秒检查一次事件循环被阻塞了多久
+    """
+
+    def __init__(self, loop, interval=0.05):
+        self.loop = loop
+        self.interval = interval
+        self.samples = []
+
+    async def run(self):
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, self.loop.time() - start - self.interval))
+
+    def stats(self):
+        samples = sorted(self.samples) or [0.0]
+        return {
+            'p50_ms': round(samples[len(samples) // 2] * 1000, 2),
+            'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+            'max_ms': round(samples[-1] * 1000, 2),
+        }
+
+
+def spawn_redis(port):
+    """
+    启动一个不落盘的 redis-server
+    """
+    redis_server = shutil.which('redis-server')
+    if not redis_server:
+        sys.exit('redis-server not found, start a redis and pass --redis')
+    process = subprocess.Popen([redis_server, '--port', str(port), '--save', '', '--appendonly', 'no'],
+                               stdout=subprocess.DEVNULL)
+    time.sleep(0.5)
+    return process
+
+
+async def seed(redis_host, weibo_host, job_types, jobs, accounts):
+    """
+    清空压测用的数据库，写入账号和每种任务的种子任务
+    """
+    cookie_conn = await aioredis.create_connection(redis_host, db=COOKIE_DB)
+    job_conn = await aioredis.create_connection(redis_host, db=JOB_DB)
+    try:
+        await cookie_conn.execute('flushdb')
+        await job_conn.execute('flushdb')
+        for i in range(accounts):
+            user_name = 'bench%d' % i
+            await cookie_conn.execute('hset', 'account', user_name, json.dumps({
+                'user_name': user_name, 'cookies': {}, 'login_time': time.time()}))
+            await cookie_conn.execute('sadd', 'users', user_name)
+        for job_type in job_types:
+            job_infos = []
+            for i in range(jobs):
+                uid = UID_BASE + i
+                tweet_id = 'T%dP1I0' % uid
+                job_infos.append({
+                    JobType.search.value: {'url': weibo_host + '/search/mblog/?keyword=bench%d&filter=hasori' % i},
+                    JobType.comment.value: {'url': weibo_host + '/comment/%s' % tweet_id, 'tweetId': tweet_id},
+                    JobType.repost.value: {'url': weibo_host + '/repost/%s' % tweet_id, 'tweetId': tweet_id},
+                    JobType.user.value: {'user_id': str(uid)},
+                    JobType.tweet.value: {'url': weibo_host + '/%d' % uid, 'uid': str(uid)},
+                    JobType.follower.value: {'url': weibo_host + '/%d/follow' % uid, 'uid': str(uid)},
+                }[job_type])
+            await job_conn.execute('lpush', job_type, *[json.dumps(job_info) for job_info in job_infos])
+    finally:
+        cookie_conn.close()
+        job_conn.close()
+
+
+async def wait_drained(spider, redis_host, job_types, timeout, idle_checks=3, interval=0.5):
+    """
+    所有任务队列和重试队列为空、没有正在执行的任务，并且连续 idle_checks 次检查都如此时认为已经清空
+    :return: 队列清空的时间，超时返回 None
+    """
+    conn = await aioredis.create_connection(redis_host, db=JOB_DB)
+    deadline = time.time() + timeout
+    idle = 0
+    try:
+        while time.time() < deadline:
+            pending = 0
+            for job_type in job_types:
+                pending += await conn.execute('llen', job_type)
+            pending += await conn.execute('zcard', spider.redis_job.retry_key)
+            if pending == 0 and spider.in_flight == 0:
+                idle += 1
+                if idle >= idle_checks:
+                    return spider.last_active
+            else:
+                idle = 0
+            await asyncio.sleep(interval)
+        return None
+    finally:
+        conn.close()
+
+
+async def run(args, loop):
+    weibo_host = 'http://%s:%d' % (args.mock_host, args.mock_port)
+    job_types = [TYPE_ARGS[t] for t in args.types]
+    mock = MockWeibo(latency=args.latency, error_rate=args.error_rate, depth=args.depth,
+                     page_size=args.page_size, users=args.users)
+    runner = await start_server(mock, args.mock_host, args.mock_port)
+    await seed(args.redis, weibo_host, job_types, args.seed_jobs, args.accounts)
+
+    transport = MemoryTransport()
+    producer = BatchProducer([], 'sinaweibo', loop=loop, transport=transport)
+    spider = BenchSpider(tasks=args.tasks, loop=loop, weibo_host=weibo_host, redis_host=args.redis,
+                         weibo_producer=producer, requests_per_minute=args.requests_per_minute,
+                         retry_base_delay=args.retry_delay, retry_move_interval=min(args.retry_delay, 1))
+    lag = LoopLag(loop)
+    lag_task = loop.create_task(lag.run())
+    start = time.time()
+    workers = spider.create_workers(args.types)
+    try:
+        drained_at = await wait_drained(spider, args.redis, job_types, args.timeout)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        if workers:
+            await asyncio.wait(workers)
+        lag_task.cancel()
+        await spider.close()
+        await runner.cleanup()
+    elapsed = (drained_at or time.time()) - start
+
+    return {
+        'tasks_per_type': args.tasks,
+        'types': args.types,
+        'drained': drained_at is not None,
+        'drain_seconds': round(elapsed, 2),
+        'fetches': spider.fetches,
+        'fetch_errors': spider.fetch_errors,
+        'coalesced_fetches': spider.flight.shared + spider.flight.cache_hits if spider.flight else 0,
+        'fetches_per_sec': round(spider.fetches / elapsed, 2) if elapsed else 0,
+        'records': sum(transport.records.values()),
+        'records_per_sec': round(sum(transport.records.values()) / elapsed, 2) if elapsed else 0,
+        'records_by_type': dict(transport.records),
+        'kafka_batches': transport.batches,
+        'kafka_failed': producer.failed,
+        'server_requests': dict(mock.requests),
+        'server_errors': mock.errors,
+        'loop_lag': lag.stats(),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='WeiboCnSpider pipeline benchmark')
+    arg_parser.add_argument('-t', '--tasks', type=int, default=4, help='每种任务的协程数')
+    arg_parser.add_argument('--types', default='s,c,u,w,f,r', help='运行的任务类型，含义同 start.py')
+    arg_parser.add_argument('--seed-jobs', type=int, default=5, help='每种任务的种子任务数')
+    arg_parser.add_argument('--accounts', type=int, default=50, help='写入的假账号数')
+    arg_parser.add_argument('--requests-per-minute', type=int, default=0, help='每个账号每分钟请求数，0 不限速')
+    arg_parser.add_argument('--redis', default='redis://localhost:6390', help='压测用的 redis，会被清空')
+    arg_parser.add_argument('--spawn-redis', action='store_true', help='启动一个临时的 redis-server')
+    arg_parser.add_argument('--mock-host', default='127.0.0.1')
+    arg_parser.add_argument('--mock-port', type=int, default=8900)
+    arg_parser.add_argument('--latency', type=float, default=50, help='模拟服务的平均响应延迟（毫秒）')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='模拟服务返回 500 的比例')
+    arg_parser.add_argument('--retry-delay', type=float, default=1,
+                            help='失败任务第一次重试的等待秒数，默认的 RETRY_BASE_DELAY 会让队列很久才清空')
+    arg_parser.add_argument('--depth', type=int, default=3, help='每个列表的页数')
+    arg_parser.add_argument('--page-size', type=int, default=10, help='每页的记录数')
+    arg_parser.add_argument('--users', type=int, default=1000, help='模拟的用户总数')
+    arg_parser.add_argument('--timeout', type=float, default=600, help='最多运行多少秒')
+    arg_parser.add_argument('--save', help='把结果保存为 json')
+    args = arg_parser.parse_args()
+    args.types = [t for t in args.types.split(',') if t]
+    unknown = [t for t in args.types if t not in TYPE_ARGS]
+    if unknown:
+        arg_parser.error('unknown job types: %s' % ','.join(unknown))
+    if args.redis.rstrip('/') == PRODUCTION_REDIS:
+        arg_parser.error('refusing to flush %s, use a separate redis for benchmarks' % PRODUCTION_REDIS)
+
+    redis_process = None
+    if args.spawn_redis:
+        redis_process = spawn_redis(int(args.redis.rsplit(':', 1)[1].split('/')[0]))
+    loop = asyncio.get_event_loop()
+    try:
+        result = loop.run_until_complete(run(args, loop))
+    finally:
+        if redis_process is not None:
+            redis_process.terminate()
+            redis_process.wait()
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    return 0 if result['drained'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
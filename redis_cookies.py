@@ -3,14 +3,18 @@ import redis
 import json
 import datetime
 from login import WeiboLogin
-from setting import LOGGER, ACCOUNTS
+from setting import LOGGER, ACCOUNTS, JOB_FETCH_TIMEOUT
 import traceback
+import sys
 from pybloom import ScalableBloomFilter
+from aio.weibo_job_codec import JobCodec
 
 
 class RedisJob(object):
     redis_pool = redis.ConnectionPool(host='localhost', port=6378, db=1)
     url_filter = ScalableBloomFilter(mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+    # 异步爬虫写入的任务可能是紧凑编码，读取时 json 和紧凑编码都支持
+    codec = JobCodec()
 
     @classmethod
     def push_job(cls, job_type, job_info):
@@ -31,13 +35,39 @@ class RedisJob(object):
     @classmethod
     def fetch_job(cls, job_type):
         r = redis.Redis(connection_pool=cls.redis_pool)
-        job_info = r.lpop(job_type)
-        if job_info:
+        job = r.lpop(job_type)
+        if job:
+            job_info = cls.codec.decode(job)
             LOGGER.info('fetched job: %s' % job_info)
-            return json.loads(job_info)
+            return job_info
         else:
             return None
 
+    @classmethod
+    def fetch_job_blocking(cls, job_types, timeout=JOB_FETCH_TIMEOUT):
+        """
+        阻塞地从多个队列中取任务（BLPOP），所有队列都为空时最多等待 timeout 秒
+        :return: (job_type, job_info)，超时返回 (None, None)
+        """
+        r = redis.Redis(connection_pool=cls.redis_pool)
+        result = r.blpop(job_types, timeout=timeout)
+        if result:
+            job_type, job = result
+            job_info = cls.codec.decode(job)
+            LOGGER.info('fetched job: %s' % job_info)
+            return job_type.decode('utf-8'), job_info
+        return None, None
+
+    @classmethod
+    def jobs(cls, *job_types, timeout=JOB_FETCH_TIMEOUT):
+        """
+        任务迭代器，队列为空时阻塞在 redis 上而不是空转
+        """
+        while True:
+            job_type, job_info = cls.fetch_job_blocking(list(job_types), timeout)
+            if job_info:
+                yield job_type, job_info
+
 
 class RedisCookies(object):
     redis_pool = redis.ConnectionPool(host='localhost', port=6378, db=0)
@@ -54,6 +84,11 @@ class RedisCookies(object):
         r = redis.Redis(connection_pool=cls.redis_pool)
         r.hset('account', user_name, pickled_cookies)
         cls.user_in_queue(user_name)
+        # 重新登录过的账号清除下线标记和冷却记录
+        r.srem('account:relogin', user_name)
+        r.hdel('account:strikes', user_name)
+        # 通知各个节点的进程内 cookie 池重新加载
+        r.publish('account:invalidate', user_name)
 
     @classmethod
     def user_in_queue(cls, user_name):
@@ -70,6 +105,14 @@ class RedisCookies(object):
             LOGGER.info('user in queue: %s' % user_name)
             r.sadd("users", user_name)
 
+    @classmethod
+    def relogin_users(cls):
+        """
+        被爬虫标记为 cookie 失效或者多次冷却后下线、需要重新登录的账号
+        """
+        r = redis.Redis(connection_pool=cls.redis_pool)
+        return set(user.decode('utf-8') for user in r.smembers('account:relogin'))
+
     @classmethod
     def fetch_cookies(cls):
         # LOGGER.info('get cookies from reids')
@@ -93,12 +136,21 @@ class RedisCookies(object):
         r.delete('account')
 
 
-def main():
+def main(relogin_only=False):
+    """
+    登录所有账号并保存 cookies
+    :param relogin_only: 只重新登录被爬虫下线的账号
+    """
     # RedisCookies.clean()
     weiboLogin = WeiboLogin()
     success = []
     failed = []
-    for account in ACCOUNTS:
+    accounts = ACCOUNTS
+    if relogin_only:
+        relogin_users = RedisCookies.relogin_users()
+        accounts = [account for account in ACCOUNTS if account['user'] in relogin_users]
+        LOGGER.info('%d accounts need relogin' % len(accounts))
+    for account in accounts:
         try:
             LOGGER.info('get cookies for %s' % str(account))
             cookies = weiboLogin.login_by_selenium(account['user'], account['password'])
@@ -116,4 +168,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    main(relogin_only='relogin' in sys.argv[1:])
@@ -7,6 +7,155 @@ import os
 # 多线程线程数
 THREAD_NUM = 2
 
+# worker 方式：pool 所有任务类型共用一个按权重取任务、自动扩缩容的 worker 池，fixed 每种任务固定 tasks 个协程
+WORKER_MODE = 'pool'
+# worker 池的最小、最大 worker 数
+WORKER_MIN = 4
+WORKER_MAX = 64
+# 各个队列的权重，越大越优先，实际优先级还会随队列积压增加
+WORKER_WEIGHTS = {'comment': 3, 'repost': 2, 'tweet': 2, 'user': 1, 'follower': 1, 'search': 1}
+# 检查队列长度、调整 worker 数量的间隔（秒）
+WORKER_SCALE_INTERVAL = 5
+# worker 池单次 BRPOP 的超时时间（秒），超时后重新排列队列顺序
+WORKER_FETCH_TIMEOUT = 1
+
+# start.py 的爬虫进程数，大于 1 时主进程只负责启动、重启子进程和汇总统计
+PROCESSES = 1
+# 子进程使用 uvloop 事件循环（需要安装 uvloop，没有安装时使用默认的事件循环）
+USE_UVLOOP = False
+# 子进程异常退出后重启的等待时间（秒），连续崩溃时加倍，最多 RESTART_BACKOFF_MAX 秒
+RESTART_BACKOFF = 1
+# 子进程运行超过这个时间（秒）后再退出，重启等待时间从 RESTART_BACKOFF 重新开始
+RESTART_BACKOFF_MAX = 60
+# 收到 SIGTERM/SIGINT 后等待处理中的任务完成的最长时间（秒）
+DRAIN_TIMEOUT = 30
+# 子进程上报、主进程打印汇总统计的间隔（秒）
+STATS_INTERVAL = 60
+
+# 任务在 redis 中的编码：compact 只保存任务种类、id、页码等字段，url 取出时按模板拼出，json 为原来的格式。
+# aio 爬虫和 redis_cookies.RedisJob（weibo_cn.py）读取时两种格式都支持，可以随时切换
+JOB_CODEC = 'json'
+
+# 队列为空时阻塞取任务的超时时间（秒）
+JOB_FETCH_TIMEOUT = 5
+
+# 可靠队列：取任务时原子地放入本 worker 的处理中列表并加租约，处理完 ack 才删除，
+# 租约过期（worker 崩溃或被杀）的任务由 reaper 放回队列
+JOB_RELIABLE = False
+# 租约时长（秒）
+JOB_VISIBILITY_TIMEOUT = 10 * 60
+# 可靠队列为空时轮询的间隔（秒）
+JOB_POLL_INTERVAL = 1
+# 检查过期租约的间隔（秒）
+JOB_REAP_INTERVAL = 30
+
+# 分页方式：eager 解析第一页后一次放入所有分页任务，cursor 每个资源只有一个任务，处理完一页再放入下一页，
+# 进度保存在 redis 的 cursor:<任务类型> hash 中
+PAGINATION = 'eager'
+# cursor 模式下增量抓取用户微博：每个用户记录抓到的最新微博，再次抓取时翻到已经抓过的微博就停止
+TIMELINE_INCREMENTAL = False
+# 游标多久（秒）没有推进认为任务丢失，按检查点重新放回队列
+CURSOR_STALE_TIMEOUT = 60 * 60
+# 检查丢失游标的间隔（秒）
+CURSOR_RESUME_INTERVAL = 5 * 60
+
+# 定时重新抓取（python -m aio.weibo_scheduler watch <uid>）：用户和微博评论的初始间隔（秒），
+# 有新内容时间隔减半，没有时加倍，限制在最小、最大间隔之间
+SCHEDULE_USER_INTERVAL = 6 * 60 * 60
+SCHEDULE_TWEET_INTERVAL = 30 * 60
+SCHEDULE_MIN_INTERVAL = 10 * 60
+SCHEDULE_MAX_INTERVAL = 7 * 24 * 60 * 60
+# 关注用户发布的微博在多久（秒）内定时重新抓取评论
+SCHEDULE_TWEET_HORIZON = 3 * 24 * 60 * 60
+# 检查到期任务的间隔（秒）
+SCHEDULE_RELEASE_INTERVAL = 10
+
+# 去重过滤器：local 每个进程一个内存布隆过滤器，redis 整个集群共用 redis 中的布隆过滤器
+DEDUP_BACKEND = 'local'
+# redis 布隆过滤器的容量和误判率，决定 bitmap 大小
+DEDUP_CAPACITY = 20000000
+DEDUP_ERROR_RATE = 0.001
+
+# 失败任务重试：第 n 次重试等待 RETRY_BASE_DELAY * 2^n 秒（带随机抖动），最多等待 RETRY_MAX_DELAY 秒
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 60 * 60
+# 超过最大重试次数的任务放入死信队列
+RETRY_MAX_ATTEMPTS = 5
+# 检查到期重试任务的间隔（秒）
+RETRY_MOVE_INTERVAL = 5
+
+# kafka 发送方式：sync 每条记录同步发送，batch 在内存中攒批后异步发送
+KAFKA_SINK = 'batch'
+# 批量发送：每批最多多少条记录
+KAFKA_BATCH_SIZE = 500
+# 批量发送：攒批最多等待多久（毫秒）
+KAFKA_LINGER_MS = 200
+# 批量发送：内存中最多缓存多少条记录，满了以后 send 会等待
+KAFKA_BUFFER_SIZE = 10000
+# 压缩方式：None, gzip, snappy, lz4
+KAFKA_COMPRESSION = 'gzip'
+
+# cookie 池：redis 每次请求都从 redis 取账号，local 启动时加载全部账号到进程内
+COOKIE_POOL = 'redis'
+# 进程内 cookie 池分配账号的方式：round_robin 轮询，lru 最久未使用的优先
+COOKIE_POOL_STRATEGY = 'round_robin'
+# 进程内 cookie 池从 redis 刷新的间隔（秒），收到失效通知时会立即刷新
+COOKIE_POOL_REFRESH_INTERVAL = 5 * 60
+
+# 每个账号每分钟最多请求次数（令牌桶），0 表示不限速，只在 COOKIE_POOL 为 local 时生效
+ACCOUNT_REQUESTS_PER_MINUTE = 0
+# 令牌桶容量，允许的突发请求数
+ACCOUNT_BURST = 2
+
+# 账号健康度：每次请求结果按 ACCOUNT_HEALTH_ALPHA 做指数平均，低于阈值进入冷却
+ACCOUNT_HEALTH_ALPHA = 0.2
+ACCOUNT_HEALTH_THRESHOLD = 0.5
+# 第 n 次冷却时长为 ACCOUNT_COOLDOWN * 2^(n-1) 秒
+ACCOUNT_COOLDOWN = 10 * 60
+# 冷却次数达到上限的账号下线，等待 redis_cookies.py 重新登录
+ACCOUNT_MAX_STRIKES = 3
+# 检查冷却结束账号的间隔（秒）
+ACCOUNT_RELEASE_INTERVAL = 30
+# 所有账号都在冷却或下线时，每隔 ACCOUNT_WAIT_INTERVAL 秒检查一次有没有账号放回，
+# 超过 ACCOUNT_WAIT_TIMEOUT 秒任务放回重试队列，不计重试次数
+ACCOUNT_WAIT_INTERVAL = 5
+ACCOUNT_WAIT_TIMEOUT = 60
+
+# 解析页面的进程数，0 表示在事件循环线程内解析
+PARSER_PROCESSES = 0
+# 解析后端：lxml 直接解析响应的 bytes，bs4 为原来的 BeautifulSoup 实现，两者结果一致（python -m aio.parser_parity 检查）
+PARSER_BACKEND = 'bs4'
+
+# 个人主页到 uid 的缓存：进程内 LRU 的大小，以及主页上没有 uid 时缓存多久（秒）后重新下载
+HOMEPAGE_CACHE_SIZE = 50000
+HOMEPAGE_NEGATIVE_TTL = 24 * 60 * 60
+
+# 一个页面中同时处理的行数（下载个人主页取 uid、放入 redis）
+ROW_CONCURRENCY = 5
+
+# 合并同一 url 的并发下载，只发一次请求
+FETCH_COALESCE = True
+# 下载结果在内存中缓存的时间（秒），0 表示只合并正在进行的请求、不缓存
+FETCH_CACHE_TTL = 0
+# 最多缓存的页面数
+FETCH_CACHE_SIZE = 1000
+
+# 页面归档目录，None 表示不归档；归档后可以用 python -m aio.weibo_archive 离线重新解析
+ARCHIVE_PATH = None
+# 每个分段文件的大小上限（字节），写满后新建分段
+ARCHIVE_SEGMENT_SIZE = 256 * 1024 * 1024
+# zlib 压缩级别
+ARCHIVE_COMPRESS_LEVEL = 6
+
+# 每个账号一个长连接 session，最多缓存的 session 数
+SESSION_POOL_SIZE = 200
+# 每个 session 对同一 host 的最大连接数
+SESSION_LIMIT_PER_HOST = 4
+# keep-alive 连接空闲多久后关闭（秒）
+SESSION_KEEPALIVE_TIMEOUT = 60
+# DNS 缓存时间（秒）
+SESSION_DNS_TTL = 10 * 60
+
 
 def logger_conf():
     """
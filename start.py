@@ -1,7 +1,17 @@
-import sys
-from aio.weibo_cn_async import WeiboCnSpider
+import argparse
+
+from aio.weibo_supervisor import Supervisor, run_spider
+from setting import PROCESSES, USE_UVLOOP
 
 if __name__ == '__main__':
-    args = sys.argv[1:]
+    parser = argparse.ArgumentParser(description='weibo.cn spider')
+    parser.add_argument('jobs', nargs='*', help='任务类型：u 用户信息，w 微博，f 关注，c 评论，r 转发，s 搜索')
+    parser.add_argument('-p', '--processes', type=int, default=PROCESSES, help='爬虫进程数，大于 1 时启动多个子进程')
+    parser.add_argument('-t', '--tasks', type=int, default=4, help='每个进程中每种任务的协程数')
+    parser.add_argument('--uvloop', action='store_true', default=USE_UVLOOP, help='使用 uvloop 事件循环')
+    args = parser.parse_args()
 
-    WeiboCnSpider(tasks=4).start(args)
+    if args.processes > 1:
+        Supervisor(args.jobs, args.processes, tasks=args.tasks, uvloop=args.uvloop).run()
+    else:
+        run_spider(args.jobs, args.tasks, args.uvloop)
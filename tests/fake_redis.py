@@ -0,0 +1,67 @@
+# -*- coding:utf-8 -*-
+"""
+测试用的 aioredis 连接池：只记录命令，支持 AccountHealth、RedisJob 等用到的少数几个命令
+"""
+from collections import defaultdict
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.commands = []
+        self.hashes = defaultdict(dict)
+        self.closed = False
+
+    async def execute(self, command, *args):
+        self.commands.append((command,) + args)
+        if command == 'hincrby':
+            key, field, amount = args
+            self.hashes[key][field] = self.hashes[key].get(field, 0) + amount
+            return self.hashes[key][field]
+        if command == 'hset':
+            key, field, value = args
+            self.hashes[key][field] = value.encode('utf-8') if isinstance(value, str) else value
+            return 1
+        if command == 'hget':
+            key, field = args
+            return self.hashes[key].get(field)
+        if command == 'hdel':
+            key, field = args
+            return 1 if self.hashes[key].pop(field, None) is not None else 0
+        return 1
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+class FakePool(object):
+    """
+    with await pool as conn 的用法和 aioredis 1.x 的连接池一致
+    """
+
+    def __init__(self):
+        self.conn = FakeConnection()
+        self.closed = False
+
+    def __await__(self):
+        if False:
+            yield
+        return self
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+    def names(self):
+        return [command[0] for command in self.conn.commands]
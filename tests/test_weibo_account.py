@@ -0,0 +1,64 @@
+# -*- coding:utf-8 -*-
+import asyncio
+
+import pytest
+
+from aio.weibo_account import AccountHealth, NoAccountError, Outcome, wait_for_cookies
+from tests.fake_redis import FakePool
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+def test_cool_down_below_threshold():
+    health = AccountHealth(alpha=0.5, threshold=0.3, cooldown=60, max_strikes=3)
+    health._pool = FakePool()
+
+    async def fail_twice():
+        first = await health.report('bench0', Outcome.error)
+        second = await health.report('bench0', Outcome.error)
+        return first, second
+
+    # 1.0 -> 0.5 -> 0.25，第二次低于阈值
+    assert run(fail_twice()) == ('ok', 'cooldown')
+    assert 'bench0' not in health.scores
+    assert {'hincrby', 'zadd', 'srem', 'publish'} <= set(health._pool.names())
+
+
+def test_retire_after_max_strikes():
+    health = AccountHealth(alpha=0.5, threshold=0.3, cooldown=0, max_strikes=1)
+    health._pool = FakePool()
+
+    async def fail_twice():
+        await health.report('bench0', Outcome.error)
+        return await health.report('bench0', Outcome.error)
+
+    assert run(fail_twice()) == 'retired'
+    assert 'sadd' in health._pool.names()
+
+
+class EmptyPool(object):
+    """
+    前 empty 次取不到账号
+    """
+
+    def __init__(self, empty):
+        self.empty = empty
+        self.calls = 0
+
+    async def fetch_cookies(self):
+        self.calls += 1
+        return None if self.calls <= self.empty else {'user_name': 'bench0', 'cookies': {}}
+
+
+def test_wait_for_cookies_until_released():
+    pool = EmptyPool(2)
+    cookies = run(wait_for_cookies(pool, interval=0.01, timeout=1))
+    assert cookies['user_name'] == 'bench0'
+    assert pool.calls == 3
+
+
+def test_wait_for_cookies_timeout():
+    with pytest.raises(NoAccountError):
+        run(wait_for_cookies(EmptyPool(100), interval=0.01, timeout=0.03))
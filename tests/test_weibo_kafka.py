@@ -0,0 +1,57 @@
+# -*- coding:utf-8 -*-
+import asyncio
+
+from aio.weibo_kafka import BatchProducer
+
+
+class FakeFuture(object):
+    def __init__(self, error=None):
+        self.error = error
+
+    def get(self, timeout=None):
+        if self.error:
+            raise self.error
+
+
+class FakeTransport(object):
+    """
+    假的 kafka producer，value 里带 fail 的记录发送失败
+    """
+    def __init__(self):
+        self.records = []
+
+    def send(self, topic, value=None):
+        if value.get('fail'):
+            return FakeFuture(RuntimeError('broker down'))
+        self.records.append(value)
+        return FakeFuture()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_send_reports_failed_records():
+    loop = asyncio.new_event_loop()
+    transport = FakeTransport()
+    errors = []
+    producer = BatchProducer([], 'sinaweibo', loop=loop, transport=transport, batch_size=10, linger_ms=10,
+                             on_error=lambda records, exc: errors.append((records, exc)))
+
+    async def send_all():
+        futures = []
+        for i in range(4):
+            futures.append(await producer.send({'id': i, 'fail': i % 2 == 1}, 'url'))
+        results = await asyncio.gather(*futures)
+        await producer.close()
+        return results
+
+    results = loop.run_until_complete(send_all())
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], RuntimeError) and isinstance(results[3], RuntimeError)
+    assert [record['id'] for record in transport.records] == [0, 2]
+    assert len(errors) == 2
+    assert [records[0]['id'] for records, _ in errors] == [1, 3]
+    assert producer.stats() == {'sent': 2, 'failed': 2, 'batches': 1}
@@ -0,0 +1,60 @@
+# -*- coding:utf-8 -*-
+import asyncio
+
+from aio.weibo_redis import PageCursor, RedisJob
+from setting import RETRY_MAX_ATTEMPTS
+from tests.fake_redis import FakeConnection, FakePool
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+class FakeFilter(object):
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def test_close_releases_pool_connections_and_filter():
+    redis_job = RedisJob(reliable=True)
+    redis_job._pool = pool = FakePool()
+    redis_job.url_filter = FakeFilter()
+    released, leaked = FakeConnection(), FakeConnection()
+    redis_job._connections.update([released, leaked])
+
+    async def close():
+        await redis_job.disconnect(released)
+        await redis_job.close()
+
+    run(close())
+    assert pool.closed and redis_job._pool is None
+    assert released.closed and leaked.closed
+    assert not redis_job._connections
+    assert redis_job.url_filter.closed
+
+
+def test_retry_job_gives_up_after_max_attempts():
+    redis_job = RedisJob()
+    redis_job._pool = pool = FakePool()
+    job_info = {'uid': '123', 'page': 3, 'max_page': 10, 'retry': RETRY_MAX_ATTEMPTS}
+
+    assert run(redis_job.retry_job('tweet', dict(job_info, retry=0))) is True
+    assert run(redis_job.retry_job('tweet', job_info)) is False
+    assert pool.names() == ['zadd', 'lpush']
+
+
+def test_abandon_cursor_only_at_same_page():
+    page_cursor = PageCursor()
+    page_cursor._pool = pool = FakePool()
+
+    async def abandon(page):
+        await page_cursor.save('tweet', '123', {'page': 3, 'max_page': 10})
+        await page_cursor.abandon('tweet', '123', page)
+        return await page_cursor.get('tweet', '123')
+
+    # 过期的重复任务不删除检查点
+    assert run(abandon(2))['page'] == 3
+    assert run(abandon(3)) is None
+    assert 'hdel' in pool.names()
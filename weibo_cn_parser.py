@@ -0,0 +1,275 @@
+# -*- coding:utf-8 -*-
+"""
+weibo_cn.py 中各个 grab_* 的页面解析部分，不访问网络、redis 和 kafka，可以单独运行（benchmark.parser_bench）。
+需要下载个人主页才能拿到的 uid 用 weibo_parser.HomePage(完整 url) 表示，由 WeiboCnSpider.resolve_user_id 解析
+"""
+import datetime
+import re
+
+from bs4 import BeautifulSoup
+
+from aio import weibo_parser, weibo_tweet
+
+WEIBO_HOST = 'https://weibo.cn'
+
+time_current_pattern = re.compile(r'(\d*)分钟前')
+time_today_pattern = re.compile(r'今天\s*(\d*):(\d*)')
+time_year_pattern = re.compile(r'(\d*)月(\d*)日\s*(\d*):(\d*)')
+user_id_pattern = re.compile(r'https://weibo.cn/u/(\d*)')
+
+def get_time(time_str):
+    current_result = time_current_pattern.findall(time_str)
+    time_now = datetime.datetime.now()
+    if current_result:
+        result_time = time_now - datetime.timedelta(minutes=int(current_result[0]))
+        return result_time.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        current_result = time_today_pattern.findall(time_str)
+        if current_result:
+            result_time = datetime.datetime(time_now.year, time_now.month,
+                                            time_now.day, int(current_result[0][0]), int(current_result[0][0]))
+            return result_time.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            current_result = time_year_pattern.findall(time_str)
+            if current_result:
+                result_time = datetime.datetime(time_now.year, int(current_result[0][0]),
+                                                int(current_result[0][1]), int(current_result[0][2]),
+                                                int(current_result[0][3]))
+                return result_time.strftime('%Y-%m-%d %H:%M:%S')
+            else:
+                return time_str
+
+
+def href_user_id(user_href):
+    """
+    评论、转发、微博作者的链接：/u/<uid> 直接取 uid，个性域名需要下载个人主页
+    """
+    if user_href.startswith('/u/'):
+        return user_href[3:]
+    return weibo_parser.HomePage(WEIBO_HOST + user_href)
+
+
+def parse_view(html_content):
+    """
+    个人主页中的微博数、粉丝数、关注数
+    """
+    home_page_html = BeautifulSoup(html_content, "lxml")
+    v = home_page_html.find('div', class_='tip2')
+    result = {}
+    if v:
+        content = v.get_text(';')
+    else:
+        content = ''
+    tweet_r = re.findall('微博\[(\d+)\];', content)
+    result['tweetNum'] = tweet_r[0] if tweet_r else -1
+    fans_r = re.findall('粉丝\[(\d+)\];', content)
+    result['fansNum'] = fans_r[0] if fans_r else -1
+    follow_r = re.findall('关注\[(\d+)\];', content)
+    result['followNum'] = follow_r[0] if follow_r else -1
+    return result
+
+
+def parse_home_page_user_id(html_content):
+    """
+    :return: 个人主页中 “资料” 链接里的 uid，没有返回 0
+    """
+    home_page_html = BeautifulSoup(html_content, "lxml")
+    info_a = home_page_html.find('a', string='资料')
+    if info_a:
+        return info_a.get('href').split('/')[1]
+    return 0
+
+
+def parse_repost(html_content, tweet_id, first_page=False):
+    """
+    转发列表页
+    :return: {'tweets': [转发的微博], 'max_page': 第一页的总页数}
+    """
+    repost_html = BeautifulSoup(html_content, "lxml")
+    tweets = []
+    reposts = repost_html.find_all('div', class_='c')
+    for repost in reposts:
+        tweet_info = {}
+
+        attr_span = repost.find('span', class_='cc')
+        if attr_span:
+            attitude_url = attr_span.extract().find('a').get('href')
+            tweet_info['id'] = attitude_url.split('/')[2]
+        else:
+            continue
+
+        time_tool_text = repost.find('span', class_='ct').extract().get_text()
+        time_tool = time_tool_text.split('\u6765\u81ea')
+        tweet_info['time'] = get_time(time_tool[0])
+        if len(time_tool) == 2:
+            source = time_tool[1]
+            tweet_info['source'] = source
+        tweet_info['flag'] = '转发'
+        tweet_info['uid'] = href_user_id(repost.find('a').get('href'))
+        tweet_content = repost.get_text()
+        tweet_info['content'] = tweet_content
+        tweet_info['sourceTid'] = tweet_id
+        tweet_info['type'] = 'tweet_info'
+        tweets.append(tweet_info)
+    return {'tweets': tweets, 'max_page': weibo_parser.parse_max_page(repost_html) if first_page else None}
+
+
+def parse_follow(html_content):
+    """
+    关注列表页
+    :return: {'users': [(uid 或 HomePage, 是否需要抓取)], 'max_page': 总页数}
+    """
+    follow_html = BeautifulSoup(html_content, "lxml")
+    users = []
+    all_td = follow_html.find_all('td', style=True)
+    for td in all_td:
+        a = td.find('a').get('href')
+        usr_id_result = user_id_pattern.findall(a)
+        if usr_id_result:
+            usr_id = usr_id_result[0]
+        else:
+            usr_id = weibo_parser.HomePage(a)
+        public_user = td.parent.find_all('img', src='https://h5.sinaimg.cn/upload/2016/05/26/319/5338.gif')
+        enterprise_user = None
+        if not public_user:
+            enterprise_user = td.parent.find_all('img', src='https://h5.sinaimg.cn/upload/2016/05/26/319/5337.gif')
+        users.append((usr_id, not public_user and not enterprise_user))
+    return {'users': users, 'max_page': weibo_parser.parse_max_page(follow_html)}
+
+
+def parse_comments(html_content, tweet_id, first_page=False):
+    """
+    评论列表页
+    :param first_page: 第一页还要解析顶部的微博和总页数
+    :return: {'comments': [评论], 'tweet': 顶部的微博, 'max_page': 总页数}
+    """
+    comment_html = BeautifulSoup(html_content, "lxml")
+    comments = []
+    comment_divs = comment_html.find_all(id=re.compile('C_[\d]'), class_='c')
+    for comment_div in comment_divs:
+        comment_info = {}
+        comment_id = comment_div.get('id')
+        user_a = comment_div.find('a')
+        if user_a:
+            comment_info['userId'] = href_user_id(user_a.get('href'))
+            comment_info['content'] = comment_div.find(class_='ctt').get_text()
+            others = comment_div.find(class_='ct').get_text()
+            if others:
+                others = others.split('\u6765\u81ea')
+                comment_info['pubTime'] = get_time(others[0])
+                if len(others) == 2:
+                    comment_info['source'] = others[1]
+            comment_info['id'] = comment_id
+            comment_info['tweetId'] = tweet_id
+            comment_info['type'] = 'comment_info'
+            comments.append(comment_info)
+    result = {'comments': comments, 'tweet': None, 'max_page': None}
+    if not first_page:
+        return result
+
+    tweet_div = comment_html.find(id='M_', class_='c')
+    if tweet_div:
+        tweet_user_a = tweet_div.find('a')
+        flag = False
+        if tweet_user_a:
+            tweet = {}
+            tweet_user_id = href_user_id(tweet_user_a.get('href'))
+            if tweet_div.find(class_='cmt', string='转发理由:'):
+                flag = True
+            else:
+                tweet_content = tweet_div.find('span', class_='ctt').get_text()
+                tweet['content'] = tweet_content
+            tweet_details = list(
+                filter(lambda div: div.find(class_='pms'),
+                       comment_html.find_all('div', id=False, class_=False)))
+            detail = tweet_details[0].get_text(';').replace('\xa0', '')
+            like, transfer, comment = weibo_tweet.parse_counts(detail, 0)
+            tweet['id'] = tweet_id
+            tweet['like'] = like
+            tweet['transfer'] = transfer
+            tweet['comment'] = comment
+            tweet['type'] = 'tweet_info'
+            if not flag:
+                others = tweet_div.find(class_='ct').get_text()
+                if others:
+                    others = others.split('\u6765\u81ea')
+                    tweet['time'] = get_time(others[0])
+                    if len(others) == 2:
+                        tweet['source'] = others[1]
+                tweet['uid'] = tweet_user_id
+            result['tweet'] = tweet
+    result['max_page'] = weibo_parser.parse_max_page(comment_html)
+    return result
+
+
+def parse_user_tweet(html_content, uid):
+    """
+    用户微博列表页
+    :return: {'tweets': [微博], 'max_page': 总页数}
+    """
+    user_tweet_html = BeautifulSoup(html_content, "lxml")
+    tweets = []
+    tweet_divs = user_tweet_html.find_all(id=True, class_='c')
+    for tweet_div in tweet_divs:
+        tweets.append(weibo_tweet.to_record(weibo_parser.extract_tweet(tweet_div), tweet_div.get('id'), uid,
+                                            raw=True))
+    return {'tweets': tweets, 'max_page': weibo_parser.parse_max_page(user_tweet_html)}
+
+
+def parse_user_info(html_content, user_id):
+    """
+    资料页，不含个人主页中的微博数等
+    :return: 用户资料，没有昵称时为空 dict
+    """
+    user_info_html = BeautifulSoup(html_content, "lxml")
+    div_list = list(user_info_html.find_all(class_=['c', 'tip']))
+
+    base_info_index, edu_info_index, work_info_index = -1, -1, -1
+    base_info = ''
+    edu_info = ''
+    work_info = ''
+    tags = ''
+    user_info = {}
+    for index, div in enumerate(div_list):
+        text = div.text
+        if text == u'基本信息':
+            base_info_index = index
+        elif text == u'学习经历':
+            edu_info_index = index
+        elif text == u'工作经历':
+            work_info_index = index
+    if base_info_index != -1:
+        b = div_list[base_info_index + 1]
+        tags = ','.join(map(lambda a: a.get_text(), b.find_all('a')))
+        base_info = b.get_text(';')
+    if edu_info_index != -1:
+        edu_info = div_list[edu_info_index + 1].get_text(';')
+
+    if work_info_index != -1:
+        work_info = div_list[work_info_index + 1].get_text(';')
+
+    nickname = re.findall(u'\u6635\u79f0[:|\uff1a](.*?);', base_info)  # 昵称
+    if nickname:
+        user_info['nickname'] = nickname[0] if nickname else 'unknown'
+        gender = re.findall(u'\u6027\u522b[:|\uff1a](.*?);', base_info)  # 性别
+        place = re.findall(u'\u5730\u533a[:|\uff1a](.*?);', base_info)  # 地区（包括省份和城市）
+        signature = re.findall(u'\u7b80\u4ecb[:|\uff1a](.*?);', base_info)  # 个性签名
+        birthday = re.findall(u'\u751f\u65e5[:|\uff1a](.*?);', base_info)  # 生日
+        sex_orientation = re.findall(u'\u6027\u53d6\u5411[:|\uff1a](.*?);', base_info)  # 性取向
+        marriage = re.findall(u'\u611f\u60c5\u72b6\u51b5[:|\uff1a](.*?);', base_info)  # 婚姻状况
+        head_url = user_info_html.find('img', alt='头像')
+        if head_url:
+            user_info['head'] = head_url.get('src')
+        user_info['tags'] = tags
+        user_info['gender'] = gender[0] if gender else 'unknown'
+        user_info['place'] = place[0] if place else 'unknown'
+        user_info['signature'] = signature[0] if signature else 'unknown'
+        user_info['birthday'] = birthday[0] if birthday else 'unknown'
+        user_info['sexOrientation'] = sex_orientation[0] if sex_orientation else 'unknown'
+        user_info['eduInfo'] = edu_info if edu_info else 'unknown'
+        user_info['marriage'] = marriage[0] if marriage else 'unknown'
+        user_info['workInfo'] = work_info if work_info else 'unknown'
+
+        user_info['type'] = 'user_info'
+        user_info['id'] = user_id
+    return user_info